@@ -15,6 +15,8 @@ const statusCheckFreq = 300000;
 const reconnectTimer = 600000;
 // Length of time a processor has to confirm it received a process request
 const processTimer = 60000;
+// Length of time (in ms) over which status changes are coalesced into one GUI update
+const broadcastFreq = 1000;
 // List of processor nodes currently active
 var processorNodes = {};
 // List of timeouts from disconnects - we can't store in the above since they don't serialize
@@ -23,8 +25,12 @@ var timeouts = {};
 var analyzerNodes = [];
 // Completed videos and their output files
 var completed = {};
-// Sent requests, pending acknowledgment from processor, and their timeouts
+// Sent batches of videos, pending acknowledgment from processor, and their timeouts
 var pending = {};
+// Batch ID - we just count up
+var nextBatchId = 0;
+// Timeout of the next scheduled GUI update, if any
+var broadcastTimeout = null;
 // Number of analyzer nodes to create
 var numAnalyzer = 2;
 // Number of processor ndoes
@@ -227,10 +233,20 @@ function getGuiInfo() {
     });
 }
 
+// Every message from a processor changes the status, so updates are coalesced
+// rather than serializing every processor's state once per message
 function broadcastStatus() {
-    guiWws.clients.forEach((client) => {
-        client.send(getGuiInfo());
-    });
+    if (broadcastTimeout != null)
+        return;
+    broadcastTimeout = setTimeout(function() {
+        broadcastTimeout = null;
+        if (guiWws.clients.size == 0)
+            return;
+        var guiInfo = getGuiInfo();
+        guiWws.clients.forEach((client) => {
+            client.send(guiInfo);
+        });
+    }, broadcastFreq);
 }
 
 function startAnalyzer(node) {
@@ -296,7 +312,7 @@ function onSocketDisconnect(ws) {
 function onReconnectFail(id) {
     return function() {
         logger.debug("WS " + id + " failed to reconnect");
-        processorNodes[id].videos.forEach(function(video) {
+        processorNodes[id].videos.slice().forEach(function(video) {
             VideoManager.addVideo(video.path);
             removeVideoFromProcessor(id, video.path);
         });
@@ -343,7 +359,7 @@ function parseMessage(message, ws) {
     switch(msgObj.action) {
         case actionTypes.req_video:
             logger.info("Video requested by " + id);
-            sendNextVideo(ws);
+            sendNextVideo(ws, msgObj.count);
             break;
         case actionTypes.req_rec:
             logger.info("Confirm request received by " + id);
@@ -368,12 +384,15 @@ function parseMessage(message, ws) {
     broadcastStatus();
 }
 
-function sendNextVideo(ws) {
-    var nextVideoPath = VideoManager.nextVideo();
+// Processors that prefetch ask for count videos at once and receive them as
+// one batch with a single acknowledgment timeout; older processors ask for one
+// and receive it as a single path
+function sendNextVideo(ws, count) {
     var id = ws.id;
+    var nextVideoPaths = VideoManager.nextVideos((count == null) ? 1 : count);
     // If there is no 'next video', work may stop
     var requestMessage;
-    if (nextVideoPath == null) {
+    if (nextVideoPaths.length == 0) {
         logger.info("No videos remaining; telling " + id + " to cease requests");
         requestMessage = {
             action: actionTypes.cease_req,
@@ -382,47 +401,65 @@ function sendNextVideo(ws) {
         sendRequest(requestMessage, ws);
         return;
     }
-    logger.info("Sending video to " + id + ": " + nextVideoPath);
+    logger.info("Sending " + nextVideoPaths.length + " videos to " + id);
     var analyzer = getBalancedAnalyzer();
     var analyzerPath = "";
     if (analyzer != null) {
         analyzerPath = analyzer.path;
-        analyzer.numVideos++;
+        analyzer.numVideos += nextVideoPaths.length;
     }
 
-    var videoInfo = {
-        path: nextVideoPath,
-        analyzer: analyzerPath,
-        //time: getTime()
-    };
-    pending[nextVideoPath] = setTimeout(processTimeout(nextVideoPath, ws), processTimer);
-    processorNodes[id].videos.push(videoInfo);
+    var batchId = nextBatchId++;
+    for (var nextVideoPath of nextVideoPaths) {
+        var videoInfo = {
+            path: nextVideoPath,
+            analyzer: analyzerPath,
+            batch: batchId,
+            //time: getTime()
+        };
+        processorNodes[id].videos.push(videoInfo);
+    }
+    pending[batchId] = setTimeout(processTimeout(batchId, nextVideoPaths, ws), processTimer);
     // TODO validate path is real?
     requestMessage = {
         action: actionTypes.process,
-        analyzer: analyzerPath,
-        path: nextVideoPath
+        analyzer: analyzerPath
     };
+    if (count == null) {
+        requestMessage.path = nextVideoPaths[0];
+    } else {
+        requestMessage.batch = batchId;
+        requestMessage.paths = nextVideoPaths;
+    }
     sendRequest(requestMessage, ws);
 }
 
 function processReceived(msgObj, ws) {
-    logger.debug("Clearing timeout for " + msgObj.video);
-    clearTimeout(pending[msgObj.video]);
-    pending[msgObj.video] = null;
+    var batchId = msgObj.batch;
+    if (batchId == null) {
+        // Older processors confirm a single video by its path
+        var videoInfo = processorNodes[ws.id].videos.find((videoItem) => videoItem.path == msgObj.video);
+        if (videoInfo == null) {
+            logger.error("Node confirmed a video it was not assigned: " + ws.id);
+            return;
+        }
+        batchId = videoInfo.batch;
+    }
+    logger.debug("Clearing timeout for batch " + batchId);
+    clearTimeout(pending[batchId]);
+    delete pending[batchId];
 }
 
-function processTimeout(video, ws) {
+function processTimeout(batchId, videos, ws) {
     var id = ws.id;
     return function() {
-        // Processor did not acknoweldge receipt of video
-        // Remove video from processor
-        logger.info("Connection " + id + " did not verify receipt of request to process " + video);
-        removeVideoFromProcessor(id, video);
-        // Return it to the queue, and clean up the pending request
-        VideoManager.addVideo(video);
+        // Processor did not acknoweldge receipt of the batch
+        logger.info("Connection " + id + " did not verify receipt of request to process batch " + batchId);
+        // Remove the videos it still holds from the processor, and return them to the queue
+        var unconfirmed = videos.filter((video) => removeVideoFromProcessor(id, video));
+        VideoManager.addVideos(unconfirmed);
         broadcastStatus();
-        pending[video] = null;
+        delete pending[batchId];
     };
 }
 
@@ -433,28 +470,36 @@ function processStatusReport(msg, ws) {
     delete processorNodes[id].statusRequested;
 }
 
+// Processors that batch report every video completed since their last report
+// in one message, as a list of {video, output} objects
 function processTaskComplete(msgObj, ws) {
     var id = ws.id;
-    var video = msgObj.video;
-    if (video == null) {
-        logger.error("Completed video not specified by " + id);
-        return;
+    var completions = msgObj.videos;
+    if (completions == null)
+        completions = [{video: msgObj.video, output: msgObj.output}];
+    for (var completion of completions) {
+        var video = completion.video;
+        if (video == null) {
+            logger.error("Completed video not specified by " + id);
+            continue;
+        }
+        removeVideoFromProcessor(id, video);
+        var outputPath = completion.output;
+        if (outputPath == null)
+            outputPath = "Not Reported";
+        completed[video] = outputPath;
     }
-    removeVideoFromProcessor(id, video);
-    var outputPath = msgObj.output;
-    if (outputPath == null)
-        outputPath = "Not Reported";
-    completed[video] = outputPath;
     checkProcessorComplete(ws);
 }
 
+// Returns whether the video was assigned to the processor
 function removeVideoFromProcessor(id, video) {
     var index = processorNodes[id].videos.findIndex((videoItem) => videoItem.path == video);
     if (index == -1) {
         // Video path not assigned to this ws
         logger.error("Node reported on video it was not assigned: " + id);
         // TODO Handle malformed input
-        return;
+        return false;
     }
     var analyzerPath = processorNodes[id].videos[index].analyzer;
     // Decrement our video counter
@@ -466,6 +511,7 @@ function removeVideoFromProcessor(id, video) {
     }
     //logger.info("%s processed video %s in %d ms", ip, video, getTime() - processorNodes[id].videos[index].time);
     processorNodes[id].videos.splice(index, 1);
+    return true;
 }
 
 function checkProcessorComplete(ws) {
@@ -0,0 +1,140 @@
+// Measure how fast the control node dispatches videos to many processors.
+//
+// Starts a control node on a generated list of fake video paths, connects a
+// number of simulated processors that confirm and complete every video as
+// soon as it is assigned, and reports the number of videos dispatched per
+// second. Run from the ControlNode directory, e.g.
+//
+//     node examples/load_test.js --processors 500 --videos 100000 --batchSize 8
+//
+// and compare with --batchSize 0, which simulates processors that request,
+// confirm and complete one video per message.
+const WebSocket = require('ws');
+const yargs = require('yargs');
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const { spawn } = require('child_process');
+
+const argv = yargs
+    .option('processors', {
+                    alias: 'n',
+                    description: 'Number of simulated processors',
+                    default: 200,
+                    type: 'number'
+                })
+    .option('videos', {
+                    alias: 'v',
+                    description: 'Number of fake video paths to dispatch',
+                    default: 20000,
+                    type: 'number'
+                })
+    .option('batchSize', {
+                    alias: 'b',
+                    description: 'Number of videos each processor requests at once. 0 uses the single video protocol',
+                    default: 8,
+                    type: 'number'
+                })
+    .option('port', {
+                    alias: 'p',
+                    description: 'Port on which to start the control node',
+                    default: 8091,
+                    type: 'number'
+                })
+    .option('startupDelay', {
+                    alias: 'd',
+                    description: 'Length of time (in ms) to let the control node read its path list before connecting',
+                    default: 2000,
+                    type: 'number'
+                })
+    .help()
+    .alias('help', 'h')
+    .argv;
+
+const workDir = fs.mkdtempSync(path.join(os.tmpdir(), 'snva-load-test-'));
+const inputFile = path.join(workDir, 'videopaths.txt');
+const logDir = path.join(workDir, 'logs');
+fs.mkdirSync(logDir);
+
+var videoPaths = [];
+for (var i = 0; i < argv.videos; i++)
+    videoPaths.push('/load/test/video' + i + '.mp4');
+fs.writeFileSync(inputFile, videoPaths.join('\n') + '\n');
+
+const controlNode = spawn(process.execPath, [
+    path.join(__dirname, '..', 'app.js'), '-i', inputFile, '-l', logDir,
+    '--outputPath', path.join(workDir, 'outputList.txt'), '-p', argv.port],
+    {stdio: 'inherit'});
+
+var numCompleted = 0;
+var numMessages = 0;
+var start = null;
+var sockets = [];
+
+function send(ws, msgObj) {
+    numMessages++;
+    ws.send(JSON.stringify(msgObj));
+}
+
+function requestVideos(ws) {
+    if (argv.batchSize > 0)
+        send(ws, {action: 'REQUEST_VIDEO', count: argv.batchSize});
+    else
+        send(ws, {action: 'REQUEST_VIDEO'});
+}
+
+// Confirm and complete every assigned video at once, then ask for more
+function onProcess(ws, msgObj) {
+    if (msgObj.paths != null) {
+        send(ws, {action: 'REQUEST_RECEIVED', batch: msgObj.batch, videos: msgObj.paths});
+        send(ws, {action: 'COMPLETE', videos: msgObj.paths.map((video) => ({video: video, output: 'none'}))});
+        numCompleted += msgObj.paths.length;
+    } else {
+        send(ws, {action: 'REQUEST_RECEIVED', video: msgObj.path});
+        send(ws, {action: 'COMPLETE', video: msgObj.path, output: 'none'});
+        numCompleted++;
+    }
+    if (numCompleted >= argv.videos) {
+        finish();
+        return;
+    }
+    requestVideos(ws);
+}
+
+function connectProcessor() {
+    const ws = new WebSocket('ws://localhost:' + argv.port + '/registerProcess');
+    ws.on('message', function incoming(message) {
+        var msgObj = JSON.parse(message);
+        switch (msgObj.action) {
+            case 'CONNECTION_SUCCESS':
+            case 'RESUME_REQUESTS':
+                requestVideos(ws);
+                break;
+            case 'PROCESS':
+                onProcess(ws, msgObj);
+                break;
+        }
+    });
+    ws.on('error', function(error) {
+        console.error(error.message);
+    });
+    sockets.push(ws);
+}
+
+function finish() {
+    var duration = (Date.now() - start) / 1000;
+    console.log(argv.processors + ' processors completed ' + numCompleted + ' videos in ' +
+        duration.toFixed(2) + ' s (' + (numCompleted / duration).toFixed(0) + ' videos/s, ' +
+        numMessages + ' messages sent, batch size ' + argv.batchSize + ')');
+    for (var ws of sockets)
+        ws.terminate();
+    controlNode.kill();
+    fs.rmdirSync(workDir, {recursive: true});
+    process.exit();
+}
+
+setTimeout(function() {
+    start = Date.now();
+    for (var i = 0; i < argv.processors; i++)
+        connectProcessor();
+}, argv.startupDelay);
@@ -5,7 +5,9 @@ var toProcess = [];
 
 exports.readInputPaths = readInputPaths;
 exports.nextVideo = nextVideo;
+exports.nextVideos = nextVideos;
 exports.addVideo = addVideo;
+exports.addVideos = addVideos;
 exports.isComplete = isComplete;
 exports.getCount = getCount;
 
@@ -28,10 +30,21 @@ function nextVideo() {
     return null;
 }
 
+// Remove up to count videos from the queue at once, in the order nextVideo
+// would return them
+function nextVideos(count) {
+    return toProcess.splice(Math.max(toProcess.length - count, 0)).reverse();
+}
+
 function addVideo(videoPath) {
     toProcess.push(videoPath);
 }
 
+function addVideos(videoPaths) {
+    for (var videoPath of videoPaths)
+        toProcess.push(videoPath);
+}
+
 function isComplete() {
     return toProcess.length <= 0;
 }
\ No newline at end of file
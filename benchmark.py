@@ -0,0 +1,587 @@
+import argparse
+import csv
+import filecmp
+import numpy as np
+import os
+import tempfile
+from time import time
+import tracemalloc
+from utils.event import EventQuery, EventQueryEngine, Trip
+from utils.io import IO, zstandard
+from utils.timestamp import Timestamp
+
+
+# 15 frames per second for one hour, matching SHRP2 NDS forward video
+NUM_FRAMES_PER_HOUR = 15 * 60 * 60
+
+
+def synthesize_timestamp_values(num_frames, seed=0):
+  # SHRP2 timestamps advance in irregular 66/67 ms steps
+  random_state = np.random.RandomState(seed)
+  timesteps = random_state.choice([66, 67], size=num_frames - 1)
+  return np.concatenate(([0], np.cumsum(timesteps))).astype(np.int64)
+
+
+def render_timestamp_images(timestamp_values, num_digits=10, num_channels=3):
+  """Draw each timestamp value into a crop as it appears in SHRP2 video.
+
+  Returns:
+    A uint8 array of shape (nt, 16, 16 * nd, nc).
+  """
+  num_timestamps = timestamp_values.shape[0]
+  height = Timestamp.digit_mask_array.shape[1]
+
+  num_value_digits = np.floor(
+    np.log10(np.maximum(timestamp_values, 1))).astype(np.int64) + 1
+  exponents = np.expand_dims(num_value_digits, 1) - 1 - np.arange(num_digits)
+  digits = np.expand_dims(timestamp_values, 1) // 10 ** np.maximum(
+    exponents, 0) % 10
+  digits[exponents < 0] = 10  # blank cells follow the last digit
+
+  # (11, 16, 16)
+  masks = np.concatenate((Timestamp.digit_mask_array.astype(np.uint8),
+                          np.zeros((1, height, height), dtype=np.uint8)))
+  # (nt, nd, 16, 16)
+  timestamp_images = masks[digits]
+  # (nt, 16, 16 * nd)
+  timestamp_images = np.reshape(np.transpose(timestamp_images, (0, 2, 1, 3)),
+                                (num_timestamps, height, height * num_digits))
+
+  return np.repeat(np.expand_dims(timestamp_images, -1), num_channels, -1)
+
+
+def _recognize_digits_by_broadcast(timestamp_object, timestamp_image_batch):
+  # the recognizer used before digit cells were bit-packed: every cell is
+  # compared pixel-by-pixel against every digit mask
+  digit_cells = np.where(
+    timestamp_object._split_digit_cells(timestamp_image_batch), 255, 0)
+  # (nb, 10, nd, 16, 16)
+  _equal = np.equal(np.expand_dims(digit_cells, 1), np.expand_dims(
+    Timestamp.digit_mask_array, 1))
+  # (nb, 10, nd)
+  _all = np.all(_equal, axis=(3, 4))
+  digit_array = np.full(
+    (timestamp_image_batch.shape[0], timestamp_object.num_digits), -1,
+    dtype=np.int8)
+  frame_numbers, digits, positions = np.nonzero(_all)
+  digit_array[frame_numbers, positions] = digits
+  return digit_array
+
+
+def synthesize_class_probs(num_frames, num_classes, seed=0):
+  # class probabilities that drift slowly and carry per-frame noise, like the
+  # output of a frame classifier over driving video
+  random_state = np.random.RandomState(seed)
+  logits = np.cumsum(random_state.normal(
+    scale=0.1, size=(num_frames, num_classes)), axis=0)
+  logits += random_state.normal(size=(num_frames, num_classes))
+  class_probs = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+  return (class_probs / np.sum(class_probs, axis=1, keepdims=True)).astype(
+    np.float32)
+
+
+def _smooth_probs_by_fancy_index(class_probs, smoothing_factor):
+  # the smoother used before all classes were convolved at once: every class
+  # gathers an (n - window, window) matrix of its own probabilities
+  weight, window = IO._get_gauss_weight_and_window(smoothing_factor)
+  weight_sum = np.sum(weight)
+  indices = np.arange(class_probs.shape[0] - window)
+  indices = np.expand_dims(indices, axis=1) + np.arange(weight.shape[0])
+  head_padding_len, tail_padding_len = IO._div_odd(window)
+  smoothed_probs = np.ndarray(class_probs.shape)
+  for i in range(class_probs.shape[1]):
+    class_smoothed_probs = np.sum(
+      weight * class_probs[:, i][indices], axis=1) / weight_sum
+    smoothed_probs[:, i] = np.concatenate(
+      (np.ones((head_padding_len,)) * class_smoothed_probs[0],
+       class_smoothed_probs,
+       np.ones((tail_padding_len,)) * class_smoothed_probs[-1]))
+  return smoothed_probs
+
+
+def benchmark_smoothing(args):
+  class_probs = synthesize_class_probs(args.numframes, args.numclasses)
+
+  print('smoothing the probabilities of {} classes over {} synthetic '
+        'frames'.format(args.numclasses, args.numframes))
+
+  for smoothing_factor in args.smoothingfactors:
+    window = 2 * smoothing_factor - 1
+    method = 'fft' if window > IO.max_direct_smoothing_window else 'direct'
+
+    IO.clear_smoothed_probs_cache()
+
+    start = time()
+    smoothed_probs = IO.smooth_probs(class_probs, smoothing_factor)
+    print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+      'factor {} ({})'.format(smoothing_factor, method))))
+
+    start = time()
+    IO.smooth_probs(class_probs, smoothing_factor)
+    print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+      'memoized')))
+
+    # the legacy smoother is the reference for edge padding and alignment
+    if not args.skipbaseline:
+      start = time()
+      baseline_smoothed_probs = _smooth_probs_by_fancy_index(
+        class_probs, smoothing_factor)
+      print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+        'fancy index')))
+
+      if not np.allclose(smoothed_probs, baseline_smoothed_probs, atol=1e-5):
+        raise AssertionError(
+          'smoothed probabilities differ from the legacy smoother for '
+          'smoothing factor {}'.format(smoothing_factor))
+
+  IO.clear_smoothed_probs_cache()
+
+
+def _read_report_by_csv_reader(report_file_path, data_col_range):
+  # the legacy reader: every field is kept as a string until the whole report
+  # has been read
+  with open(report_file_path, newline='') as report_file:
+    report_reader = csv.reader(report_file)
+    next(report_reader)
+
+    frame_numbers = []
+    timestamps = []
+    qa_flags = []
+    probabilities = []
+
+    for row in report_reader:
+      frame_numbers.append(row[1])
+      timestamps.append(row[2])
+      qa_flags.append(row[3])
+      probabilities.append(row[data_col_range[0]:data_col_range[1]])
+
+  return {'frame_numbers': np.array(frame_numbers).astype(np.int64),
+          'frame_timestamps': np.array(timestamps).astype(np.int64),
+          'qa_flag': np.array(qa_flags).astype(np.uint8),
+          'probabilities': np.array(probabilities).astype(np.float32)}
+
+
+def _write_report_by_csv_writer(report_file_path, report_file_name,
+                                class_probs, timestamps, qa_flags):
+  # the legacy writer: every cell is formatted on its own
+  rows = [[report_file_name, '{:d}'.format(i + 1),
+           '{:d}'.format(timestamps[i]), '{:d}'.format(qa_flags[i])] +
+          ['{0:.4f}'.format(cls) for cls in class_probs[i]]
+          for i in range(len(class_probs))]
+
+  with open(report_file_path, 'w', newline='') as report_file:
+    csv_writer = csv.writer(report_file)
+    csv_writer.writerow(['file_name', 'frame_number', 'frame_timestamp',
+                         'qa_flag'] + ['class_{}_probability'.format(i)
+                                       for i in range(class_probs.shape[1])])
+    csv_writer.writerows(rows)
+
+
+def _get_peak_memory(function, *args):
+  tracemalloc.start()
+  function(*args)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return peak
+
+
+def benchmark_reports(args):
+  class_name_map = {i: 'class_{}'.format(i) for i in range(args.numclasses)}
+  class_probs = synthesize_class_probs(args.numframes, args.numclasses)
+  timestamps = synthesize_timestamp_values(args.numframes)
+  qa_flags = np.zeros((args.numframes,), dtype=np.uint8)
+
+  data_col_range = (4, 4 + args.numclasses)
+
+  with tempfile.TemporaryDirectory() as report_dir_path:
+    start = time()
+    report_file_path = IO.write_inference_report(
+      'benchmark', report_dir_path, class_probs, class_name_map, timestamps,
+      qa_flags)
+    write_duration = time() - start
+
+    print('{} rows of {} classes, {:.1f} MB:'.format(
+      args.numframes, args.numclasses,
+      os.path.getsize(report_file_path) / 2 ** 20))
+    print(IO.get_processing_duration(write_duration, '{:>20}:'.format(
+      'write')))
+
+    start = time()
+    _, report_data = IO.read_report(
+      report_file_path, frame_col_num=1, timestamp_col_num=2,
+      qa_flag_col_num=3, data_col_range=data_col_range)
+    print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+      'read')))
+    print('{:>20}: {:.1f} MB'.format('peak memory', _get_peak_memory(
+      IO.read_report, report_file_path, 1, 2, 3, data_col_range) / 2 ** 20))
+
+    if not args.skipbaseline:
+      baseline_report_file_path = os.path.join(
+        report_dir_path, 'baseline.csv')
+
+      start = time()
+      _write_report_by_csv_writer(
+        baseline_report_file_path, 'benchmark', class_probs, timestamps,
+        qa_flags)
+      print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+        'csv writer')))
+
+      if not filecmp.cmp(report_file_path, baseline_report_file_path,
+                         shallow=False):
+        raise AssertionError(
+          'the report differs from the one written by the csv writer')
+
+      start = time()
+      baseline_report_data = _read_report_by_csv_reader(
+        report_file_path, data_col_range)
+      print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+        'csv reader')))
+      baseline_peak_memory = _get_peak_memory(
+        _read_report_by_csv_reader, report_file_path, data_col_range)
+      print('{:>20}: {:.1f} MB'.format(
+        'peak memory', baseline_peak_memory / 2 ** 20))
+
+      for key, value in baseline_report_data.items():
+        if not np.array_equal(report_data[key], value):
+          raise AssertionError(
+            '{} differ from those read by the csv reader'.format(key))
+
+
+def benchmark_compression(args):
+  class_name_map = {0: 'background', 1: 'regulatory_sign', 2: 'warning_sign',
+                    3: 'work_zone', 4: 'other'}
+
+  class_probs = synthesize_trip_probs(
+    args.numframes, len(class_name_map), args.meanfeaturelength)
+  timestamps = synthesize_timestamp_values(args.numframes)
+  qa_flags = np.zeros((args.numframes,), dtype=np.uint8)
+
+  events = Trip(np.arange(1, args.numframes + 1), timestamps, qa_flags,
+                class_probs, class_name_map).find_work_zone_events()
+
+  print('reports for a video of {} frames with {} events:'.format(
+    args.numframes, len(events)))
+
+  output_compressions = [None, 'gzip']
+
+  if zstandard is not None:
+    output_compressions.append('zstd')
+
+  for output_compression in output_compressions:
+    IO.output_compression = output_compression
+
+    with tempfile.TemporaryDirectory() as report_dir_path:
+      start = time()
+      report_file_paths = [IO.write_inference_report(
+        'benchmark', report_dir_path, class_probs, class_name_map, timestamps,
+        qa_flags, args.smoothingfactor > 1, args.smoothingfactor,
+        args.binarizeprobs)]
+      report_file_paths.append(
+        IO.write_event_report('benchmark', report_dir_path, events))
+      duration = time() - start
+
+      num_bytes = sum([os.path.getsize(report_file_path)
+                       for report_file_path in report_file_paths])
+
+    print(IO.get_processing_duration(duration, '{:>20}: {:.1f} MB in'.format(
+      output_compression or 'uncompressed', num_bytes / 2 ** 20)))
+
+  IO.output_compression = None
+  IO.clear_smoothed_probs_cache()
+
+
+def synthesize_trip_probs(num_frames, num_classes, mean_feature_length,
+                          seed=0):
+  # one-hot probabilities whose predicted class changes after geometrically
+  # distributed runs of frames, mostly back to the first (background) class
+  random_state = np.random.RandomState(seed)
+  feature_lengths = random_state.geometric(
+    1 / mean_feature_length, size=num_frames // mean_feature_length + 1)
+  feature_class_ids = np.where(
+    random_state.random_sample(feature_lengths.shape) < 0.5, 0,
+    random_state.randint(1, num_classes, size=feature_lengths.shape))
+  class_ids = np.repeat(feature_class_ids, feature_lengths)[:num_frames]
+  class_ids = np.pad(class_ids, (0, num_frames - class_ids.shape[0]), 'edge')
+  return np.eye(num_classes, dtype=np.float32)[class_ids]
+
+
+def benchmark_events(args):
+  class_name_map = {0: 'background', 1: 'regulatory_sign', 2: 'warning_sign',
+                    3: 'work_zone', 4: 'other'}
+
+  frame_numbers = np.arange(1, args.numframes + 1)
+  timestamps = synthesize_timestamp_values(args.numframes).astype(np.int32)
+  qa_flags = np.zeros((args.numframes,), dtype=np.uint8)
+
+  event_query_engine = EventQueryEngine([
+    EventQuery('work_zone', ['regulatory_sign', 'warning_sign', 'work_zone']),
+    EventQuery('sign', ['regulatory_sign', 'warning_sign'],
+               following_feature_class_name='work_zone'),
+    EventQuery('work_zone_approach', ['work_zone'],
+               preceding_feature_class_name='warning_sign',
+               following_feature_class_name='regulatory_sign'),
+    EventQuery('other', ['other'], minimum_event_length=30)])
+
+  for mean_feature_length in args.meanfeaturelengths:
+    class_probs = synthesize_trip_probs(
+      args.numframes, len(class_name_map), mean_feature_length)
+
+    start = time()
+    trip = Trip(frame_numbers, timestamps, qa_flags, class_probs,
+                class_name_map)
+    segmentation_duration = time() - start
+
+    start = time()
+    events = trip.find_work_zone_events()
+    event_duration = time() - start
+
+    print('{} features with a mean length of {} frames, {} events:'.format(
+      trip.num_features, mean_feature_length, len(events)))
+    print(IO.get_processing_duration(segmentation_duration, '{:>20}:'.format(
+      'segmentation')))
+    print(IO.get_processing_duration(event_duration, '{:>20}:'.format(
+      'find events')))
+
+    start = time()
+    query_events = event_query_engine.run(trip)
+    print(IO.get_processing_duration(time() - start, '{:>20}:'.format(
+      '{} queries'.format(len(query_events)))))
+
+
+def benchmark_timestamps(args):
+  timestamp_values = synthesize_timestamp_values(args.numframes)
+  timestamp_object = Timestamp(16, 160)
+
+  print('recognizing the digits of {} synthetic timestamps in batches of '
+        '{}'.format(args.numframes, args.batchsize))
+
+  recognizers = [('bit-packed lookup', timestamp_object.recognize_digits)]
+
+  if not args.skipbaseline:
+    recognizers.append(
+      ('pixel broadcast', lambda timestamp_image_batch:
+       _recognize_digits_by_broadcast(timestamp_object, timestamp_image_batch)))
+
+  digit_arrays = []
+
+  for name, recognize_digits in recognizers:
+    duration = 0
+    digit_array = []
+
+    for i in range(0, args.numframes, args.batchsize):
+      timestamp_image_batch = render_timestamp_images(
+        timestamp_values[i:i + args.batchsize])
+      start = time()
+      digit_array.append(recognize_digits(timestamp_image_batch))
+      duration += time() - start
+
+    digit_arrays.append(np.concatenate(digit_array))
+
+    print(IO.get_processing_duration(duration, '{:>20}:'.format(name)))
+
+  if len(digit_arrays) > 1 and not np.array_equal(*digit_arrays):
+    raise AssertionError('recognizers disagree on at least one digit')
+
+  duration = 0
+
+  timestamp_object.begin(args.numframes)
+
+  for i in range(0, args.numframes, args.batchsize):
+    timestamp_image_batch = render_timestamp_images(
+      timestamp_values[i:i + args.batchsize])
+    start = time()
+    timestamp_object.update(timestamp_image_batch)
+    duration += time() - start
+
+  start = time()
+  timestamps, _ = timestamp_object.finalize()
+  duration += time() - start
+
+  print(IO.get_processing_duration(
+    duration, '{:>20}:'.format('update + finalize')))
+
+  if not np.array_equal(timestamps.astype(np.int64), timestamp_values):
+    raise AssertionError('timestamps were not read back correctly')
+
+  if args.anchorinterval > 0:
+    # the burned-in counter and container PTS are driven by the same clock
+    presentation_timestamps = timestamp_values.astype(np.float64)
+
+    duration = 0
+
+    timestamp_object.begin(
+      args.numframes, presentation_timestamps, args.anchorinterval)
+
+    for i in range(0, args.numframes, args.batchsize):
+      timestamp_image_batch = render_timestamp_images(
+        timestamp_values[i:i + args.batchsize])
+      start = time()
+      timestamp_object.update(timestamp_image_batch)
+      duration += time() - start
+
+    start = time()
+    timestamps, qa_flags = timestamp_object.finalize()
+    duration += time() - start
+
+    print(IO.get_processing_duration(duration, '{:>20}:'.format(
+      'anchored every {}'.format(args.anchorinterval))))
+
+    if not np.array_equal(timestamps.astype(np.int64), timestamp_values) \
+        or np.any(qa_flags == Timestamp.QA_PTS_DISAGREEMENT):
+      raise AssertionError('timestamps were not reconstructed correctly')
+
+  if args.noisefraction > 0:
+    # flip a few pixels in a random subset of crops, as compression artifacts
+    # do, so that tolerant digit matching is timed too
+    random_state = np.random.RandomState(2)
+    noisy_array = random_state.random_sample(
+      args.numframes) < args.noisefraction
+    noisy_indices = np.flatnonzero(noisy_array)
+    noise_y = random_state.randint(0, 16, size=(noisy_indices.shape[0], 3))
+    noise_x = random_state.randint(0, 160, size=(noisy_indices.shape[0], 3))
+
+    tolerant_timestamp_object = Timestamp(16, 160, args.digittolerance)
+
+    duration = 0
+
+    tolerant_timestamp_object.begin(args.numframes)
+
+    for i in range(0, args.numframes, args.batchsize):
+      timestamp_image_batch = render_timestamp_images(
+        timestamp_values[i:i + args.batchsize])
+      batch_indices = np.flatnonzero(np.logical_and(
+        noisy_indices >= i, noisy_indices < i + args.batchsize))
+      batch_frame_indices = np.expand_dims(
+        noisy_indices[batch_indices] - i, 1)
+      timestamp_image_batch[
+        batch_frame_indices, noise_y[batch_indices], noise_x[batch_indices]] \
+        = 255 - timestamp_image_batch[batch_frame_indices,
+                                      noise_y[batch_indices],
+                                      noise_x[batch_indices]]
+      start = time()
+      tolerant_timestamp_object.update(timestamp_image_batch)
+      duration += time() - start
+
+    start = time()
+    timestamps, _ = tolerant_timestamp_object.finalize()
+    duration += time() - start
+
+    print(IO.get_processing_duration(duration, '{:>20}:'.format(
+      'with {:.0%} noisy'.format(args.noisefraction))))
+
+    if not np.array_equal(timestamps.astype(np.int64), timestamp_values):
+      raise AssertionError('noisy timestamps were not read back correctly')
+
+  if args.unreadablefraction > 0:
+    # blank out a random subset of crops, as signal loss does in SHRP2 video,
+    # so that the gap synthesis fallback is timed too
+    unreadable_array = np.random.RandomState(1).random_sample(
+      args.numframes) < args.unreadablefraction
+    unreadable_array[0] = False
+
+    duration = 0
+
+    timestamp_object.begin(args.numframes)
+
+    for i in range(0, args.numframes, args.batchsize):
+      timestamp_image_batch = render_timestamp_images(
+        timestamp_values[i:i + args.batchsize])
+      timestamp_image_batch[unreadable_array[i:i + args.batchsize]] = 0
+      start = time()
+      timestamp_object.update(timestamp_image_batch)
+      duration += time() - start
+
+    start = time()
+    timestamps, qa_flags = timestamp_object.finalize()
+    duration += time() - start
+
+    print(IO.get_processing_duration(duration, '{:>20}:'.format(
+      'with {:.0%} unreadable'.format(args.unreadablefraction))))
+
+    read = qa_flags == Timestamp.QA_READ
+
+    if not np.array_equal(timestamps[read].astype(np.int64),
+                          timestamp_values[read]) \
+        or np.any(qa_flags[unreadable_array] == Timestamp.QA_READ):
+      raise AssertionError('timestamps were not read back correctly')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Micro-benchmarks for the SNVA post-processing pipeline')
+
+  subparsers = parser.add_subparsers(dest='benchmark')
+  subparsers.required = True
+
+  timestamp_parser = subparsers.add_parser(
+    'timestamps', help='Timestamp OCR over a synthetic hour of video')
+  timestamp_parser.add_argument('--numframes', '-nf', type=int,
+                                default=NUM_FRAMES_PER_HOUR)
+  timestamp_parser.add_argument('--batchsize', '-bs', type=int, default=32)
+  timestamp_parser.add_argument('--skipbaseline', '-sb', action='store_true',
+                                help='Do not time the pixel broadcast '
+                                     'recognizer.')
+  timestamp_parser.add_argument('--anchorinterval', '-ai', type=int,
+                                default=30,
+                                help='Number of frames between anchors when '
+                                     'timing PTS reconstruction. Pass 0 to '
+                                     'skip.')
+  timestamp_parser.add_argument('--noisefraction', '-nzf', type=float,
+                                default=0.1,
+                                help='Fraction of crops in which to flip three '
+                                     'pixels when timing tolerant digit '
+                                     'matching. Pass 0 to skip.')
+  timestamp_parser.add_argument('--digittolerance', '-dt', type=int,
+                                default=4)
+  timestamp_parser.add_argument('--unreadablefraction', '-uf', type=float,
+                                default=0.1,
+                                help='Fraction of crops to blank out when '
+                                     'timing timestamp synthesis. Pass 0 to '
+                                     'skip.')
+  timestamp_parser.set_defaults(function=benchmark_timestamps)
+
+  smoothing_parser = subparsers.add_parser(
+    'smoothing', help='Probability smoothing over a synthetic hour of video')
+  smoothing_parser.add_argument('--numframes', '-nf', type=int,
+                                default=NUM_FRAMES_PER_HOUR)
+  smoothing_parser.add_argument('--numclasses', '-nc', type=int, default=5)
+  smoothing_parser.add_argument('--smoothingfactors', '-sf', type=int,
+                                nargs='+', default=[4, 16, 64])
+  smoothing_parser.add_argument('--skipbaseline', '-sb', action='store_true',
+                                help='Do not time or compare against the fancy '
+                                     'index smoother.')
+  smoothing_parser.set_defaults(function=benchmark_smoothing)
+
+  event_parser = subparsers.add_parser(
+    'events', help='Feature segmentation and work zone event detection over '
+                   'synthetic trips')
+  event_parser.add_argument('--numframes', '-nf', type=int, default=1000000)
+  event_parser.add_argument('--meanfeaturelengths', '-mfl', type=int,
+                            nargs='+', default=[2, 30, 500])
+  event_parser.set_defaults(function=benchmark_events)
+
+  report_parser = subparsers.add_parser(
+    'reports', help='Writing and reading an inference report')
+  report_parser.add_argument('--numframes', '-nf', type=int, default=1000000)
+  report_parser.add_argument('--numclasses', '-nc', type=int, default=5)
+  report_parser.add_argument('--skipbaseline', '-sb', action='store_true',
+                             help='Do not time or compare against the csv '
+                                  'writer and reader.')
+  report_parser.set_defaults(function=benchmark_reports)
+
+  compression_parser = subparsers.add_parser(
+    'compression', help='Bytes written and write time per video for each '
+                        'output compression')
+  compression_parser.add_argument('--numframes', '-nf', type=int,
+                                  default=NUM_FRAMES_PER_HOUR)
+  compression_parser.add_argument('--meanfeaturelength', '-mfl', type=int,
+                                  default=30)
+  compression_parser.add_argument('--smoothingfactor', '-sf', type=int,
+                                  default=16,
+                                  help='Pass 0 to write unsmoothed reports.')
+  compression_parser.add_argument('--binarizeprobs', '-bp',
+                                  action='store_true')
+  compression_parser.set_defaults(function=benchmark_compression)
+
+  args = parser.parse_args()
+  args.function(args)
@@ -1,19 +1,22 @@
 import argparse
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
 from logging.handlers import QueueHandler, SocketHandler
-from multiprocessing import Process, Queue
+from multiprocessing import Queue
 import os
 import platform
-from queue import Empty
 import signal
 import socket
 from subprocess import PIPE, Popen
 from threading import Thread
-from time import sleep, time
+from time import time
 from utils.io import IO
-from utils.processor import process_video, process_video_signalstate
+from utils.prefetch import prefetch_video
+from utils.processor import initialize_worker, process_video, \
+  process_video_signalstate
+from utils.worker import WorkerPool, get_queue
 import websockets as ws
 
 path = os.path
@@ -35,20 +38,6 @@ def main_logger_fn(log_queue):
       break
 
 
-# Logger thread: listens for updates to log queue and writes them as they arrive
-# Terminates after we add None to the queue
-def child_logger_fn(main_log_queue, child_log_queue):
-  while True:
-    try:
-      message = child_log_queue.get()
-      if message is None:
-        break
-      main_log_queue.put(message)
-    except Exception as e:
-      logging.error(e)
-      break
-
-
 def stringify_command(arg_list):
   command_string = arg_list[0]
   for elem in arg_list[1:]:
@@ -210,139 +199,135 @@ async def main():
 
   class_name_map = IO.read_class_names(class_names_path)
 
-  return_code_queue_map = {}
-  child_logger_thread_map = {}
-  child_process_map = {}
-
-  total_num_processed_videos = 0
-  total_num_processed_frames = 0
-  total_analysis_duration = 0
-
-  def start_video_processor(video_file_path):
-    # Before popping the next video off of the list and creating a process to
-    # scan it, check to see if fewer than logical_device_count + 1 processes are
-    # active. If not, Wait for a child process to release its semaphore
-    # acquisition. If so, acquire the semaphore, pop the next video name,
-    # create the next child process, and pass the semaphore to it
-    return_code_queue = Queue()
-
-    return_code_queue_map[video_file_path] = return_code_queue
+  return_code_future_map = {}
 
-    logging.debug('creating new child process.')
+  event_loop = asyncio.get_event_loop()
 
-    child_log_queue = Queue()
+  worker_pool = WorkerPool(
+    num_processes, log_queue, args.maxvideosperworker, initialize_worker,
+    (args.modelserverhost, args.processormode))
 
-    child_logger_thread = Thread(target=child_logger_fn,
-                                 args=(log_queue, child_log_queue))
+  # up to prefetchdepth videos beyond one per worker are assigned at a time.
+  # They are probed and read ahead, then wait in the pool's task queue, so that
+  # a worker takes up its next video without a round trip to the control node
+  max_num_assigned_videos = num_processes + args.prefetchdepth
 
-    child_logger_thread.start()
+  prefetch_executor = ThreadPoolExecutor(max_workers=max_num_assigned_videos)
 
-    child_logger_thread_map[video_file_path] = child_logger_thread
+  total_num_processed_videos = 0
+  total_num_processed_frames = 0
+  total_analysis_duration = 0
 
+  def start_video_processor(video_file_path, video_dimensions):
+    # the next idle worker process takes up the video, and the return code and
+    # log queues that precede log_level are supplied by the worker
     if 'signalstate' == args.processormode:
-      child_process = Process(
-        target=process_video_signalstate,
-        name=path.splitext(path.split(video_file_path)[1])[0],
-        args=(video_file_path, output_dir_path, class_name_map, args.modelname, args.modelsignaturename, args.modelserverhost,model_input_size,
-              return_code_queue, child_log_queue, log_level,
+      processor_fn = process_video_signalstate
+      leading_args = (video_file_path, output_dir_path, class_name_map, args.modelname, args.modelsignaturename, args.modelserverhost,model_input_size)
+      trailing_args = (log_level,
               ffmpeg_path, ffprobe_path, args.crop, args.cropwidth, args.cropheight,
               args.cropx, args.cropy, args.extracttimestamps,
               args.timestampmaxwidth, args.timestampheight, args.timestampx,
               args.timestampy, args.deinterlace, args.numchannels, args.batchsize,
               args.smoothprobs, args.smoothingfactor, args.binarizeprobs,
-              args.writebbox, args.writeeventreports, args.maxanalyzerthreads, args.processormode))
+              args.writebbox, args.writeeventreports, args.maxanalyzerthreads, args.processormode,
+              args.probecachepath, args.timestampanchorinterval,
+              args.timestampdigittolerance, args.outputcompression,
+              args.resultcatalogpath, args.trackiouthreshold,
+              args.trackmaxmissedframes, args.bboxreportformat,
+              video_dimensions)
     else:
-      child_process = Process(
-      target=process_video,
-      name=path.splitext(path.split(video_file_path)[1])[0],
-      args=(video_file_path, output_dir_path, class_name_map, args.modelname, args.modelsignaturename, args.modelserverhost,model_input_size,
-            return_code_queue, child_log_queue, log_level,
+      processor_fn = process_video
+      leading_args = (video_file_path, output_dir_path, class_name_map, args.modelname, args.modelsignaturename, args.modelserverhost,model_input_size)
+      trailing_args = (log_level,
             ffmpeg_path, ffprobe_path, args.crop, args.cropwidth, args.cropheight,
             args.cropx, args.cropy, args.extracttimestamps,
             args.timestampmaxwidth, args.timestampheight, args.timestampx,
             args.timestampy, args.deinterlace, args.numchannels, args.batchsize,
             args.smoothprobs, args.smoothingfactor, args.binarizeprobs,
-            args.writeinferencereports, args.writeeventreports, args.maxanalyzerthreads, args.processormode))
-    logging.debug('starting child process.')
+            args.writeinferencereports, args.writeeventreports, args.maxanalyzerthreads, args.processormode,
+            args.probecachepath, args.timestampanchorinterval,
+            args.timestampdigittolerance, args.streamevents,
+            args.inferencereportformat, args.outputcompression,
+            args.resultcatalogpath, video_dimensions)
+    logging.debug('submitting {} to the worker pool.'.format(video_file_path))
+
+    return worker_pool.submit(processor_fn, leading_args, trailing_args)
+
+  async def prefetch_and_process_video(video_file_path):
+    video_dimensions = await event_loop.run_in_executor(
+      prefetch_executor, prefetch_video, video_file_path, ffprobe_path,
+      args.probecachepath)
+
+    return await asyncio.wrap_future(
+      start_video_processor(video_file_path, video_dimensions),
+      loop=event_loop)
+
+  # Wait until at least one child process has returned, or until timeout
+  # seconds have passed if timeout is not None, then close every child process
+  # that has returned. Control nodes that batch are notified of every completed
+  # video in one message
+  async def close_completed_video_processors(
+      total_num_processed_videos, total_num_processed_frames,
+      total_analysis_duration, websocket_conn, timeout=None,
+      do_batch_completions=False):
+    if len(return_code_future_map) == 0:
+      return total_num_processed_videos, total_num_processed_frames, \
+             total_analysis_duration
 
-    child_process.start()
+    completed_futures, _ = await asyncio.wait(
+      list(return_code_future_map.values()), timeout=timeout,
+      return_when=asyncio.FIRST_COMPLETED)
 
-    child_process_map[video_file_path] = child_process
+    completions = []
 
-  async def close_completed_video_processors(
-      total_num_processed_videos, total_num_processed_frames,
-      total_analysis_duration, websocket_conn):
-    for video_file_path in list(return_code_queue_map.keys()):
-      return_code_queue = return_code_queue_map[video_file_path]
+    for video_file_path in list(return_code_future_map.keys()):
+      return_code_future = return_code_future_map[video_file_path]
 
-      try:
-        return_code_map = return_code_queue.get_nowait()
+      if return_code_future in completed_futures:
+        return_code_map = return_code_future.result()
 
         return_code = return_code_map['return_code']
         return_value = return_code_map['return_value']
 
-        child_process = child_process_map[video_file_path]
-
         logging.debug(
-          'child process {} returned with exit code {} and exit value '
-          '{}'.format(child_process.pid, return_code, return_value))
+          'processing of {} returned with exit code {} and exit value '
+          '{}'.format(video_file_path, return_code, return_value))
 
         if return_code == 'success':
           total_num_processed_videos += 1
           total_num_processed_frames += return_value
           total_analysis_duration += return_code_map['analysis_duration']
 
-          logging.info('notifying control node of completion')
-
-          complete_request = json.dumps({
-            'action': 'COMPLETE',
+          completions.append({
             'video': os.path.basename(video_file_path),
             'output': return_code_map['output_locations']})
-          await websocket_conn.send(complete_request)
-
-        child_logger_thread = child_logger_thread_map[video_file_path]
-        
-        logging.debug('joining logger thread for child process {}'.format(
-          child_process.pid))
-
-        child_logger_thread.join(timeout=15)
-
-        if child_logger_thread.is_alive():
-          logging.warning(
-            'logger thread for child process {} remained alive following join '
-            'timeout'.format(child_process.pid))
-        
-        logging.debug('joining child process {}'.format(child_process.pid))
-        
-        child_process.join(timeout=15)
-
-        # if the child process has not yet terminated, kill the child process at
-        # the risk of losing any log message not yet buffered by the main logger
-        try:
-          os.kill(child_process.pid, signal.SIGKILL)
-          logging.warning(
-            'child process {} remained alive following join timeout and had to '
-            'be killed'.format(child_process.pid))
-        except:
-          pass
-        
-        return_code_queue.close()
-        
-        return_code_queue_map.pop(video_file_path)
-        child_logger_thread_map.pop(video_file_path)
-        child_process_map.pop(video_file_path)
-      except Empty:
-        pass
+
+        return_code_future_map.pop(video_file_path)
+
+    if len(completions) > 0:
+      logging.info('notifying control node of {} completions'.format(
+        len(completions)))
+
+      if do_batch_completions:
+        complete_requests = [{'action': 'COMPLETE', 'videos': completions}]
+      else:
+        complete_requests = [dict(completion, action='COMPLETE')
+                             for completion in completions]
+
+      for complete_request in complete_requests:
+        await websocket_conn.send(json.dumps(complete_request))
 
     return total_num_processed_videos, total_num_processed_frames, \
            total_analysis_duration
 
   start = time()
 
-  sleep_duration = 1
   breakLoop = False
   connectionId = None
   isIdle = False
+  # set once the control node hands out videos in batches
+  isBatched = False
   while True:
     try:
       if breakLoop:
@@ -363,13 +348,13 @@ async def main():
           connectionId = response['id']
         logging.debug("Assigned id {}".format(connectionId))
         while True:
-          # block if num_processes child processes are active
-          while len(return_code_queue_map) >= num_processes:
+          # block if every worker is busy and the prefetch queue is full
+          while len(return_code_future_map) >= max_num_assigned_videos:
             total_num_processed_videos, total_num_processed_frames, \
             total_analysis_duration = await close_completed_video_processors(
               total_num_processed_videos, total_num_processed_frames,
-              total_analysis_duration, conn)
-            sleep(sleep_duration)
+              total_analysis_duration, conn,
+              do_batch_completions=isBatched)
 
           try:  # todo poll for termination signal from control node
             _ = main_interrupt_queue.get_nowait()
@@ -380,34 +365,35 @@ async def main():
             pass
           
           if not isIdle:
-            logging.info('requesting video')
-            request = json.dumps({'action': 'REQUEST_VIDEO'})
+            num_requested_videos = \
+              max_num_assigned_videos - len(return_code_future_map)
+            logging.info('requesting {} videos'.format(num_requested_videos))
+            request = json.dumps({'action': 'REQUEST_VIDEO',
+                                  'count': num_requested_videos})
             await conn.send(request)
             logging.info('reading response')
             response = await conn.recv()
           else:
-            # If idle, we will try to close completed processors until all are done
-            while len(return_code_queue_map) > 0:
-              # Before checking for completed processes, check for a new message
-              logging.info('Checking for new message')
-              try:
-                # If we get a response quickly, break our waiting loop and process the command
-                response = await asyncio.wait_for(conn.recv(), 1)
+            # If idle, close completed processors as they finish until a new
+            # message arrives
+            receive_future = asyncio.ensure_future(conn.recv())
+
+            while len(return_code_future_map) > 0:
+              completed_futures, _ = await asyncio.wait(
+                [receive_future] + list(return_code_future_map.values()),
+                return_when=asyncio.FIRST_COMPLETED)
+
+              if receive_future in completed_futures:
                 break
-              except asyncio.TimeoutError:
-                # Otherwise, go back to finishing our current tasks
-                logging.debug('No new message from control node, continuing...')
-                pass
+
               total_num_processed_videos, total_num_processed_frames, \
               total_analysis_duration = await close_completed_video_processors(
                 total_num_processed_videos, total_num_processed_frames,
-                total_analysis_duration, conn)
-              # by now, the last device_id_queue_len videos are being processed,
-              # so we can afford to poll for their completion infrequently
-              if len(return_code_queue_map) > 0:
-                sleep(sleep_duration)
+                total_analysis_duration, conn, timeout=0,
+                do_batch_completions=isBatched)
+
             # Once all are complete, if still idle we have no work left to do - we just wait for a new message
-            response = await conn.recv() 
+            response = await receive_future
           
           response = json.loads(response)
 
@@ -427,33 +413,40 @@ async def main():
             breakLoop = True
             break
           elif response['action'] == 'PROCESS':
-            # TODO Prepend input path
-            video_file_path = os.path.join(args.inputpath, response['path'])
-            request_received = json.dumps({'action': 'REQUEST_RECEIVED', 'video': response['path']})
+            # control nodes that predate batching send a single path, and
+            # expect each video to be confirmed and completed on its own
+            isBatched = 'paths' in response
+
+            if isBatched:
+              video_paths = response['paths']
+              request_received = json.dumps({'action': 'REQUEST_RECEIVED', 'batch': response['batch'], 'videos': video_paths})
+            else:
+              video_paths = [response['path']]
+              request_received = json.dumps({'action': 'REQUEST_RECEIVED', 'video': response['path']})
             await conn.send(request_received)
-            try:
-              start_video_processor(video_file_path)
-            except Exception as e:
-              logging.error('an unknown error has occured while processing {}'.format(video_file_path))
-              logging.error(e)
+
+            for video_path in video_paths:
+              # TODO Prepend input path
+              video_file_path = os.path.join(args.inputpath, video_path)
+              try:
+                return_code_future_map[video_file_path] = asyncio.ensure_future(
+                  prefetch_and_process_video(video_file_path))
+              except Exception as e:
+                logging.error('an unknown error has occured while processing {}'.format(video_file_path))
+                logging.error(e)
           else:
             raise ConnectionError(
               'control node replied with unexpected response: {}'.format(response))
-        logging.debug('{} child processes remain enqueued'.format(len(return_code_queue_map)))
-        while len(return_code_queue_map) > 0:
+        logging.debug('{} child processes remain enqueued'.format(len(return_code_future_map)))
+        while len(return_code_future_map) > 0:
           #logging.debug('waiting for the final {} child processes to '
-          #              'terminate'.format(len(return_code_queue_map)))
+          #              'terminate'.format(len(return_code_future_map)))
 
           total_num_processed_videos, total_num_processed_frames, \
           total_analysis_duration = await close_completed_video_processors(
             total_num_processed_videos, total_num_processed_frames,
-            total_analysis_duration, conn)
-
-          # by now, the last device_id_queue_len videos are being processed,
-          # so we can afford to poll for their completion infrequently
-          if len(return_code_queue_map) > 0:
-            #logging.debug('sleeping for {} seconds'.format(sleep_duration))
-            sleep(sleep_duration)
+            total_analysis_duration, conn,
+            do_batch_completions=isBatched)
 
         end = time() - start
 
@@ -466,6 +459,18 @@ async def main():
         logging.info('Video analysis alone spanned a cumulative {:.02f} '
                     'seconds'.format(total_analysis_duration))
 
+        mean_startup_duration, mean_task_overhead_duration, num_run_videos = \
+          worker_pool.get_startup_summary()
+
+        logging.info('worker processes took {:.3f} seconds on average to start '
+                     'and initialize, while each of {} videos added {:.3f} '
+                     'seconds on average to a running worker, saving an '
+                     'estimated {:.02f} seconds of startup'.format(
+                      mean_startup_duration, num_run_videos,
+                      mean_task_overhead_duration,
+                      num_run_videos * (mean_startup_duration
+                                        - mean_task_overhead_duration)))
+
         logging.info('exiting snva {} main process'.format(snva_version_string))
         breakLoop = True
     except socket.gaierror:
@@ -482,10 +487,15 @@ async def main():
     except Exception as e:
       logging.error("Unknown Exception")
       logging.error(e)
+      prefetch_executor.shutdown()
+      worker_pool.close()
       raise e
     if breakLoop:
       break
 
+  prefetch_executor.shutdown()
+  worker_pool.close()
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(
     description='SHRP2 NDS Video Analytics built on TensorFlow')
@@ -518,6 +528,11 @@ if __name__ == '__main__':
                            'extraction.')
   parser.add_argument('--writebbox', '-bb', action='store_true',
                       help='Create JSON files with bounding box data for signal state')
+  parser.add_argument('--bboxreportformat', '-bbrf', default='jsonl',
+                      choices=['jsonl', 'json'],
+                      help='Write bounding box reports as JSON lines, or as '
+                           'the single JSON array written by earlier '
+                           'versions.')
   # parser.add_argument('--excludepreviouslyprocessed', '-epp',
   #                     action='store_true',
   #                     help='Skip processing of videos for which reports '
@@ -545,6 +560,10 @@ if __name__ == '__main__':
                       default=4,
                       help='Maximum number of threads to assign to each video '
                            'processor')
+  parser.add_argument('--maxvideosperworker', '-mvpw', type=int, default=0,
+                      help='Number of videos that a worker process handles '
+                           'before it is replaced, to bound the memory it may '
+                           'leak. Workers are never replaced if 0.')
   parser.add_argument('--modelsdirpath', '-mdp',
                       default='models/work_zone_scene_detection',
                       help='Path to the parent directory of model directories.')
@@ -562,15 +581,47 @@ if __name__ == '__main__':
   parser.add_argument('--numprocessesperdevice', '-nppd', type=int, default=1,
                       help='The number of instances of inference to perform on '
                            'each device.')
+  parser.add_argument('--prefetchdepth', '-pfd', type=int, default=0,
+                      help='Number of videos beyond one per worker to request '
+                           'ahead of time. Each is probed and read ahead while '
+                           'it waits, so that a worker starts its next video '
+                           'as soon as it finishes the last.')
+  parser.add_argument('--probecachepath', '-pcp', default=None,
+                      help='Path to a SQLite cache of video dimensions keyed by '
+                           'path, size and modification time. Fill it ahead '
+                           'of time with python -m utils.probe.')
   parser.add_argument('--protobuffilename', '-pbfn', default='model.pb',
                       help='Name of the model protobuf file.')
+  parser.add_argument('--outputcompression', '-oc', default=None,
+                      choices=['gzip', 'zstd'],
+                      help='Compress CSV and JSON reports as they are written. '
+                           'zstd requires the zstandard package and falls back '
+                           'to gzip without it.')
   parser.add_argument('--outputpath', '-op', default='reports',
                       help='Path to the directory where reports are stored.')
+  parser.add_argument('--resultcatalogpath', '-rcp', default=None,
+                      help='Path to a SQLite catalog to which the events of '
+                           'every processed video are added, so that they can '
+                           'be queried with python -m utils.catalog.')
   parser.add_argument('--smoothprobs', '-sp', action='store_true',
                       help='Apply class-wise smoothing across video frame class'
                            ' probability distributions.')
   parser.add_argument('--smoothingfactor', '-sf', type=int, default=16,
                       help='The class-wise probability smoothing factor.')
+  parser.add_argument('--streamevents', '-se', action='store_true',
+                      help='Detect events, and append them to event reports, '
+                           'while inference is still under way rather than '
+                           'after it completes. Not used in signalstate mode.')
+  parser.add_argument('--timestampanchorinterval', '-tai', type=int,
+                      default=0,
+                      help='Read the timestamp of every Nth frame (and of '
+                           'frames where PTS cadence breaks) and reconstruct '
+                           'the rest from PTS. Reads every timestamp if 0.')
+  parser.add_argument('--timestampdigittolerance', '-tdt', type=int,
+                      default=0,
+                      help='The number of pixels in which a timestamp digit '
+                           'may differ from its mask and still be read. Only '
+                           'exact matches are read if 0.')
   parser.add_argument('--timestampheight', '-th', type=int, default=16,
                       help='The length of the y-dimension of the timestamp '
                            'overlay.')
@@ -583,6 +634,15 @@ if __name__ == '__main__':
   parser.add_argument('--timestampy', '-ty', type=int, default=340,
                       help='y-component of top-left corner of timestamp '
                            '(before cropping).')
+  parser.add_argument('--trackiouthreshold', '-tit', type=float, default=0.3,
+                      help='The minimum intersection over union at which a '
+                           'signal detection continues the track of a signal '
+                           'detected in a recent frame. Only used in '
+                           'signalstate mode.')
+  parser.add_argument('--trackmaxmissedframes', '-tmmf', type=int, default=1,
+                      help='The number of consecutive sampled frames in which '
+                           'a signal may go undetected and its track still be '
+                           'continued. Only used in signalstate mode.')
   parser.add_argument('--writeeventreports', '-wer', type=bool, default=True,
                       help='Output a CVS file for each video containing one or '
                            'more feature events')
@@ -591,6 +651,10 @@ if __name__ == '__main__':
                       help='For every video, output a CSV file containing a '
                            'probability distribution over class labels, a '
                            'timestamp, and a frame number for each frame')
+  parser.add_argument('--inferencereportformat', '-irf', default='csv',
+                      choices=['csv', 'columnar'],
+                      help='Write inference reports as CSV, or in a columnar '
+                           'binary format that can be memory-mapped.')
   parser.add_argument('--clocktype', '-ct', default='wall',
                       help='Specify whether profiling should use "gpu" or "wall" clock type')
   parser.add_argument('--profformat', '-pfmt', default='pstat',
@@ -671,7 +735,8 @@ if __name__ == '__main__':
 
   logging.basicConfig(level=log_level, format=log_format, handlers=log_handlers)
 
-  log_queue = Queue()
+  # shared with worker processes
+  log_queue = get_queue()
 
   logger_thread = Thread(target=main_logger_fn, args=(log_queue,))
 
@@ -0,0 +1,113 @@
+import os
+import shutil
+from subprocess import PIPE, Popen
+import tempfile
+import unittest
+
+import numpy as np
+
+from utils.io import IO
+from utils.timestamp import Timestamp
+
+timestamp_height = 16
+timestamp_max_width = 96
+frame_width = timestamp_max_width
+frame_height = 3 * timestamp_height
+
+num_frames = 150
+first_timestamp = 100000
+
+
+def get_timestamp(frame_number):
+  # NDS video runs at 15000/1001 fps, so frames are 66 or 67 ms apart
+  return first_timestamp + int(round(frame_number * 1001 / 15))
+
+
+def render_number(number):
+  cells = np.zeros(
+    (timestamp_height, timestamp_max_width), dtype=np.uint8)
+
+  for i, digit in enumerate(str(number)):
+    cells[:, i * timestamp_height:(i + 1) * timestamp_height] = \
+      Timestamp.digit_mask_array[int(digit)]
+
+  return cells
+
+
+def render_frame(frame_number):
+  # the timestamp overlay on top, and the frame number below it so that the
+  # frames that the decoder samples can be identified
+  frame = np.zeros((frame_height, frame_width), dtype=np.uint8)
+  frame[:timestamp_height] = render_number(get_timestamp(frame_number))
+  frame[2 * timestamp_height:] = render_number(frame_number)
+
+  return np.repeat(frame[..., np.newaxis], 3, axis=2)
+
+
+class SignalStateTimestampTest(unittest.TestCase):
+  def setUp(self):
+    self.ffmpeg_path = os.environ.get('FFMPEG_HOME', shutil.which('ffmpeg'))
+
+    if self.ffmpeg_path is None:
+      self.skipTest('ffmpeg is not available')
+
+    self.temp_dir_path = tempfile.mkdtemp()
+    self.video_file_path = os.path.join(self.temp_dir_path, 'video.mkv')
+
+    # encode losslessly, so that every decoded overlay is readable
+    encoder = Popen(
+      [self.ffmpeg_path, '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt',
+       'rgb24', '-s', '{}x{}'.format(frame_width, frame_height), '-framerate',
+       '15000/1001', '-i', 'pipe:0', '-c:v', 'ffv1', self.video_file_path],
+      stdin=PIPE)
+    encoder.communicate(b''.join(
+      render_frame(frame_number).tobytes()
+      for frame_number in range(num_frames)))
+
+    self.assertEqual(encoder.returncode, 0)
+
+  def tearDown(self):
+    shutil.rmtree(self.temp_dir_path)
+
+  def test_sampled_timestamps_are_read_with_anchors_enabled(self):
+    ffmpeg_command = IO.get_decode_command(
+      self.ffmpeg_path, self.video_file_path,
+      output_frame_rate=IO.signalstate_frame_rate)
+
+    decoder = Popen(ffmpeg_command, stdout=PIPE, stderr=PIPE)
+    frame_bytes, _ = decoder.communicate()
+
+    # a decode command that this ffmpeg rejects leaves signal state mode
+    # unable to read any video
+    self.assertEqual(decoder.returncode, 0)
+
+    frames = np.frombuffer(frame_bytes, dtype=np.uint8).reshape(
+      (-1, frame_height, frame_width, 3))
+
+    # one frame per second of video, not one per packet
+    self.assertLess(frames.shape[0], num_frames / 10)
+
+    presentation_timestamps = IO.read_anchor_presentation_timestamps(
+      self.video_file_path, 'ffprobe', IO.signalstate_frame_rate)
+
+    self.assertIsNone(presentation_timestamps)
+
+    timestamp_object = Timestamp(timestamp_height, timestamp_max_width)
+    timestamp_object.begin(frames.shape[0], presentation_timestamps,
+                           anchor_interval=8)
+    timestamp_object.update(frames[:, :timestamp_height])
+    timestamps, qa_flags = timestamp_object.finalize()
+
+    frame_number_digits = timestamp_object.recognize_digits(
+      frames[:, 2 * timestamp_height:])
+    frame_numbers = [int(''.join(str(digit) for digit in digits if digit >= 0))
+                     for digits in frame_number_digits.tolist()]
+
+    self.assertEqual(timestamps.tolist(),
+                     [get_timestamp(frame_number)
+                      for frame_number in frame_numbers])
+    self.assertTrue(np.all(qa_flags == Timestamp.QA_READ))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from utils.io import IO
+
+
+def smooth_probs_by_fancy_index(class_probs, smoothing_factor):
+  # the smoother used before all classes were convolved at once, which defines
+  # the edge padding and alignment that IO.smooth_probs must keep
+  weight, window = IO._get_gauss_weight_and_window(smoothing_factor)
+  weight_sum = np.sum(weight)
+  indices = np.arange(class_probs.shape[0] - window)
+  indices = np.expand_dims(indices, axis=1) + np.arange(weight.shape[0])
+  head_padding_len, tail_padding_len = IO._div_odd(window)
+  smoothed_probs = np.ndarray(class_probs.shape)
+  for i in range(class_probs.shape[1]):
+    class_smoothed_probs = np.sum(
+      weight * class_probs[:, i][indices], axis=1) / weight_sum
+    smoothed_probs[:, i] = np.concatenate(
+      (np.ones((head_padding_len,)) * class_smoothed_probs[0],
+       class_smoothed_probs,
+       np.ones((tail_padding_len,)) * class_smoothed_probs[-1]))
+  return smoothed_probs
+
+
+class SmoothProbsTest(unittest.TestCase):
+  def setUp(self):
+    random_state = np.random.RandomState(0)
+    class_probs = random_state.random_sample((2000, 3))
+    self.class_probs = (class_probs / np.sum(
+      class_probs, axis=1, keepdims=True)).astype(np.float32)
+
+  def tearDown(self):
+    IO.clear_smoothed_probs_cache()
+
+  def assert_matches_legacy_smoother(self, smoothing_factor):
+    smoothed_probs = IO.smooth_probs(self.class_probs, smoothing_factor)
+
+    self.assertEqual(smoothed_probs.dtype, np.float32)
+    self.assertEqual(smoothed_probs.shape, self.class_probs.shape)
+    np.testing.assert_allclose(
+      smoothed_probs,
+      smooth_probs_by_fancy_index(self.class_probs, smoothing_factor),
+      rtol=0, atol=1e-5)
+
+  def test_direct_convolution_matches_legacy_smoother(self):
+    smoothing_factor = 16
+    _, window = IO._get_gauss_weight_and_window(smoothing_factor)
+    self.assertLessEqual(window, IO.max_direct_smoothing_window)
+
+    self.assert_matches_legacy_smoother(smoothing_factor)
+
+  def test_fft_convolution_matches_legacy_smoother(self):
+    smoothing_factor = 64
+    _, window = IO._get_gauss_weight_and_window(smoothing_factor)
+    self.assertGreater(window, IO.max_direct_smoothing_window)
+
+    self.assert_matches_legacy_smoother(smoothing_factor)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -10,6 +10,22 @@ from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
 from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
   import PredictionServiceStub
 import tensorflow as tf
+from utils.timestamp import Timestamp
+
+# gRPC channels multiplex concurrent requests and are safe to share between
+# threads, so a worker process reuses one stub per model server and channel
+# options for every video it analyzes
+_prediction_service_stubs = {}
+
+
+def get_prediction_service_stub(model_server_host, options=None):
+  stub_key = (model_server_host, tuple(options or []))
+
+  if stub_key not in _prediction_service_stubs:
+    _prediction_service_stubs[stub_key] = PredictionServiceStub(
+      insecure_channel(model_server_host, options=options))
+
+  return _prediction_service_stubs[stub_key]
 
 
 class VideoAnalyzer:
@@ -18,7 +34,9 @@ class VideoAnalyzer:
       model_signature_name, model_server_host, model_input_size,
       should_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
       timestamp_max_width, should_crop, crop_x, crop_y, crop_width,
-      crop_height, ffmpeg_command, max_num_threads):
+      crop_height, ffmpeg_command, max_num_threads,
+      presentation_timestamps=None, timestamp_anchor_interval=0,
+      timestamp_digit_tolerance=0):
     #### frame generator variables ####
     self.frame_shape = frame_shape
     self.should_crop = should_crop
@@ -33,17 +51,19 @@ class VideoAnalyzer:
     self.should_extract_timestamps = should_extract_timestamps
 
     if self.should_extract_timestamps:
-      self.ti = 0
-
       self.tx = timestamp_x
       self.ty = timestamp_y
       self.th = timestamp_height
       self.tw = timestamp_max_width
 
-      self.timestamp_array = np.ndarray(
-        (self.th * num_frames, self.tw, self.frame_shape[-1]), dtype=np.uint8)
+      # timestamp crops are read as they arrive so that only their integer
+      # values, not the crops themselves, are held for the length of the video
+      self.timestamp = Timestamp(
+        self.th, self.tw, timestamp_digit_tolerance)
+      self.timestamp.begin(num_frames, presentation_timestamps,
+                           timestamp_anchor_interval)
     else:
-      self.timestamp_array = None
+      self.timestamp = None
 
     self.model_input_size = model_input_size
     self.max_num_threads = max_num_threads
@@ -62,8 +82,7 @@ class VideoAnalyzer:
       self.input_name = 'input'
       self.output_name = 'probabilities'
     self.signature_name = model_signature_name
-    self.service_stub = PredictionServiceStub(
-      insecure_channel(model_server_host))
+    self.service_stub = get_prediction_service_stub(model_server_host)
 
     logging.debug('opening video frame pipe')
 
@@ -116,10 +135,9 @@ class VideoAnalyzer:
         frame = np.reshape(frame, self.frame_shape)
 
         if self.should_extract_timestamps:
-          self.timestamp_array[self.th * self.ti:self.th * (self.ti + 1)] = \
-            frame[self.ty:self.ty + self.th,
-            self.tx:self.tx + self.tw]
-          self.ti += 1
+          self.timestamp.update(
+            frame[np.newaxis, self.ty:self.ty + self.th,
+            self.tx:self.tx + self.tw])
 
         if self.should_crop:
           frame = frame[self.crop_y:self.crop_y + self.crop_height,
@@ -176,11 +194,8 @@ class VideoAnalyzer:
         frame = np.reshape(frame, [-1] + self.frame_shape)
 
         if self.should_extract_timestamps:
-          self.timestamp_array[self.th * self.ti:self.th * (
-            self.ti + frame.shape[0])] = \
-            np.reshape(frame[:, self.ty:self.ty + self.th,
-            self.tx:self.tx + self.tw], (-1,) + self.timestamp_array.shape[1:])
-          self.ti += frame.shape[0]
+          self.timestamp.update(
+            frame[:, self.ty:self.ty + self.th, self.tx:self.tx + self.tw])
 
         if self.should_crop:
           frame = frame[:, self.crop_y:self.crop_y + self.crop_height,
@@ -221,24 +236,66 @@ class VideoAnalyzer:
 
     return response.shape[0]  # report num frames processed to caller
 
-  def run(self):
+  def _collect_completed_requests(
+      self, completed_futures, pending_future_map, frame_callback):
+    for future in completed_futures:
+      num_frames_processed = future.result()
+      self.num_frames_processed += num_frames_processed
+      self.completed_batch_map[pending_future_map.pop(future)] = \
+        num_frames_processed
+
+    # batches can complete out of order, so the frontier only advances over
+    # an unbroken run of completed batches
+    num_ordered_frames = self.num_ordered_frames
+
+    while self.num_ordered_frames in self.completed_batch_map:
+      self.num_ordered_frames += self.completed_batch_map.pop(
+        self.num_ordered_frames)
+
+    if frame_callback is not None \
+        and self.num_ordered_frames > num_ordered_frames:
+      frame_callback(self.num_ordered_frames)
+
+  def run(self, frame_callback=None):
+    """Analyze every frame of the video.
+
+    Args:
+      frame_callback: callable. If given, it is called on this thread with
+        the number of leading frames whose probabilities are all available,
+        each time that number grows.
+    """
     logging.info('started inference on {} frames'.format(
       self.prob_array.shape[0]))
 
+    self.completed_batch_map = {}
+    self.num_ordered_frames = 0
+
+    # requests hold decoded frames, so only enough of them to keep every
+    # thread busy are allowed to wait for a response
+    max_num_pending_requests = 2 * self.max_num_threads
+
     with futures.ThreadPoolExecutor(
         max_workers=self.max_num_threads) as executor:
-      future_probs = [executor.submit(
-        self._consume_batch_grpc_request, request, index)
-        for request, index in self._produce_batch_grpc_request()]
+      pending_future_map = {}
+
+      for request, index in self._produce_batch_grpc_request():
+        pending_future_map[executor.submit(
+          self._consume_batch_grpc_request, request, index)] = index
+
+        if len(pending_future_map) >= max_num_pending_requests:
+          completed_futures, _ = futures.wait(
+            pending_future_map, return_when=futures.FIRST_COMPLETED)
+          self._collect_completed_requests(
+            completed_futures, pending_future_map, frame_callback)
 
-      for future in futures.as_completed(future_probs):
-        num_frames_processed = future.result()
-        self.num_frames_processed += num_frames_processed
+      completed_futures, _ = futures.wait(pending_future_map)
+      self._collect_completed_requests(
+        completed_futures, pending_future_map, frame_callback)
 
     logging.info('completed inference on {} frames.'.format(
       self.num_frames_processed))
 
-    return self.num_frames_processed, self.prob_array, self.timestamp_array
+    return self.num_frames_processed, self.prob_array, self.timestamp
 
   def __del__(self):
     if self.frame_pipe.returncode is None:
@@ -0,0 +1,363 @@
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+from time import time
+from utils.io import IO
+from utils.reanalyze import read_report_file_paths
+
+path = os.path
+
+class ResultCatalog:
+  # the columns returned by query_events, in order
+  event_columns = ['file_name', 'report_type', 'sequence_number',
+                   'classification', 'start_frame_number', 'end_frame_number',
+                   'start_timestamp', 'end_timestamp']
+
+  def __init__(self, catalog_file_path, timeout=60):
+    """Create a new 'ResultCatalog' object.
+
+    Args:
+      catalog_file_path: str. The path to the SQLite database in which videos
+        and their events are stored. The file is created if it does not exist.
+      timeout: float. The number of seconds to wait on a lock held by another
+        process (e.g. a concurrent processor) before raising.
+    """
+    self.catalog_file_path = catalog_file_path
+
+    catalog_dir_path = path.dirname(path.abspath(catalog_file_path))
+
+    if not path.exists(catalog_dir_path):
+      os.makedirs(catalog_dir_path)
+
+    self.connection = sqlite3.connect(catalog_file_path, timeout=timeout)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute(
+      'CREATE TABLE IF NOT EXISTS videos ('
+      'video_id INTEGER PRIMARY KEY, file_name TEXT, processor_mode TEXT, '
+      'num_frames INTEGER, num_events INTEGER, cataloged_at REAL, '
+      'UNIQUE (file_name, processor_mode))')
+    self.connection.execute(
+      'CREATE TABLE IF NOT EXISTS events ('
+      'video_id INTEGER REFERENCES videos (video_id), report_type TEXT, '
+      'sequence_number INTEGER, classification TEXT, '
+      'start_frame_number INTEGER, end_frame_number INTEGER, '
+      'start_timestamp INTEGER, end_timestamp INTEGER)')
+    self.connection.execute(
+      'CREATE INDEX IF NOT EXISTS events_video_id ON events (video_id)')
+    self.connection.execute(
+      'CREATE INDEX IF NOT EXISTS events_classification_start_timestamp '
+      'ON events (classification, start_timestamp)')
+    self.connection.execute(
+      'CREATE INDEX IF NOT EXISTS events_start_timestamp '
+      'ON events (start_timestamp)')
+    self.connection.commit()
+
+    # the video whose results are being collected, and its event rows, which
+    # are only written to the catalog once the video is ended
+    self.video = None
+    self.event_rows = []
+
+  def begin_video(self, file_name, processor_mode, num_frames=None):
+    """Start collecting the results of a video. They replace any results
+    that were previously cataloged for it in the same processor mode when
+    end_video is called, and are discarded if it is not."""
+    if self.video is not None:
+      raise ValueError('begin_video was called before end_video for the '
+                       'previous video')
+
+    self.video = (file_name, processor_mode, num_frames)
+    self.event_rows = []
+
+  def add_event_rows(self, rows):
+    """Add rows of the form returned by IO.get_event_report_rows."""
+    self.event_rows.extend(
+      [('workzone', sequence_number, 'work_zone', start_frame_number,
+        end_frame_number, start_timestamp, end_timestamp)
+       for _, sequence_number, start_frame_number, end_frame_number,
+           start_timestamp, end_timestamp in rows])
+
+  def add_weather_rows(self, rows):
+    """Add rows of the form returned by IO.get_weather_report_rows."""
+    self.event_rows.extend(
+      [('weather', sequence_number, classification, start_frame_number,
+        end_frame_number, start_timestamp, end_timestamp)
+       for _, sequence_number, classification, start_frame_number,
+           end_frame_number, start_timestamp, end_timestamp in rows])
+
+  def add_signalstate_rows(self, rows):
+    """Add rows of the form written to signal state reports. Each detection
+    starts and ends on its own frame."""
+    self.event_rows.extend(
+      [('signalstate', None, classification, frame_number, frame_number,
+        timestamp, timestamp)
+       for _, frame_number, timestamp, classification in rows])
+
+  def add_signalstate_event_rows(self, rows):
+    """Add rows of the form returned by
+    IO.get_signalstate_event_report_rows."""
+    self.event_rows.extend(
+      [('signalstate_event', sequence_number, classification,
+        start_frame_number, end_frame_number, start_timestamp, end_timestamp)
+       for _, sequence_number, classification, start_frame_number,
+           end_frame_number, start_timestamp, end_timestamp, _ in rows])
+
+  def end_video(self):
+    """Replace the previously cataloged results of the current video with
+    those collected since begin_video.
+
+    The replacement is a single transaction, so the catalog holds either the
+    old results or the new ones, and other processors only wait on it for as
+    long as it takes to write one video's rows.
+    """
+    file_name, processor_mode, num_frames = self.video
+
+    # the write lock is taken up front, so that no other processor can
+    # catalog the same video between the lookup and the insert
+    self.connection.execute('BEGIN IMMEDIATE')
+
+    try:
+      row = self.connection.execute(
+        'SELECT video_id FROM videos '
+        'WHERE file_name = ? AND processor_mode = ?',
+        (file_name, processor_mode)).fetchone()
+
+      if row is None:
+        video_id = self.connection.execute(
+          'INSERT INTO videos (file_name, processor_mode) VALUES (?, ?)',
+          (file_name, processor_mode)).lastrowid
+      else:
+        video_id = row[0]
+        self.connection.execute(
+          'DELETE FROM events WHERE video_id = ?', (video_id,))
+
+      self.connection.executemany(
+        'INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        [(video_id,) + event_row for event_row in self.event_rows])
+      self.connection.execute(
+        'UPDATE videos SET num_frames = ?, num_events = ?, cataloged_at = ? '
+        'WHERE video_id = ?',
+        (num_frames, len(self.event_rows), time(), video_id))
+      self.connection.commit()
+    except:
+      self.connection.rollback()
+      raise
+    finally:
+      self.video = None
+      self.event_rows = []
+
+  def abort_video(self):
+    """Discard the results collected since begin_video, leaving any that
+    were previously cataloged for the video in place."""
+    self.video = None
+    self.event_rows = []
+
+  def query_events(self, classification=None, report_type=None,
+                   start_timestamp=None, end_timestamp=None, file_name=None):
+    """Find the events that overlap a timestamp range.
+
+    Returns:
+      A list of rows with columns named by event_columns, ordered by file name
+      and start frame number.
+    """
+    conditions = []
+    parameters = []
+
+    if classification is not None:
+      conditions.append('events.classification = ?')
+      parameters.append(classification)
+
+    if report_type is not None:
+      conditions.append('events.report_type = ?')
+      parameters.append(report_type)
+
+    if start_timestamp is not None:
+      conditions.append('events.end_timestamp >= ?')
+      parameters.append(start_timestamp)
+
+    if end_timestamp is not None:
+      conditions.append('events.start_timestamp <= ?')
+      parameters.append(end_timestamp)
+
+    if file_name is not None:
+      conditions.append('videos.file_name = ?')
+      parameters.append(file_name)
+
+    query = 'SELECT videos.file_name, ' + ', '.join(
+      ['events.' + column for column in ResultCatalog.event_columns[1:]]) + \
+            ' FROM events JOIN videos USING (video_id)'
+
+    if len(conditions) > 0:
+      query += ' WHERE ' + ' AND '.join(conditions)
+
+    query += ' ORDER BY videos.file_name, events.start_frame_number'
+
+    return self.connection.execute(query, parameters).fetchall()
+
+  def close(self):
+    """Close the catalog, discarding the results of a video that was begun
+    but not ended."""
+    if self.video is not None:
+      logging.warning('discarding the results of {}, which were not '
+                      'cataloged'.format(self.video[0]))
+      self.abort_video()
+
+    self.connection.close()
+
+
+def catalog_report(result_catalog, report_file_path):
+  """Add the rows of an event, weather or signal state report to the catalog.
+
+  Returns:
+    The number of rows added, or None if the report is of a kind that the
+    catalog does not hold, e.g. an inference report or reanalysis summary.
+  """
+  if report_file_path.endswith(IO.columnar_report_extension):
+    return None
+
+  with IO.open_report_file(report_file_path) as report_file:
+    report_reader = csv.reader(report_file)
+    header = next(report_reader, None)
+    # empty fields stand for missing timestamps
+    rows = [[value if value != '' else None for value in row]
+            for row in report_reader]
+
+  if header == IO.event_report_header:
+    processor_mode = 'workzone'
+    add_rows = result_catalog.add_event_rows
+  elif header == IO.weather_report_header:
+    processor_mode = 'weather'
+    add_rows = result_catalog.add_weather_rows
+  elif header == IO.signalstate_report_header:
+    processor_mode = 'signalstate'
+    add_rows = result_catalog.add_signalstate_rows
+  elif header == IO.signalstate_event_report_header:
+    # tracked signals are cataloged apart from the detections they summarize,
+    # so that neither replaces the other
+    processor_mode = 'signalstate_event'
+    add_rows = result_catalog.add_signalstate_event_rows
+  else:
+    return None
+
+  if len(rows) > 0:
+    file_name = rows[0][0]
+  else:
+    file_name = IO.strip_report_extension(path.basename(report_file_path))
+
+  result_catalog.begin_video(file_name, processor_mode)
+
+  try:
+    add_rows(rows)
+  except:
+    result_catalog.abort_video()
+    raise
+
+  result_catalog.end_video()
+
+  return len(rows)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Catalog SNVA event reports in SQLite, and query the catalog')
+
+  subparsers = parser.add_subparsers(dest='command')
+  subparsers.required = True
+
+  ingest_parser = subparsers.add_parser(
+    'ingest', help='Add existing event, weather and signal state reports to '
+                   'the catalog')
+  ingest_parser.add_argument('--inputpath', '-ip', required=True,
+                             help='Path to a folder of event reports '
+                                  '(searched recursively), or a text file '
+                                  'that lists event report file paths.')
+
+  query_parser = subparsers.add_parser(
+    'query', help='Write the cataloged events that match all given criteria '
+                  'as CSV')
+  query_parser.add_argument('--classification', '-c', default=None,
+                            help='e.g. \'work_zone\', or a weather or signal '
+                                 'state class name.')
+  query_parser.add_argument('--reporttype', '-rt', default=None,
+                            choices=['workzone', 'weather', 'signalstate',
+                                     'signalstate_event'])
+  query_parser.add_argument('--starttimestamp', '-st', type=int, default=None,
+                            help='Only return events that end at or after '
+                                 'this timestamp.')
+  query_parser.add_argument('--endtimestamp', '-et', type=int, default=None,
+                            help='Only return events that start at or before '
+                                 'this timestamp.')
+  query_parser.add_argument('--filename', '-fn', default=None,
+                            help='Only return events from this video.')
+  query_parser.add_argument('--outputpath', '-op', default=None,
+                            help='Path to the CSV file in which events are '
+                                 'written. Defaults to standard output.')
+
+  for subparser in [ingest_parser, query_parser]:
+    subparser.add_argument('--resultcatalogpath', '-rcp', required=True,
+                           help='Path to the SQLite result catalog file.')
+    subparser.add_argument('--loglevel', '-ll', default='info',
+                           help='Defaults to \'info\'. Pass \'debug\' or '
+                                '\'error\' for verbose or minimal logging, '
+                                'respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  start = time()
+
+  result_catalog = ResultCatalog(args.resultcatalogpath)
+
+  if args.command == 'ingest':
+    report_file_paths = read_report_file_paths(args.inputpath)
+
+    num_rows = 0
+    num_reports = 0
+    num_failures = 0
+
+    for report_file_path in report_file_paths:
+      try:
+        num_report_rows = catalog_report(result_catalog, report_file_path)
+      except Exception as e:
+        num_failures += 1
+        logging.error('failed to catalog {}: {}'.format(report_file_path, e))
+        continue
+
+      if num_report_rows is None:
+        logging.debug('skipping {}, which is not an event, weather or signal '
+                      'state report'.format(report_file_path))
+      else:
+        num_rows += num_report_rows
+        num_reports += 1
+
+    logging.info(IO.get_processing_duration(
+      time() - start, 'cataloged {} events from {} reports ({} failures, {} '
+                      'other reports skipped) in'.format(
+        num_rows, num_reports, num_failures,
+        len(report_file_paths) - num_reports - num_failures)))
+  else:
+    rows = result_catalog.query_events(
+      args.classification, args.reporttype, args.starttimestamp,
+      args.endtimestamp, args.filename)
+
+    if args.outputpath is None:
+      csv_writer = csv.writer(sys.stdout)
+      csv_writer.writerow(ResultCatalog.event_columns)
+      csv_writer.writerows(rows)
+    else:
+      IO.write_csv(args.outputpath, ResultCatalog.event_columns, rows)
+
+    logging.info(IO.get_processing_duration(
+      time() - start, 'found {} events in'.format(len(rows))))
+
+  result_catalog.close()
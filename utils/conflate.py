@@ -0,0 +1,429 @@
+import argparse
+import csv
+from itertools import islice
+import logging
+import numpy as np
+import os
+from time import time
+from utils.io import IO
+from utils.reanalyze import read_report_file_paths
+
+path = os.path
+
+
+def read_telemetry(telemetry_file_path, timestamp_column_name='timestamp',
+                   value_column_names=None, chunk_size=None,
+                   key_column_name=None):
+  """Read a telemetry table, e.g. exported RID time series, from a CSV file
+  and sort it by key, if given, and timestamp.
+
+  Args:
+    telemetry_file_path: str. The path to the (optionally compressed) CSV
+      file.
+    timestamp_column_name: str. The column of timestamps, on the same clock
+      and in the same units as event report timestamps.
+    value_column_names: list. The numeric columns to summarize. Defaults to
+      every column but the timestamp column that holds a number.
+    chunk_size: int. The number of rows to parse at a time. Defaults to
+      IO.report_read_chunk_size.
+    key_column_name: str. The column that names the video (or trip) that each
+      row belongs to, matching the file_name column of event reports.
+
+  Returns:
+    A tuple of sorted timestamps, an (n, len(value_column_names)) float64
+    array of the values in the same order, value_column_names, and the rows'
+    keys in the same order, or None if key_column_name is not given. Empty or
+    non-numeric values are NaN.
+  """
+  if chunk_size is None:
+    chunk_size = IO.report_read_chunk_size
+
+  with IO.open_report_file(telemetry_file_path) as telemetry_file:
+    header = next(csv.reader([telemetry_file.readline()]))
+
+    for column_name in [timestamp_column_name, key_column_name]:
+      if column_name is not None and column_name not in header:
+        raise ValueError('{} has no {} column'.format(
+          telemetry_file_path, column_name))
+
+    is_value_column_given = value_column_names is not None
+
+    if not is_value_column_given:
+      value_column_names = [
+        column_name for column_name in header
+        if column_name not in [timestamp_column_name, key_column_name]]
+
+    col_nums = [header.index(timestamp_column_name)] + [
+      header.index(column_name) for column_name in value_column_names]
+
+    telemetry_chunks = []
+    key_chunks = []
+
+    while True:
+      telemetry_lines = [line for line in islice(telemetry_file, chunk_size)
+                         if line.strip()]
+
+      if len(telemetry_lines) > 0:
+        telemetry_chunks.append(np.genfromtxt(
+          telemetry_lines, dtype=np.float64, delimiter=',',
+          usecols=col_nums).reshape((len(telemetry_lines), len(col_nums))))
+
+        if key_column_name is not None:
+          key_col_num = header.index(key_column_name)
+          key_chunks.append(np.array(
+            [row[key_col_num] for row in csv.reader(telemetry_lines)],
+            dtype=np.str_))
+      else:
+        break
+
+  if len(telemetry_chunks) > 0:
+    telemetry_data = np.concatenate(telemetry_chunks)
+  else:
+    telemetry_data = np.zeros((0, len(col_nums)), dtype=np.float64)
+
+  if key_column_name is not None and len(key_chunks) > 0:
+    keys = np.concatenate(key_chunks)
+  elif key_column_name is not None:
+    keys = np.zeros(0, dtype=np.str_)
+  else:
+    keys = None
+
+  has_timestamp = ~np.isnan(telemetry_data[:, 0])
+  telemetry_data = telemetry_data[has_timestamp]
+
+  # each key's rows form one contiguous run, sorted by timestamp
+  if keys is not None:
+    keys = keys[has_timestamp]
+    telemetry_order = np.lexsort((telemetry_data[:, 0], keys))
+    keys = keys[telemetry_order]
+  else:
+    telemetry_order = np.argsort(telemetry_data[:, 0], kind='stable')
+
+  telemetry_data = telemetry_data[telemetry_order]
+
+  timestamps = telemetry_data[:, 0]
+  telemetry_values = telemetry_data[:, 1:]
+
+  if not is_value_column_given:
+    is_numeric = ~np.all(np.isnan(telemetry_values), axis=0)
+    telemetry_values = telemetry_values[:, is_numeric]
+    value_column_names = [column_name for column_name, numeric in zip(
+      value_column_names, is_numeric.tolist()) if numeric]
+
+  # integral timestamps are written back as integers
+  if np.array_equal(timestamps, np.floor(timestamps)):
+    timestamps = timestamps.astype(np.int64)
+
+  return timestamps, telemetry_values, value_column_names, keys
+
+
+def read_events(report_file_paths):
+  """Read the events of work zone event, weather and signal state event
+  reports. Other reports, e.g. inference reports, signal state detection
+  reports or reanalysis summaries, are skipped.
+
+  Returns:
+    A tuple of event rows, each a list of file_name, sequence_number,
+    classification, start_frame_number, end_frame_number, start_timestamp
+    and end_timestamp strings, and float64 arrays of their start and end
+    timestamps in which missing timestamps are NaN.
+  """
+  event_rows = []
+
+  for report_file_path in report_file_paths:
+    if report_file_path.endswith(IO.columnar_report_extension):
+      logging.warning('skipping {}, which is not an event report'.format(
+        report_file_path))
+      continue
+
+    with IO.open_report_file(report_file_path) as report_file:
+      report_reader = csv.reader(report_file)
+      header = next(report_reader, None)
+
+      if header == IO.event_report_header:
+        event_rows.extend(
+          [row[:2] + ['work_zone'] + row[2:] for row in report_reader])
+      elif header == IO.weather_report_header:
+        event_rows.extend(report_reader)
+      elif header == IO.signalstate_event_report_header:
+        event_rows.extend([row[:7] for row in report_reader])
+      else:
+        logging.warning('skipping {}, which is not an event report'.format(
+          report_file_path))
+
+  if len(event_rows) > 0:
+    timestamps = np.array(
+      [[row[5], row[6]] for row in event_rows], dtype=np.str_)
+    timestamps[timestamps == ''] = 'nan'
+    timestamps = timestamps.astype(np.float64)
+  else:
+    timestamps = np.zeros((0, 2), dtype=np.float64)
+
+  return event_rows, timestamps[:, 0], timestamps[:, 1]
+
+
+def join_intervals(start_timestamps, end_timestamps, telemetry_timestamps,
+                   telemetry_values, tolerance=0, event_keys=None,
+                   telemetry_keys=None):
+  """Find the telemetry rows that fall within each event and summarize them.
+
+  Telemetry must be sorted by key, if given, and timestamp. Each event's rows
+  are located by a binary search on both of its ends within the rows of its
+  key, and every statistic is computed for all events at once from
+  cumulative sums or a single reduction, so the cost grows with the number
+  of events and telemetry rows, not their product.
+
+  Args:
+    start_timestamps: float array. Missing timestamps are NaN.
+    end_timestamps: float array.
+    telemetry_timestamps: array. Sorted in ascending order.
+    telemetry_values: float array. One row per telemetry timestamp and one
+      column per summarized value. NaN values are ignored.
+    tolerance: number. Telemetry rows up to this far before an event starts
+      or after it ends are included.
+    event_keys: str array. The video (or trip) of each event. If given, an
+      event is only joined with the telemetry rows of the same key.
+    telemetry_keys: str array. The key of each telemetry row, sorted in
+      ascending order. Required if event_keys is given.
+
+  Returns:
+    A dict of arrays with one element (or row) per event: 'first_row' and
+    'last_row' indices (last_row is exclusive), 'num_rows', and for each
+    value column its 'start' and 'end' values, 'min', 'max' and 'mean', each
+    an (n, num_columns) array that is NaN where an event has no rows.
+  """
+  num_events = len(start_timestamps)
+  num_rows, num_columns = telemetry_values.shape
+
+  # events with missing timestamps sort after all telemetry and find no rows
+  if event_keys is None:
+    first_rows = np.searchsorted(
+      telemetry_timestamps, start_timestamps - tolerance, side='left')
+    last_rows = np.searchsorted(
+      telemetry_timestamps, end_timestamps + tolerance, side='right')
+  else:
+    first_rows = np.zeros(num_events, dtype=np.intp)
+    last_rows = np.zeros(num_events, dtype=np.intp)
+
+    # the contiguous range of telemetry rows of each event's key, which is
+    # empty for keys without telemetry
+    key_first_rows = np.searchsorted(telemetry_keys, event_keys, side='left')
+    key_last_rows = np.searchsorted(telemetry_keys, event_keys, side='right')
+
+    # events are grouped by key, and each group searched within its range
+    key_indices = np.unique(event_keys, return_inverse=True)[1].ravel()
+    event_order = np.argsort(key_indices, kind='stable')
+    group_bounds = np.flatnonzero(np.diff(key_indices[event_order])) + 1
+
+    for group in np.split(event_order, group_bounds):
+      if len(group) == 0:
+        continue
+
+      key_first_row = key_first_rows[group[0]]
+      key_timestamps = telemetry_timestamps[
+        key_first_row:key_last_rows[group[0]]]
+
+      first_rows[group] = key_first_row + np.searchsorted(
+        key_timestamps, start_timestamps[group] - tolerance, side='left')
+      last_rows[group] = key_first_row + np.searchsorted(
+        key_timestamps, end_timestamps[group] + tolerance, side='right')
+
+  last_rows = np.maximum(last_rows, first_rows)
+
+  num_event_rows = last_rows - first_rows
+  has_rows = num_event_rows > 0
+
+  join = {'first_row': first_rows, 'last_row': last_rows,
+          'num_rows': num_event_rows}
+
+  if num_rows == 0:
+    missing_values = np.full((num_events, num_columns), np.nan)
+
+    for statistic in ['start', 'end', 'min', 'max', 'mean']:
+      join[statistic] = missing_values.copy()
+
+    return join
+
+  is_valid = ~np.isnan(telemetry_values)
+
+  start_indices = np.minimum(first_rows, num_rows - 1)
+  end_indices = np.maximum(last_rows - 1, 0)
+
+  join['start'] = np.where(
+    has_rows[:, np.newaxis], telemetry_values[start_indices], np.nan)
+  join['end'] = np.where(
+    has_rows[:, np.newaxis], telemetry_values[end_indices], np.nan)
+
+  zeros = np.zeros((1, num_columns))
+
+  value_sums = np.concatenate(
+    [zeros, np.cumsum(np.where(is_valid, telemetry_values, 0.), axis=0)])
+  value_counts = np.concatenate(
+    [zeros, np.cumsum(is_valid, axis=0, dtype=np.float64)])
+
+  event_sums = value_sums[last_rows] - value_sums[first_rows]
+  event_counts = value_counts[last_rows] - value_counts[first_rows]
+  has_values = event_counts > 0
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    join['mean'] = np.where(has_values, event_sums / event_counts, np.nan)
+
+  # reduceat over interleaved (first, last) indices reduces each event's rows
+  # at even positions. A trailing sentinel row keeps last indices in bounds,
+  # and the results for events without values are discarded.
+  reduce_indices = np.column_stack([first_rows, last_rows]).ravel()
+
+  for statistic, reduce_function, fill_value in [
+      ('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)]:
+    padded_values = np.concatenate(
+      [np.where(is_valid, telemetry_values, fill_value),
+       np.full((1, num_columns), fill_value)])
+
+    if num_events > 0:
+      reduced_values = reduce_function.reduceat(
+        padded_values, reduce_indices, axis=0)[::2]
+    else:
+      reduced_values = np.zeros((0, num_columns))
+
+    join[statistic] = np.where(has_values, reduced_values, np.nan)
+
+  return join
+
+
+def _format_fields(values, is_present):
+  return [value if present else ''
+          for value, present in zip(values.tolist(), is_present.tolist())]
+
+
+def conflate(report_file_paths, telemetry_file_path,
+             timestamp_column_name='timestamp', value_column_names=None,
+             tolerance=0, key_column_name=None):
+  """Attach the range and summary statistics of each telemetry value column
+  to every event in the given event reports.
+
+  Args:
+    key_column_name: str. The telemetry column that names the video of each
+      row, matching the file_name column of event reports. If given, events
+      are only joined with the telemetry of their own video. Otherwise all
+      events are joined with the whole table, which is only meaningful if
+      the reports and telemetry cover a single trip.
+
+  Returns:
+    A header and rows ordered by event start timestamp. Events without
+    timestamps come last.
+  """
+  telemetry_timestamps, telemetry_values, value_column_names, \
+    telemetry_keys = read_telemetry(
+      telemetry_file_path, timestamp_column_name, value_column_names,
+      key_column_name=key_column_name)
+
+  event_rows, start_timestamps, end_timestamps = read_events(
+    report_file_paths)
+
+  event_keys = np.array([row[0] for row in event_rows], dtype=np.str_)
+
+  if telemetry_keys is None and len(np.unique(event_keys)) > 1:
+    logging.warning('events of {} videos are joined with one telemetry table '
+                    'by timestamp alone. Pass a key column to join each with '
+                    'its own telemetry'.format(len(np.unique(event_keys))))
+
+  event_order = np.argsort(start_timestamps, kind='stable')
+  start_timestamps = start_timestamps[event_order]
+  end_timestamps = end_timestamps[event_order]
+
+  join = join_intervals(
+    start_timestamps, end_timestamps, telemetry_timestamps, telemetry_values,
+    tolerance, event_keys[event_order] if telemetry_keys is not None else None,
+    telemetry_keys)
+
+  has_rows = join['num_rows'] > 0
+
+  if len(telemetry_timestamps) > 0:
+    first_timestamps = telemetry_timestamps[
+      np.minimum(join['first_row'], len(telemetry_timestamps) - 1)]
+    last_timestamps = telemetry_timestamps[
+      np.maximum(join['last_row'] - 1, 0)]
+  else:
+    first_timestamps = last_timestamps = np.zeros(len(event_rows))
+
+  columns = [join['num_rows'].tolist(),
+             _format_fields(first_timestamps, has_rows),
+             _format_fields(last_timestamps, has_rows)]
+
+  header = IO.weather_report_header + [
+    'num_telemetry_rows', 'first_telemetry_timestamp',
+    'last_telemetry_timestamp']
+
+  for column_num, column_name in enumerate(value_column_names):
+    for statistic in ['start', 'end', 'min', 'max', 'mean']:
+      header.append('{}_{}'.format(column_name, statistic))
+      column = join[statistic][:, column_num]
+      columns.append(_format_fields(column, ~np.isnan(column)))
+
+  rows = [event_rows[event_index] + list(fields)
+          for event_index, fields in zip(event_order.tolist(), zip(*columns))]
+
+  return header, rows
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Join SNVA event reports with a telemetry time series by '
+                'timestamp, and summarize the telemetry within each event')
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to a folder of event, weather or signal '
+                           'state event reports (searched recursively), or a '
+                           'text file that lists event report file paths.')
+  parser.add_argument('--telemetrypath', '-tp', required=True,
+                      help='Path to a CSV file of telemetry, e.g. RID time '
+                           'series, with one row per timestamp.')
+  parser.add_argument('--timestampcolumn', '-tc', default='timestamp',
+                      help='The telemetry column whose timestamps are '
+                           'compared with event timestamps.')
+  parser.add_argument('--keycolumn', '-kc', default=None,
+                      help='The telemetry column that names the video of '
+                           'each row, matching the file_name column of event '
+                           'reports. Required to conflate the reports of '
+                           'more than one video.')
+  parser.add_argument('--valuecolumns', '-vc', nargs='+', default=None,
+                      help='The numeric telemetry columns to summarize. '
+                           'Defaults to all but the timestamp column.')
+  parser.add_argument('--tolerance', '-t', type=float, default=0,
+                      help='Include telemetry up to this far (in timestamp '
+                           'units) before an event starts or after it ends.')
+  parser.add_argument('--outputpath', '-op',
+                      default='./reports/conflated_events.csv',
+                      help='Path to the CSV file in which conflated events '
+                           'are written.')
+  parser.add_argument('--loglevel', '-ll', default='info',
+                      help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
+                           'for verbose or minimal logging, respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  start = time()
+
+  header, rows = conflate(
+    read_report_file_paths(args.inputpath), args.telemetrypath,
+    args.timestampcolumn, args.valuecolumns, args.tolerance, args.keycolumn)
+
+  output_dir_path = path.dirname(path.abspath(args.outputpath))
+
+  if not path.exists(output_dir_path):
+    os.makedirs(output_dir_path)
+
+  output_file_path = IO.write_csv(args.outputpath, header, rows)
+
+  logging.info(IO.get_processing_duration(
+    time() - start, 'conflated {} events in'.format(len(rows))))
+  logging.info('wrote conflated events to {}'.format(output_file_path))
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import logging
+import os
+from time import time
+from utils.io import IO
+from utils.reanalyze import is_report_file_name, read_report_file_paths
+
+path = os.path
+
+
+def convert_csv_to_columnar(report_file_path, output_dir_path):
+  with IO.open_report_file(report_file_path) as report_file:
+    report_reader = csv.reader(report_file)
+    header = next(report_reader)
+    first_row = next(report_reader, None)
+
+  report_file_name = IO.strip_report_extension(
+    path.basename(report_file_path))
+
+  if first_row is not None:
+    report_file_name = first_row[0]
+
+  has_timestamps = header[2:4] == ['frame_timestamp', 'qa_flag']
+  data_col_range = (4 if has_timestamps else 2, len(header))
+
+  _, report_data = IO.read_report(
+    report_file_path, frame_col_num=1,
+    timestamp_col_num=2 if has_timestamps else None,
+    qa_flag_col_num=3 if has_timestamps else None,
+    data_col_range=data_col_range)
+
+  output_file_path = path.join(
+    output_dir_path, IO.strip_report_extension(
+      path.basename(report_file_path)) + IO.columnar_report_extension)
+
+  IO.write_columnar_inference_report(
+    output_file_path, report_file_name,
+    header[data_col_range[0]:data_col_range[1]],
+    report_data['probabilities'], report_data['frame_numbers'],
+    report_data.get('frame_timestamps'), report_data.get('qa_flag'))
+
+  return output_file_path
+
+
+def convert_columnar_to_csv(report_file_path, output_dir_path):
+  metadata, columns = IO.read_columnar_report(report_file_path)
+
+  output_file_path = path.join(
+    output_dir_path, IO.strip_report_extension(
+      path.basename(report_file_path)) + '.csv')
+
+  IO.write_csv_inference_report(
+    output_file_path, metadata['file_name'], metadata['probability_names'],
+    columns['probabilities'], columns['frame_number'],
+    columns.get('frame_timestamp'), columns.get('qa_flag'))
+
+  return output_file_path
+
+
+def convert_report(report_file_path, output_dir_path):
+  """Convert a CSV inference report to a columnar one, or a columnar report
+  to CSV, depending on the format of the given report."""
+  if not path.exists(output_dir_path):
+    os.makedirs(output_dir_path)
+
+  if IO.is_columnar_report(report_file_path):
+    return convert_columnar_to_csv(report_file_path, output_dir_path)
+  else:
+    return convert_csv_to_columnar(report_file_path, output_dir_path)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Convert SNVA inference reports between CSV and the columnar '
+                'binary format')
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to an inference report, a folder of inference '
+                           'reports (searched recursively), or a text file that '
+                           'lists inference report file paths.')
+  parser.add_argument('--outputpath', '-op', required=True,
+                      help='Path to the folder in which converted reports are '
+                           'written.')
+  parser.add_argument('--loglevel', '-ll', default='info',
+                      help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
+                           'for verbose or minimal logging, respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  if path.isfile(args.inputpath) and is_report_file_name(
+      path.basename(args.inputpath)):
+    report_file_paths = [args.inputpath]
+  else:
+    report_file_paths = read_report_file_paths(args.inputpath)
+
+  start = time()
+
+  num_failures = 0
+
+  for report_file_path in report_file_paths:
+    try:
+      logging.debug('converted {} to {}'.format(
+        report_file_path, convert_report(report_file_path, args.outputpath)))
+    except Exception as e:
+      num_failures += 1
+      logging.error('failed to convert {}: {}'.format(report_file_path, e))
+
+  logging.info(IO.get_processing_duration(
+    time() - start, 'converted {} reports ({} failures) in'.format(
+      len(report_file_paths) - num_failures, num_failures)))
@@ -6,6 +6,11 @@ path = os.path
 
 
 class Feature:
+  __slots__ = ['feature_id', 'class_id', 'class_name', 'start_timestamp',
+               'end_timestamp', 'start_timestamp_qa_flag',
+               'end_timestamp_qa_flag', 'start_frame_number',
+               'end_frame_number', 'event_id', 'length']
+
   def __init__(self, feature_id, class_id, class_name, start_timestamp,
                end_timestamp, start_timestamp_qa_flag, end_timestamp_qa_flag,
                start_frame_number, end_frame_number, event_id=None):
@@ -58,6 +63,56 @@ class Feature:
     return print_string
 
 
+# one row per run of consecutive frames that share a predicted class
+feature_table_dtype = np.dtype([
+  ('feature_id', np.int32), ('class_id', np.int32),
+  ('start_timestamp', np.int32), ('end_timestamp', np.int32),
+  ('start_timestamp_qa_flag', np.uint8), ('end_timestamp_qa_flag', np.uint8),
+  ('start_frame_number', np.int64), ('end_frame_number', np.int64),
+  ('length', np.int64)])
+
+
+def segment_features(report_frame_numbers, report_class_ids,
+                     report_timestamps=None, qa_flags=None):
+  """Run-length encode a per-frame class sequence into a feature table.
+
+  Returns:
+    A structured array of dtype feature_table_dtype. Timestamp and QA fields
+    are zero if report_timestamps is None.
+  """
+  report_frame_numbers = np.asarray(report_frame_numbers)
+  report_class_ids = np.asarray(report_class_ids)
+
+  num_frames = report_class_ids.shape[0]
+
+  if num_frames == 0:
+    return np.zeros((0,), dtype=feature_table_dtype)
+
+  start_indices = np.concatenate(
+    ([0], np.flatnonzero(np.diff(report_class_ids)) + 1))
+  end_indices = np.concatenate((start_indices[1:] - 1, [num_frames - 1]))
+
+  feature_table = np.zeros(start_indices.shape, dtype=feature_table_dtype)
+
+  feature_table['feature_id'] = np.arange(start_indices.shape[0])
+  feature_table['class_id'] = report_class_ids[start_indices]
+  feature_table['start_frame_number'] = report_frame_numbers[start_indices]
+  feature_table['end_frame_number'] = report_frame_numbers[end_indices]
+  feature_table['length'] = feature_table['end_frame_number'] - \
+                            feature_table['start_frame_number']
+
+  if report_timestamps is not None:
+    report_timestamps = np.asarray(report_timestamps)
+    qa_flags = np.asarray(qa_flags)
+
+    feature_table['start_timestamp'] = report_timestamps[start_indices]
+    feature_table['end_timestamp'] = report_timestamps[end_indices]
+    feature_table['start_timestamp_qa_flag'] = qa_flags[start_indices]
+    feature_table['end_timestamp_qa_flag'] = qa_flags[end_indices]
+
+  return feature_table
+
+
 class Event:
   def __init__(self, event_id, target_feature_list, preceding_feature=None,
                following_feature=None):
@@ -134,6 +189,252 @@ class Event:
     return print_string
 
 
+class EventQuery:
+  def __init__(self, name, target_feature_class_names=None,
+               target_feature_class_ids=None, preceding_feature_class_name=None,
+               preceding_feature_class_id=None, following_feature_class_name=None,
+               following_feature_class_id=None, non_event_weight_scale=0.05,
+               minimum_event_length=100):
+    """Create a new 'EventQuery' object.
+
+    Args:
+      name: str. The key under which EventQueryEngine.run returns the events
+        found by this query.
+      target_feature_class_names: list. The names of the classes whose
+        features make up an event. Ignored if target_feature_class_ids is
+        given.
+      target_feature_class_ids: list. The ids of the classes whose features
+        make up an event, as keys of the trip's class name map. Takes
+        precedence over target_feature_class_names.
+      preceding_feature_class_name: str. The name of a class whose feature
+        should be included in an event if it occurs just before it. Ignored
+        if preceding_feature_class_id is given.
+      preceding_feature_class_id: int. The id of the preceding feature class.
+        Takes precedence over preceding_feature_class_name.
+      following_feature_class_name: str. The name of a class whose feature
+        should be included in an event if it occurs just after it. Ignored if
+        following_feature_class_id is given.
+      following_feature_class_id: int. The id of the following feature class.
+        Takes precedence over following_feature_class_name.
+      non_event_weight_scale: float. The fraction of the length of a
+        non-target feature that counts against the event it interrupts.
+      minimum_event_length: int. The minimum number of frames in an event.
+    """
+    self.name = name
+    self.target_feature_class_names = target_feature_class_names
+    self.target_feature_class_ids = target_feature_class_ids
+    self.preceding_feature_class_name = preceding_feature_class_name
+    self.preceding_feature_class_id = preceding_feature_class_id
+    self.following_feature_class_name = following_feature_class_name
+    self.following_feature_class_id = following_feature_class_id
+    self.non_event_weight_scale = non_event_weight_scale
+    self.minimum_event_length = minimum_event_length
+
+
+class EventQueryEngine:
+  def __init__(self, queries=None):
+    """Create a new 'EventQueryEngine' object.
+
+    Evaluates every registered EventQuery over the feature table of a Trip.
+    The arrays that queries derive from the table, e.g. the positions and
+    weights of their target features, are computed once per distinct set of
+    classes and shared by every query that uses it.
+    """
+    self.queries = []
+
+    if queries is not None:
+      for query in queries:
+        self.register(query)
+
+  def register(self, query):
+    if any(query.name == registered_query.name
+           for registered_query in self.queries):
+      raise ValueError('an event query named {} is already '
+                       'registered'.format(query.name))
+
+    self.queries.append(query)
+
+  def run(self, trip, share_features=False):
+    """Find the events of every registered query in trip.
+
+    Args:
+      trip: Trip.
+      share_features: bool. Whether events are built from the trip's own
+        Feature objects (see Trip.get_feature). Each query otherwise gets
+        Feature objects of its own, since event detection assigns features to
+        events.
+
+    Returns:
+      A dict mapping each query name to the list of events it found.
+    """
+    feature_arrays = _FeatureArrays(trip.feature_table)
+
+    events = {}
+
+    for query in self.queries:
+      if share_features:
+        get_feature = trip.get_feature
+      else:
+        get_feature = trip._make_feature_getter()
+
+      events[query.name] = trip._find_query_events(
+        trip._resolve_query(query), feature_arrays, get_feature,
+        share_features)
+
+    return events
+
+
+class _FeatureArrays:
+  def __init__(self, feature_table):
+    """Create a new '_FeatureArrays' object.
+
+    Holds the feature table columns that event queries read, and memoizes the
+    arrays derived from them so that queries with the same classes share
+    them.
+    """
+    self.num_features = feature_table.shape[0]
+    self.class_ids = feature_table['class_id']
+    self.lengths = feature_table['length']
+    self.start_frame_numbers = feature_table['start_frame_number']
+    self.end_frame_numbers = feature_table['end_frame_number']
+    self.start_timestamps = feature_table['start_timestamp']
+    self.end_timestamps = feature_table['end_timestamp']
+
+    self._indices = {}
+    self._weights = {}
+
+  def get_indices(self, class_ids):
+    """Return a _FeatureIndex of the features whose class is one of
+    class_ids."""
+    key = frozenset(class_ids)
+
+    if key not in self._indices:
+      self._indices[key] = _FeatureIndex(
+        np.isin(self.class_ids, list(key)))
+
+    return self._indices[key]
+
+  def get_weights(self, target_class_ids, weight_scale):
+    """Return the amount by which each feature changes the weight of an
+    event: its length if its class is a target class, and weight_scale times
+    its length against the event otherwise.
+
+    Returns:
+      A tuple of a float64 array of the weights and the same weights in a
+      list, which is faster to read one at a time.
+    """
+    key = (frozenset(target_class_ids), weight_scale)
+
+    if key not in self._weights:
+      is_target = self.get_indices(target_class_ids).mask
+
+      lengths = self.lengths.astype(np.float64)
+
+      weights = np.where(is_target, lengths, -(weight_scale * lengths))
+
+      self._weights[key] = (weights, weights.tolist())
+
+    return self._weights[key]
+
+
+class _FeatureIndex:
+  def __init__(self, mask):
+    """Create a new '_FeatureIndex' object.
+
+    Args:
+      mask: bool array. Whether each feature of a trip is indexed.
+    """
+    self.mask = mask
+    self.indices = np.flatnonzero(mask)
+    self._index_list = self.indices.tolist()
+    self._num_indices = len(self._index_list)
+
+    # the number of indexed features before each position, so that a search
+    # is a lookup rather than a binary search
+    self._counts = np.concatenate(([0], np.cumsum(mask, dtype=np.intp)))
+
+  def get_next(self, feature_index):
+    """Return the first indexed feature at or after feature_index, or None
+    if there is none."""
+    count = self._counts[feature_index]
+
+    return self._index_list[count] if count < self._num_indices else None
+
+  def get_previous(self, feature_index):
+    """Return the last indexed feature at or before feature_index, or None
+    if there is none."""
+    count = self._counts[feature_index + 1]
+
+    return self._index_list[count - 1] if count > 0 else None
+
+  def get_between(self, first_index, stop_index):
+    """Return a list of the indexed features from first_index up to, but
+    not including, stop_index."""
+    return self._index_list[
+      self._counts[first_index]:self._counts[stop_index]]
+
+  def get_array_between(self, first_index, stop_index):
+    return self.indices[self._counts[first_index]:self._counts[stop_index]]
+
+
+def _find_weight_break(weights, first_index, last_index, weight,
+                       window_size=64):
+  """Find where an event that starts at feature first_index loses all of
+  its weight.
+
+  The event's running weight is accumulated one feature at a time over the
+  first window, which most events end within, and then in windows of
+  doubling size. Weights are added in the same order as a feature-by-feature
+  scan, so the result does not depend on floating point rounding, and the
+  work is proportional to the length of the event rather than the trip.
+
+  Args:
+    weights: tuple. As returned by _FeatureArrays.get_weights.
+    first_index: int. The event's first (target) feature.
+    last_index: int. The last feature that the event may include.
+    weight: float. The weight carried into the event.
+
+  Returns:
+    A tuple of the index of the first feature after first_index at which the
+    running weight is no longer positive, or last_index if there is none,
+    and the running weight at that feature.
+  """
+  weights, weight_list = weights
+
+  # the first feature's own weight is never checked
+  weight += weight_list[first_index]
+
+  feature_index = first_index + 1
+  stop_index = min(first_index + window_size, last_index + 1)
+
+  while feature_index < stop_index:
+    weight += weight_list[feature_index]
+
+    if weight <= 0:
+      return feature_index, weight
+
+    feature_index += 1
+
+  while feature_index <= last_index:
+    window_size *= 2
+    stop_index = min(feature_index + window_size, last_index + 1)
+
+    running_weights = np.cumsum(
+      np.concatenate(([weight], weights[feature_index:stop_index])))[1:]
+
+    break_offsets = np.flatnonzero(running_weights <= 0)
+
+    if len(break_offsets) > 0:
+      offset = int(break_offsets[0])
+
+      return feature_index + offset, float(running_weights[offset])
+
+    weight = float(running_weights[-1])
+    feature_index = stop_index
+
+  return last_index, weight
+
+
 class Trip:
   def __init__(self, report_frame_numbers, report_timestamps, qa_flags,
                report_probs, class_name_map, non_event_weight_scale=0.05,
@@ -143,78 +444,92 @@ class Trip:
 
     report_class_ids = np.argmax(report_probs, axis=1)
 
-    self.feature_sequence = []
+    self.has_timestamps = report_timestamps is not None
 
-    feature_id = 0
-    class_id = report_class_ids[0]
+    self.feature_table = segment_features(
+      report_frame_numbers, report_class_ids, report_timestamps, qa_flags)
 
-    if report_timestamps is not None:
-      start_timestamp = report_timestamps[0]
-      start_timestamp_qa_flag = qa_flags[0]
-    else:
-      start_timestamp = None
-      start_timestamp_qa_flag = None
-
-    start_frame_number = report_frame_numbers[0]
-
-    for i in range(1, len(report_class_ids)):
-      if report_class_ids[i] != class_id:
-        if report_timestamps is not None:
-          end_timestamp = report_timestamps[i - 1]
-          end_timestamp_qa_flag = qa_flags[i - 1]
-        else:
-          end_timestamp = None
-          end_timestamp_qa_flag = None
-
-        end_frame_number = report_frame_numbers[i - 1]
-
-        # the beginning of the next feature has been reached.
-        # create an object for the preceding feature.
-        self.feature_sequence.append(Feature(
-          feature_id, class_id, self.class_names[class_id], start_timestamp,
-          end_timestamp, start_timestamp_qa_flag, end_timestamp_qa_flag,
-          start_frame_number, end_frame_number))
-
-        feature_id += 1
-
-        class_id = report_class_ids[i]
-
-        if report_timestamps is not None:
-          start_timestamp = report_timestamps[i]
-          start_timestamp_qa_flag = qa_flags[i]
-        else:
-          start_timestamp = None
-          start_timestamp_qa_flag = None
-
-        start_frame_number = report_frame_numbers[i]
-
-        if i == len(report_class_ids) - 1:
-          self.feature_sequence.append(Feature(
-            feature_id, class_id, self.class_names[class_id], start_timestamp,
-            start_timestamp, start_timestamp_qa_flag, start_timestamp_qa_flag,
-            start_frame_number, start_frame_number))
-      elif i == len(report_class_ids) - 1:
-        if report_timestamps is not None:
-          end_timestamp = report_timestamps[i]
-          end_timestamp_qa_flag = qa_flags[i]
-        else:
-          end_timestamp = None
-          end_timestamp_qa_flag = None
-
-        end_frame_number = report_frame_numbers[i]
-
-        self.feature_sequence.append(Feature(
-          feature_id, class_id, self.class_names[class_id], start_timestamp,
-          end_timestamp, start_timestamp_qa_flag, end_timestamp_qa_flag,
-          start_frame_number, end_frame_number))
+    # Feature objects are only created for the features that are looked at
+    self._features = {}
+    self._feature_columns = None
+    self._feature_sequence = None
 
     self.weight_scale = non_event_weight_scale
     self.minimum_event_length = minimum_event_length
 
-  def find_events(
-      self, target_feature_class_ids, target_feature_class_names=None,
-      preceding_feature_class_id=None, preceding_feature_class_name=None,
-      following_feature_class_id=None, following_feature_class_name=None):
+  @property
+  def num_features(self):
+    return self.feature_table.shape[0]
+
+  def _create_feature(self, feature_index):
+    if self._feature_columns is None:
+      # reading Python ints from lists is much faster than from table rows
+      self._feature_columns = {
+        name: self.feature_table[name].tolist()
+        for name in feature_table_dtype.names}
+
+    columns = self._feature_columns
+    class_id = columns['class_id'][feature_index]
+
+    if self.has_timestamps:
+      return Feature(
+        columns['feature_id'][feature_index], class_id,
+        self.class_names[class_id],
+        columns['start_timestamp'][feature_index],
+        columns['end_timestamp'][feature_index],
+        columns['start_timestamp_qa_flag'][feature_index],
+        columns['end_timestamp_qa_flag'][feature_index],
+        columns['start_frame_number'][feature_index],
+        columns['end_frame_number'][feature_index])
+
+    return Feature(
+      columns['feature_id'][feature_index], class_id,
+      self.class_names[class_id], None, None, None, None,
+      columns['start_frame_number'][feature_index],
+      columns['end_frame_number'][feature_index])
+
+  def get_feature(self, feature_index):
+    """Return the Feature object for a row of the feature table.
+
+    The same object is returned on every call, so that event assignments made
+    during event detection are visible to later callers.
+    """
+    feature = self._features.get(feature_index)
+
+    if feature is None:
+      feature = self._create_feature(feature_index)
+      self._features[feature_index] = feature
+
+    return feature
+
+  def _make_feature_getter(self):
+    # like get_feature, but with Feature objects of its own, so that the
+    # event assignments of one query cannot be seen by another
+    features = {}
+
+    def get_feature(feature_index):
+      feature = features.get(feature_index)
+
+      if feature is None:
+        feature = self._create_feature(feature_index)
+        features[feature_index] = feature
+
+      return feature
+
+    return get_feature
+
+  @property
+  def feature_sequence(self):
+    if self._feature_sequence is None:
+      self._feature_sequence = [
+        self.get_feature(i) for i in range(self.num_features)]
+
+    return self._feature_sequence
+
+  def _resolve_query(self, query):
+    target_feature_class_ids = query.target_feature_class_ids
+    target_feature_class_names = query.target_feature_class_names
+
     if target_feature_class_ids is None:
       if target_feature_class_names is None:
         raise ValueError('target_feature_class_ids and target_'
@@ -223,224 +538,346 @@ class Trip:
         target_feature_class_ids = [self.class_ids[name]
                                     for name in target_feature_class_names]
 
+    preceding_feature_class_id = query.preceding_feature_class_id
+
     if preceding_feature_class_id is None and \
-            preceding_feature_class_name is not None:
-      preceding_feature_class_id = self.class_ids[preceding_feature_class_name]
+            query.preceding_feature_class_name is not None:
+      preceding_feature_class_id = self.class_ids[
+        query.preceding_feature_class_name]
 
     if preceding_feature_class_id in target_feature_class_ids:
       raise ValueError('preceding_feature_class_id cannot be equal to any '
                        'target_feature_class_id')
 
+    following_feature_class_id = query.following_feature_class_id
+
     if following_feature_class_id is None and \
-            following_feature_class_name is not None:
-      following_feature_class_id = self.class_ids[following_feature_class_name]
+            query.following_feature_class_name is not None:
+      following_feature_class_id = self.class_ids[
+        query.following_feature_class_name]
 
     if following_feature_class_id in target_feature_class_ids:
       raise ValueError('following_feature_class_id cannot be equal to any '
                        'target_feature_class_id')
 
+    return EventQuery(
+      query.name, target_feature_class_ids=set(target_feature_class_ids),
+      preceding_feature_class_id=preceding_feature_class_id,
+      following_feature_class_id=following_feature_class_id,
+      non_event_weight_scale=query.non_event_weight_scale,
+      minimum_event_length=query.minimum_event_length)
+
+  def _find_query_events(self, query, feature_arrays, get_feature,
+                         assign_short_events=True):
+    """Find the events of a resolved query.
+
+    Rather than visit every feature, the search jumps between the features
+    that can change its state: the target features that start events, the
+    feature at which each event ends, and the preceding and following
+    features between events. Where an event ends, and whether it is long
+    enough to keep, are found with array operations over the shared feature
+    arrays, so Feature objects are only created for the features of events.
+
+    Args:
+      assign_short_events: bool. Whether the target features of an event
+        that is too short to keep are still assigned to it. Only needed if
+        get_feature's features can be seen by others.
+
+    Returns:
+      A list of events.
+    """
+    num_features = feature_arrays.num_features
+    start_frame_numbers = feature_arrays.start_frame_numbers
+    end_frame_numbers = feature_arrays.end_frame_numbers
+    start_timestamps = feature_arrays.start_timestamps
+    end_timestamps = feature_arrays.end_timestamps
+
+    target_feature_class_ids = query.target_feature_class_ids
+    preceding_feature_class_id = query.preceding_feature_class_id
+    following_feature_class_id = query.following_feature_class_id
+    minimum_event_length = query.minimum_event_length
+
+    target_indices = feature_arrays.get_indices(target_feature_class_ids)
+
+    def get_target_feature_list(first_index, last_index):
+      return [get_feature(feature_index) for feature_index in
+              target_indices.get_between(first_index, last_index + 1)]
+
+    def get_event_length(first_index, last_index):
+      # the length of an event from first_index to last_index before any
+      # preceding or following feature is added, as in Event
+      return int(end_frame_numbers[target_indices.get_previous(last_index)]
+                 - start_frame_numbers[first_index])
+
     events = []
 
     previous_event = None
 
     event_id = 0
 
-    i = 0
-
     weight = 0.0
 
+    # the events of a query are found one after another. gap_index is the
+    # first feature after the previous event that may still affect the
+    # state, i.e. the feature at which it ended, and i the first feature
+    # that may start the next event
+    gap_index = 0
+
+    i = 0
+
     if preceding_feature_class_id and following_feature_class_id:
+      preceding_indices = feature_arrays.get_indices(
+        [preceding_feature_class_id])
+      following_indices = feature_arrays.get_indices(
+        [following_feature_class_id])
+      auxiliary_indices = feature_arrays.get_indices(
+        [preceding_feature_class_id, following_feature_class_id])
+      weights = feature_arrays.get_weights(
+        target_feature_class_ids, query.non_event_weight_scale)
+
       previous_preceding_feature = None
       previous_following_feature = None
 
-      while i < len(self.feature_sequence):
-        current_feature = self.feature_sequence[i]
-        i += 1
-        if current_feature.class_id in target_feature_class_ids:
-          target_feature_list = [current_feature]
-          longest_target_feature_gap = 0
-          weight += current_feature.length
-
-          while i < len(self.feature_sequence) and current_feature.class_id \
-              not in [preceding_feature_class_id, following_feature_class_id]:
-            current_feature = self.feature_sequence[i]
-            i += 1
-            if current_feature.class_id in target_feature_class_ids:
-              current_feature_gap = current_feature.start_frame_number - \
-                      target_feature_list[-1].end_frame_number
-              if longest_target_feature_gap < current_feature_gap:
-                longest_target_feature_gap = current_feature_gap
-
-              target_feature_list.append(current_feature)
-              weight += current_feature.length
-            else:
-              weight -= self.weight_scale * current_feature.length
-
-            if weight <= 0:
-              break
-
-          # if a detected event begins or ends in a frame from which the timestamp
-          # could not be read or syntehsized, just ignore the event.
-          if target_feature_list[0].start_timestamp != -1 \
-              or target_feature_list[-1].end_timestamp != -1:
-            current_event = Event(event_id=event_id,
-                                  target_feature_list=target_feature_list)
-
-            if current_event.length >= self.minimum_event_length:
-              weight = 0
-
-              # if two consecutive events share a common following/preceding
-              # feature, and that feature is closer to the current event than the
-              # previous event, reassign it to the current event.
-              if previous_preceding_feature:
-                if current_event.start_frame_number - \
-                    previous_preceding_feature.end_frame_number < \
-                    longest_target_feature_gap * 10:
-                  if previous_preceding_feature.event_id:
-                    previous_target_feature = events[
-                      previous_preceding_feature.event_id].target_feature_list[-1]
-
-                    previous_target_feature_distance = \
-                      previous_preceding_feature.start_frame_number - \
-                      previous_target_feature.end_frame_number
-
-                    assert previous_target_feature_distance >= 0
-
-                    current_feature_distance = \
-                      current_event.target_feature_list[0].start_frame_number - \
-                      previous_preceding_feature.end_frame_number
-
-                    assert current_feature_distance >= 0
-
-                    if current_feature_distance < previous_target_feature_distance:
-                      previous_event.following_feature = None
-                      current_event.preceding_feature = previous_preceding_feature
-                      previous_preceding_feature.event_id = event_id
-                  else:
+      while True:
+        first_index = target_indices.get_next(i)
+
+        if first_index is None:
+          first_index = num_features
+
+        # of the preceding features between events, only the last is kept.
+        # Of the following features, the first is assigned to the previous
+        # event if it has none, and the last is kept unless it was assigned
+        gap_preceding_indices = preceding_indices.get_between(
+          gap_index, first_index)
+
+        if len(gap_preceding_indices) > 0:
+          previous_preceding_feature = get_feature(gap_preceding_indices[-1])
+
+        gap_following_indices = following_indices.get_between(
+          gap_index, first_index)
+
+        if len(gap_following_indices) > 0:
+          previous_following_feature = get_feature(gap_following_indices[-1])
+
+          if previous_event and previous_event.following_feature is None:
+            following_feature = get_feature(gap_following_indices[0])
+            previous_event.following_feature = following_feature
+            following_feature.event_id = previous_event.event_id
+
+            if len(gap_following_indices) == 1:
+              previous_following_feature = None
+
+        if first_index == num_features:
+          break
+
+        # an event ends at the first preceding or following feature after it
+        # begins, if it has not lost its weight before
+        last_index = auxiliary_indices.get_next(first_index + 1)
+
+        if last_index is None:
+          last_index = num_features - 1
+
+        current_index, weight = _find_weight_break(
+          weights, first_index, last_index, weight)
+
+        # if a detected event begins or ends in a frame from which the timestamp
+        # could not be read or syntehsized, just ignore the event.
+        if start_timestamps[first_index] != -1 or end_timestamps[
+            target_indices.get_previous(current_index)] != -1:
+          if get_event_length(first_index, current_index) < \
+              minimum_event_length:
+            if assign_short_events:
+              Event(event_id=event_id, target_feature_list=
+                    get_target_feature_list(first_index, current_index))
+          else:
+            current_event = Event(
+              event_id=event_id, target_feature_list=get_target_feature_list(
+                first_index, current_index))
+
+            event_target_indices = target_indices.get_array_between(
+              first_index, current_index + 1)
+            longest_target_feature_gap = max(0, int(np.max(
+              start_frame_numbers[event_target_indices[1:]] -
+              end_frame_numbers[event_target_indices[:-1]], initial=0)))
+
+            weight = 0
+
+            # if two consecutive events share a common following/preceding
+            # feature, and that feature is closer to the current event than the
+            # previous event, reassign it to the current event.
+            if previous_preceding_feature:
+              if current_event.start_frame_number - \
+                  previous_preceding_feature.end_frame_number < \
+                  longest_target_feature_gap * 10:
+                if previous_preceding_feature.event_id:
+                  previous_target_feature = events[
+                    previous_preceding_feature.event_id].target_feature_list[-1]
+
+                  previous_target_feature_distance = \
+                    previous_preceding_feature.start_frame_number - \
+                    previous_target_feature.end_frame_number
+
+                  assert previous_target_feature_distance >= 0
+
+                  current_feature_distance = \
+                    current_event.target_feature_list[0].start_frame_number - \
+                    previous_preceding_feature.end_frame_number
+
+                  assert current_feature_distance >= 0
+
+                  if current_feature_distance < previous_target_feature_distance:
+                    previous_event.following_feature = None
                     current_event.preceding_feature = previous_preceding_feature
                     previous_preceding_feature.event_id = event_id
+                else:
+                  current_event.preceding_feature = previous_preceding_feature
+                  previous_preceding_feature.event_id = event_id
 
-                  if previous_preceding_feature == previous_following_feature:
-                    previous_following_feature = None
-
-                  previous_preceding_feature = None
+                if previous_preceding_feature == previous_following_feature:
+                  previous_following_feature = None
 
-              events.append(current_event)
-              event_id += 1
-              previous_event = current_event
+                previous_preceding_feature = None
 
-        if current_feature.class_id == preceding_feature_class_id:
-          previous_preceding_feature = current_feature
-
-        if current_feature.class_id == following_feature_class_id:
-          previous_following_feature = current_feature
-
-          if previous_event and \
-                  previous_event.following_feature is None:
-            previous_event.following_feature = previous_following_feature
-            previous_following_feature.event_id = previous_event.event_id
-            previous_following_feature = None
-    elif not preceding_feature_class_id and following_feature_class_id:
-      while i < len(self.feature_sequence):
-        current_feature = self.feature_sequence[i]
-        i += 1
-        if current_feature.class_id in target_feature_class_ids:
-          target_feature_list = [current_feature]
-
-          while i < len(self.feature_sequence) \
-              and current_feature.class_id != following_feature_class_id:
-            current_feature = self.feature_sequence[i]
-            i += 1
-            if current_feature.class_id in target_feature_class_ids:
-              target_feature_list.append(current_feature)
-
-          current_event = Event(event_id=event_id,
-                                target_feature_list=target_feature_list)
-
-          if current_event.length >= self.minimum_event_length:
             events.append(current_event)
             event_id += 1
             previous_event = current_event
 
-        if current_feature.class_id == following_feature_class_id:
-          previous_following_feature = current_feature
+        gap_index = current_index
+        i = current_index + 1
+    elif not preceding_feature_class_id and following_feature_class_id:
+      following_indices = feature_arrays.get_indices(
+        [following_feature_class_id])
+
+      while True:
+        first_index = target_indices.get_next(i)
+
+        if first_index is None:
+          first_index = num_features
+
+        # the first following feature after an event is assigned to the
+        # previous event if it has none
+        following_index = following_indices.get_next(gap_index)
+
+        if following_index is not None and following_index < first_index \
+            and previous_event and previous_event.following_feature is None:
+          previous_following_feature = get_feature(following_index)
+          previous_event.following_feature = previous_following_feature
+          previous_following_feature.event_id = previous_event.event_id
+
+        if first_index == num_features:
+          break
+
+        current_index = following_indices.get_next(first_index + 1)
 
-          if previous_event and \
-                  previous_event.following_feature is None:
-            previous_event.following_feature = previous_following_feature
-            previous_following_feature.event_id = previous_event.event_id
+        if current_index is None:
+          current_index = num_features - 1
+
+        if get_event_length(first_index, current_index) >= \
+            minimum_event_length:
+          current_event = Event(
+            event_id=event_id, target_feature_list=get_target_feature_list(
+              first_index, current_index))
+
+          events.append(current_event)
+          event_id += 1
+          previous_event = current_event
+        elif assign_short_events:
+          Event(event_id=event_id, target_feature_list=get_target_feature_list(
+            first_index, current_index))
+
+        gap_index = current_index
+        i = current_index + 1
     elif preceding_feature_class_id and not following_feature_class_id:
+      preceding_indices = feature_arrays.get_indices(
+        [preceding_feature_class_id])
+
       previous_preceding_feature = None
 
-      while i < len(self.feature_sequence):
-        current_feature = self.feature_sequence[i]
-        i += 1
+      while True:
+        first_index = target_indices.get_next(i)
+
+        if first_index is None:
+          first_index = num_features
+
+        # the last preceding feature before an event is included in it
+        gap_preceding_indices = preceding_indices.get_between(
+          gap_index, first_index)
 
-        if current_feature.class_id in target_feature_class_ids:
-          target_feature_list = [current_feature]
+        if len(gap_preceding_indices) > 0:
+          previous_preceding_feature = get_feature(gap_preceding_indices[-1])
 
-          while i < len(self.feature_sequence) \
-              and current_feature.class_id != preceding_feature_class_id:
-            current_feature = self.feature_sequence[i]
-            i += 1
+        if first_index == num_features:
+          break
 
-            if current_feature.class_id in target_feature_class_ids:
-              target_feature_list.append(current_feature)
+        current_index = preceding_indices.get_next(first_index + 1)
 
-          current_event = Event(event_id=event_id,
-                                target_feature_list=target_feature_list)
+        if current_index is None:
+          current_index = num_features - 1
 
-          # if two consecutive events share a common following/preceding
-          # feature, and that feature is closer to the current event than the
-          # previous event, reassign it to the current event.
-          if previous_preceding_feature:
+        is_long_enough = get_event_length(first_index, current_index) >= \
+                         minimum_event_length
+
+        if is_long_enough or assign_short_events:
+          current_event = Event(
+            event_id=event_id, target_feature_list=get_target_feature_list(
+              first_index, current_index))
+
+        # if two consecutive events share a common following/preceding
+        # feature, and that feature is closer to the current event than the
+        # previous event, reassign it to the current event.
+        if previous_preceding_feature:
+          if is_long_enough or assign_short_events:
             current_event.preceding_feature = previous_preceding_feature
             previous_preceding_feature.event_id = event_id
-            previous_preceding_feature = None
 
-          if current_event.length >= self.minimum_event_length:
-            events.append(current_event)
-            event_id += 1
+          previous_preceding_feature = None
+
+        if is_long_enough:
+          events.append(current_event)
+          event_id += 1
 
-        if current_feature.class_id == preceding_feature_class_id:
-          previous_preceding_feature = current_feature
+        gap_index = current_index
+        i = current_index + 1
     else:
-      while i < len(self.feature_sequence):
-        current_feature = self.feature_sequence[i]
-        i += 1
-        if current_feature.class_id in target_feature_class_ids:
-          target_feature_list = [current_feature]
-          longest_target_feature_gap = 0
-          weight += current_feature.length
-
-          while i < len(self.feature_sequence):
-            current_feature = self.feature_sequence[i]
-            i += 1
-            if current_feature.class_id in target_feature_class_ids:
-              current_feature_gap = current_feature.start_frame_number - \
-                      target_feature_list[-1].end_frame_number
-              if longest_target_feature_gap < current_feature_gap:
-                longest_target_feature_gap = current_feature_gap
-
-              target_feature_list.append(current_feature)
-              weight += current_feature.length
-            else:
-              weight -= self.weight_scale * current_feature.length
-
-            if weight <= 0:
-              break
-
-          current_event = Event(event_id=event_id,
-                                target_feature_list=target_feature_list)
-
-          weight = 0
-
-          if current_event.length >= self.minimum_event_length:
-            events.append(current_event)
-            event_id += 1
+      weights = feature_arrays.get_weights(
+        target_feature_class_ids, query.non_event_weight_scale)
+
+      while True:
+        first_index = target_indices.get_next(i)
+
+        if first_index is None:
+          break
+
+        current_index, _ = _find_weight_break(
+          weights, first_index, num_features - 1, weight)
+
+        if get_event_length(first_index, current_index) >= \
+            minimum_event_length:
+          events.append(Event(
+            event_id=event_id, target_feature_list=get_target_feature_list(
+              first_index, current_index)))
+          event_id += 1
+        elif assign_short_events:
+          Event(event_id=event_id, target_feature_list=get_target_feature_list(
+            first_index, current_index))
+
+        i = current_index + 1
 
     return events
 
+  def find_events(
+      self, target_feature_class_ids, target_feature_class_names=None,
+      preceding_feature_class_id=None, preceding_feature_class_name=None,
+      following_feature_class_id=None, following_feature_class_name=None):
+    query = EventQuery(
+      'events', target_feature_class_names, target_feature_class_ids,
+      preceding_feature_class_name, preceding_feature_class_id,
+      following_feature_class_name, following_feature_class_id,
+      self.weight_scale, self.minimum_event_length)
+
+    # events found by a single query are made of the trip's own features
+    return EventQueryEngine([query]).run(self, share_features=True)['events']
+
   def find_work_zone_events(self):
     return self.find_events(
       target_feature_class_ids=[self.class_ids['regulatory_sign'],
@@ -455,37 +892,77 @@ class Trip:
     )
 
 
-class TripFromReportFile(Trip):
-  def __init__(self, report_file_path, class_names_file_path,
-               smooth_probs=False, smoothing_factor=16):
-    class_name_map = IO.read_class_names(class_names_file_path)
+def read_trip_report(report_file_path, class_name_map):
+  """Read the columns of an inference report needed to construct a 'Trip'.
+
+  Returns:
+    A tuple of frame numbers, timestamps, QA flags and class probabilities.
+    Timestamps and QA flags are None if the report does not include them.
+  """
+  class_header_names = [class_name + '_probability'
+                        for class_name in class_name_map.values()]
+
+  if IO.is_columnar_report(report_file_path):
+    return _read_columnar_trip_report(report_file_path, class_header_names)
+
+  header_mask = ['frame_number', 'frame_timestamp', 'qa_flag']
+  header_mask.extend(class_header_names)
+
+  report_header, report_data, data_col_range = IO.read_report(
+    report_file_path, frame_col_num=1, timestamp_col_num=2, qa_flag_col_num=3,
+    header_mask=header_mask, return_data_col_range=True)
 
-    class_header_names = [class_name + '_probability'
-                          for class_name in class_name_map.values()]
+  report_frame_numbers = report_data['frame_numbers']
+  report_frame_numbers = report_frame_numbers.astype(np.int32)
 
-    header_mask = ['frame_number', 'frame_timestamp', 'qa_flag']
-    header_mask.extend(class_header_names)
+  try:
+    report_timestamps = report_data['frame_timestamps']
+    report_timestamps = report_timestamps.astype(np.int32)
+    qa_flags = report_data['qa_flag']
+    qa_flags = qa_flags.astype(np.uint8)
+  except:
+    report_timestamps = None
+    qa_flags = None
 
-    report_header, report_data, data_col_range = IO.read_report(
-      report_file_path, frame_col_num=1, timestamp_col_num=2, qa_flag_col_num=3,
-      header_mask=header_mask, return_data_col_range=True)
+  report_probs = report_data['probabilities']
+  report_probs = report_probs.astype(np.float32)
 
-    report_frame_numbers = report_data['frame_numbers']
-    report_frame_numbers = report_frame_numbers.astype(np.int32)
+  return report_frame_numbers, report_timestamps, qa_flags, report_probs
 
-    try:
-      report_timestamps = report_data['frame_timestamps']
-      report_timestamps = report_timestamps.astype(np.int32)
-      qa_flags = report_data['qa_flag']
-    except:
-      report_timestamps = None
-      qa_flags = None
 
-    report_probs = report_data['probabilities']
-    report_probs = report_probs.astype(np.float32)
+def _read_columnar_trip_report(report_file_path, class_header_names):
+  metadata, columns = IO.read_columnar_report(report_file_path)
+
+  probability_names = metadata['probability_names']
+  data_col_range = (probability_names.index(class_header_names[0]),
+                    probability_names.index(class_header_names[-1]) + 1)
+
+  if probability_names[data_col_range[0]:data_col_range[1]] != \
+      class_header_names:
+    raise ValueError(
+      'report probability names: {} were expected to include: {}'.format(
+        probability_names, class_header_names))
+
+  # slicing keeps the probabilities memory-mapped until they are used
+  report_probs = columns['probabilities'][
+                 :, data_col_range[0]:data_col_range[1]]
+
+  return columns['frame_number'], columns.get('frame_timestamp'), \
+         columns.get('qa_flag'), report_probs
+
+
+class TripFromReportFile(Trip):
+  def __init__(self, report_file_path, class_names_file_path,
+               smooth_probs=False, smoothing_factor=16,
+               non_event_weight_scale=0.05, minimum_event_length=100):
+    class_name_map = IO.read_class_names(class_names_file_path)
+
+    report_frame_numbers, report_timestamps, qa_flags, report_probs = \
+      read_trip_report(report_file_path, class_name_map)
 
     if smooth_probs:
       report_probs = IO.smooth_probs(report_probs, smoothing_factor)
 
     Trip.__init__(self, report_frame_numbers, report_timestamps, qa_flags,
-                  report_probs, class_name_map)
+                  report_probs, class_name_map, non_event_weight_scale,
+                  minimum_event_length)
@@ -1,15 +1,82 @@
 import csv
+import gzip
+from io import StringIO, TextIOWrapper
+from itertools import islice
 import json
 import logging
 import numpy as np
 import os
 import math
+import struct
 import subprocess as sp
+from time import time
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
 
 path = os.path
 
 
 class IO:
+  # windows wider than this are convolved by FFT rather than tap by tap
+  max_direct_smoothing_window = 63
+
+  # the number of smoothed arrays memoized at a time. Callers smooth the
+  # same probs repeatedly within one video, not across videos
+  smoothed_probs_cache_size = 1
+  _smoothed_probs_cache = {}
+
+  # the number of report rows parsed at a time, which bounds the memory used
+  # for text beyond that of the returned arrays
+  report_read_chunk_size = 65536
+
+  # the number of report rows formatted at a time, which bounds the memory
+  # used for text
+  report_write_chunk_size = 65536
+
+  # columnar reports start with this tag, then the length of a JSON header
+  # that describes the columns stored after it
+  columnar_report_magic = b'SNVACOL1'
+  columnar_report_extension = '.snvc'
+  # columns start on cache line boundaries so that memory maps of them are
+  # aligned
+  columnar_report_alignment = 64
+
+  # the compression applied to CSV and JSON reports as they are written: None,
+  # 'gzip' or 'zstd'. zstd falls back to gzip if zstandard is not installed
+  output_compression = None
+  output_compression_suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+  gzip_magic = b'\x1f\x8b'
+  zstd_magic = b'\x28\xb5\x2f\xfd'
+
+  # the number of seconds between flushes of a report that is written as rows
+  # arrive. Each flush of a compressed report ends a compression block, so
+  # flushing after every batch would cost much of the compression
+  report_flush_interval = 30
+
+  video_file_extensions = ['avi', 'mp4', 'asf', 'mkv', 'm4v', 'mpeg', 'mov']
+
+  # signal state mode samples one frame per second of video
+  signalstate_frame_rate = 1
+
+  # numpy 1.23 replaced loadtxt with a C parser that also understands quoting
+  _has_fast_loadtxt = np.lib.NumpyVersion(np.__version__) >= '1.23.0'
+
+  event_report_header = [
+    'file_name', 'sequence_number', 'start_frame_number', 'end_frame_number',
+    'start_timestamp', 'end_timestamp']
+
+  weather_report_header = [
+    'file_name', 'sequence_number', 'classification', 'start_frame_number',
+    'end_frame_number', 'start_timestamp', 'end_timestamp']
+
+  signalstate_report_header = [
+    'file_name', 'frame_number', 'timestamp', 'classification']
+
+  signalstate_event_report_header = weather_report_header + ['num_detections']
+
   @staticmethod
   def _invoke_subprocess(command):
     completed_subprocess = sp.run(
@@ -41,9 +108,8 @@ class IO:
 
   @staticmethod
   def read_video_file_names(video_file_dir_path):
-    included_extenstions = ['avi', 'mp4', 'asf', 'mkv', 'm4v', 'mpeg', 'mov']
     return sorted([fn for fn in os.listdir(video_file_dir_path) if any(
-      fn.lower().endswith(ext) for ext in included_extenstions)])
+      fn.lower().endswith(ext) for ext in IO.video_file_extensions)])
 
   @staticmethod
   def _div_odd(n):
@@ -66,21 +132,139 @@ class IO:
     return {line[0]: line[1] for line in meta_lines}
 
   @staticmethod
-  def get_video_dimensions(video_file_path, ffprobe_path):
-    command = [ffprobe_path, '-show_streams', '-print_format',
-               'json', '-loglevel', 'warning', video_file_path]
+  def _read_ffprobe_json(command):
     output = IO._invoke_subprocess(command)
     try:
-      json_map = json.loads(output)
+      return json.loads(output)
     except Exception as e:
       logging.error('encountered an exception while parsing ffprobe JSON file.')
       logging.debug('received raw ffprobe response: {}'.format(output))
       logging.debug('will raise exception to caller.')
       raise e
-    return int(json_map['streams'][0]['width']),\
-           int(json_map['streams'][0]['height']),\
-           int(json_map['streams'][0]['nb_frames']),\
-           int(math.ceil(float(json_map['streams'][0]['duration']))) + 1
+
+  @staticmethod
+  def count_video_frames(video_file_path, ffprobe_path):
+    # demuxes (but does not decode) the first video stream and counts its
+    # packets. Used for containers that do not report nb_frames in the header.
+    command = [ffprobe_path, '-select_streams', 'v:0', '-count_packets',
+               '-show_entries', 'stream=nb_read_packets', '-print_format',
+               'json', '-loglevel', 'warning', video_file_path]
+    json_map = IO._read_ffprobe_json(command)
+    return int(json_map['streams'][0]['nb_read_packets'])
+
+  @staticmethod
+  def read_video_presentation_timestamps(video_file_path, ffprobe_path):
+    """Read the PTS of every packet in the first video stream.
+
+    The video is demuxed but not decoded.
+
+    Returns:
+      A float64 array of presentation timestamps in milliseconds, sorted into
+      display order.
+    """
+    command = [ffprobe_path, '-select_streams', 'v:0', '-show_entries',
+               'packet=pts_time', '-print_format', 'csv=print_section=0',
+               '-loglevel', 'warning', video_file_path]
+    output = IO._invoke_subprocess(command)
+
+    # packets without a PTS are reported as N/A and cannot be placed in order
+    pts_times = [line.strip().rstrip(',') for line in output.splitlines()]
+    pts_times = [float(pts_time) for pts_time in pts_times
+                 if pts_time and pts_time != 'N/A']
+
+    return np.sort(np.array(pts_times, dtype=np.float64) * 1000)
+
+  @staticmethod
+  def read_anchor_presentation_timestamps(
+      video_file_path, ffprobe_path, output_frame_rate=None):
+    """Read the PTS from which timestamps are reconstructed between anchors.
+
+    Frames that are decoded at a fixed output frame rate (e.g. the one frame
+    per second sampled in signal state mode) are resampled from the packets,
+    so packet PTS no longer belong to them, and every timestamp is read.
+
+    Returns:
+      As read_video_presentation_timestamps, or None if output_frame_rate is
+      given.
+    """
+    if output_frame_rate is not None:
+      logging.warning('frames are decoded at {} fps rather than at the video\'s '
+                      'own rate, so every timestamp will be read instead of '
+                      'reconstructed from PTS'.format(output_frame_rate))
+      return None
+
+    return IO.read_video_presentation_timestamps(video_file_path, ffprobe_path)
+
+  @staticmethod
+  def get_decode_command(ffmpeg_path, video_file_path, do_deinterlace=False,
+                         output_frame_rate=None):
+    """Build the ffmpeg command that pipes a video's frames as raw RGB.
+
+    Args:
+      output_frame_rate: number. The rate at which frames are sampled from the
+        video. Every frame is decoded if None.
+    """
+    ffmpeg_command = [ffmpeg_path, '-i', video_file_path]
+
+    if do_deinterlace:
+      ffmpeg_command.append('-deinterlace')
+
+    ffmpeg_command.extend(
+      ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-hide_banner',
+       '-loglevel', '0'])
+
+    # recent ffmpeg releases (e.g. 7.0) reject an output frame rate combined
+    # with variable frame rate output, which sampling at a fixed rate does not
+    # need anyway
+    if output_frame_rate is None:
+      ffmpeg_command.extend(['-vsync', 'vfr'])
+    else:
+      ffmpeg_command.extend(['-r', str(output_frame_rate)])
+
+    ffmpeg_command.extend(['-f', 'image2pipe', 'pipe:1'])
+
+    return ffmpeg_command
+
+  @staticmethod
+  def probe_video_dimensions(video_file_path, ffprobe_path):
+    command = [ffprobe_path, '-show_streams', '-show_format', '-print_format',
+               'json', '-loglevel', 'warning', video_file_path]
+    json_map = IO._read_ffprobe_json(command)
+    stream_map = json_map['streams'][0]
+
+    try:
+      num_frames = int(stream_map['nb_frames'])
+    except (KeyError, ValueError):
+      logging.debug('nb_frames is not available for {}. Will count packets '
+                    'instead.'.format(video_file_path))
+      num_frames = IO.count_video_frames(video_file_path, ffprobe_path)
+
+    if 'duration' in stream_map:
+      duration = stream_map['duration']
+    else:
+      duration = json_map['format']['duration']
+
+    return int(stream_map['width']),\
+           int(stream_map['height']),\
+           num_frames,\
+           int(math.ceil(float(duration))) + 1
+
+  @staticmethod
+  def get_video_dimensions(video_file_path, ffprobe_path, probe_cache=None):
+    if probe_cache is not None:
+      video_dimensions = probe_cache.get(video_file_path)
+
+      if video_dimensions is not None:
+        logging.debug('read video dimensions of {} from probe cache'.format(
+          video_file_path))
+        return video_dimensions
+
+    video_dimensions = IO.probe_video_dimensions(video_file_path, ffprobe_path)
+
+    if probe_cache is not None:
+      probe_cache.put(video_file_path, video_dimensions)
+
+    return video_dimensions
 
   @staticmethod
   def _get_gauss_weight_and_window(smoothing_factor):
@@ -92,31 +276,87 @@ class IO:
     return weight, window
 
   @staticmethod
-  def _smooth_class_prob_sequence(
-      probs, weight, weight_sum, indices, head_padding_len, tail_padding_len):
-    smoothed_probs = weight * probs[indices]
-    smoothed_probs = np.sum(smoothed_probs, axis=1)
-    smoothed_probs = smoothed_probs / weight_sum
-    head_padding = np.ones((head_padding_len, )) * smoothed_probs[0]
-    tail_padding = np.ones((tail_padding_len, )) * smoothed_probs[-1]
-    smoothed_probs = np.concatenate(
-      (head_padding, smoothed_probs, tail_padding))
+  def _convolve_directly(class_probs, weight, num_smoothed_probs):
+    # one pass per weight tap, each over every class at once
+    smoothed_probs = np.zeros(
+      (num_smoothed_probs, class_probs.shape[1]), dtype=np.float32)
+    for i in range(weight.shape[0]):
+      smoothed_probs += weight[i] * class_probs[i:i + num_smoothed_probs]
     return smoothed_probs
 
+  @staticmethod
+  def _convolve_by_fft(class_probs, weight, num_smoothed_probs):
+    fft_len = class_probs.shape[0] + weight.shape[0] - 1
+    class_prob_spectra = np.fft.rfft(class_probs, n=fft_len, axis=0)
+    # the weight is symmetric, so convolution and correlation agree
+    weight_spectrum = np.fft.rfft(weight, n=fft_len)
+    smoothed_probs = np.fft.irfft(
+      class_prob_spectra * np.expand_dims(weight_spectrum, 1), n=fft_len,
+      axis=0)
+    window = weight.shape[0]
+    return smoothed_probs[window - 1:window - 1 + num_smoothed_probs].astype(
+      np.float32)
+
   @staticmethod
   def smooth_probs(class_probs, smoothing_factor):
+    """Smooth each class's probability sequence with a Gaussian window.
+
+    Every class is smoothed in the same pass, directly for small windows and
+    by FFT for large ones. Edge frames repeat the nearest smoothed value.
+    The most recent smoothed_probs_cache_size results are memoized per
+    (array, smoothing factor) until IO.clear_smoothed_probs_cache is called,
+    so class_probs must not be modified in place after it has been smoothed.
+
+    Returns:
+      A float32 array with the same shape as class_probs.
+    """
+    cache_key = (id(class_probs), smoothing_factor)
+    cache_entry = IO._smoothed_probs_cache.get(cache_key)
+
+    # the cache holds a reference to each smoothed array, so its id cannot be
+    # reused by another array while the entry exists
+    if cache_entry is not None and cache_entry[0] is class_probs:
+      return cache_entry[1]
+
     weight, window = IO._get_gauss_weight_and_window(smoothing_factor)
-    weight_sum = np.sum(weight)
-    indices = np.arange(class_probs.shape[0] - window)
-    indices = np.expand_dims(indices, axis=1) + np.arange(weight.shape[0])
+    weight = (weight / np.sum(weight)).astype(np.float32)
+
+    # only windows that lie entirely within the first n - 1 frames are
+    # smoothed, as has always been the case
+    num_smoothed_probs = class_probs.shape[0] - window
+
+    if num_smoothed_probs <= 0:
+      raise ValueError(
+        'cannot smooth {} frames with a smoothing factor of {}'.format(
+          class_probs.shape[0], smoothing_factor))
+
+    class_probs_f32 = np.asarray(class_probs, dtype=np.float32)
+
+    if window > IO.max_direct_smoothing_window:
+      smoothed_probs = IO._convolve_by_fft(
+        class_probs_f32, weight, num_smoothed_probs)
+    else:
+      smoothed_probs = IO._convolve_directly(
+        class_probs_f32, weight, num_smoothed_probs)
+
     head_padding_len, tail_padding_len = IO._div_odd(window)
-    smoothed_probs = np.ndarray(class_probs.shape)
-    for i in range(class_probs.shape[1]):
-      smoothed_probs[:, i] = IO._smooth_class_prob_sequence(
-        class_probs[:, i], weight, weight_sum, indices,
-        head_padding_len, tail_padding_len)
+    smoothed_probs = np.concatenate(
+      (np.repeat(smoothed_probs[:1], head_padding_len, axis=0),
+       smoothed_probs,
+       np.repeat(smoothed_probs[-1:], tail_padding_len, axis=0)))
+
+    IO._smoothed_probs_cache[cache_key] = (class_probs, smoothed_probs)
+
+    # dicts keep insertion order, so the first entries are the oldest
+    while len(IO._smoothed_probs_cache) > IO.smoothed_probs_cache_size:
+      del IO._smoothed_probs_cache[next(iter(IO._smoothed_probs_cache))]
+
     return smoothed_probs
 
+  @staticmethod
+  def clear_smoothed_probs_cache():
+    IO._smoothed_probs_cache.clear()
+
   @staticmethod
   def _expand_class_names(class_names, appendage):
     return class_names + [class_name + appendage for class_name in class_names]
@@ -132,12 +372,141 @@ class IO:
 
     return binarized_probs
 
+  @staticmethod
+  def _get_output_compression():
+    if IO.output_compression == 'zstd' and zstandard is None:
+      logging.warning('zstandard is not installed. Reports will be compressed '
+                      'with gzip instead.')
+      IO.output_compression = 'gzip'
+
+    return IO.output_compression
+
+  @staticmethod
+  def get_output_file_path(file_path):
+    """Return the path that _open_output_file writes to given file_path,
+    which carries a suffix when output is compressed."""
+    output_compression = IO._get_output_compression()
+
+    if output_compression is None:
+      return file_path
+
+    return file_path + IO.output_compression_suffixes[output_compression]
+
+  @staticmethod
+  def _open_output_file(file_path):
+    """Open a text file for writing that is compressed as it is written,
+    according to output_compression.
+
+    Args:
+      file_path: str. The path of the file before any compression suffix is
+        appended. Use get_output_file_path to find the path written to.
+    """
+    output_compression = IO._get_output_compression()
+    output_file_path = IO.get_output_file_path(file_path)
+
+    if output_compression == 'gzip':
+      # zlib's default level compresses reports nearly as well as gzip's
+      # default of 9 in a fraction of the time
+      return gzip.open(output_file_path, 'wt', compresslevel=6, newline='')
+    elif output_compression == 'zstd':
+      return TextIOWrapper(zstandard.ZstdCompressor().stream_writer(
+        open(output_file_path, 'wb')), newline='')
+    else:
+      return open(output_file_path, 'w', newline='')
+
+  @staticmethod
+  def strip_report_extension(report_file_name):
+    """Remove the extension, and any compression suffix, from a report file
+    name."""
+    report_file_name, extension = path.splitext(report_file_name)
+
+    if extension in IO.output_compression_suffixes.values():
+      report_file_name = path.splitext(report_file_name)[0]
+
+    return report_file_name
+
+  @staticmethod
+  def open_report_file(report_file_path):
+    # compressed reports are recognized by their content rather than their
+    # name, so that renamed files can still be read
+    with open(report_file_path, 'rb') as report_file:
+      magic = report_file.read(4)
+
+    if magic.startswith(IO.gzip_magic):
+      return gzip.open(report_file_path, 'rt', newline='')
+    elif magic == IO.zstd_magic:
+      if zstandard is None:
+        raise ValueError('{} is compressed with zstd, but zstandard is not '
+                         'installed'.format(report_file_path))
+
+      return TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(
+        open(report_file_path, 'rb')), newline='')
+    else:
+      return open(report_file_path, newline='')
+
   @staticmethod
   def open_report(report_file_path):
-    report_file = open(report_file_path, newline='')
+    report_file = IO.open_report_file(report_file_path)
 
     return csv.reader(report_file)
 
+  @staticmethod
+  def _parse_report_rows(report_lines, col_nums):
+    if IO._has_fast_loadtxt:
+      return np.loadtxt(report_lines, dtype=np.float64, delimiter=',',
+                        quotechar='"', usecols=col_nums, ndmin=2)
+
+    if any('"' in line for line in report_lines):
+      # a quoted field may contain delimiters, so leave it to the csv module
+      report_data = np.array(
+        [[row[col_num] for col_num in col_nums]
+         for row in csv.reader(report_lines)], dtype=np.float64)
+    else:
+      # the leading file_name column is the only non-numeric one, so the rest
+      # of each row can be parsed in one pass over the chunk
+      report_text = ','.join(
+        [line.partition(',')[2] for line in report_lines])
+      report_data = np.fromstring(report_text, dtype=np.float64, sep=',')
+      report_data = report_data.reshape((len(report_lines), -1))
+      report_data = report_data[:, [col_num - 1 for col_num in col_nums]]
+
+    return report_data
+
+  @staticmethod
+  def read_report_columns(report_file, col_nums, chunk_size=None):
+    """Parse numeric report columns directly into an array, chunk_size rows
+    at a time.
+
+    Args:
+      report_file: file. An open report positioned after its header row.
+      col_nums: list. The indices of the columns to read. Column 0 is assumed
+        to be the file name and may not be included.
+      chunk_size: int. The number of rows to parse at a time. Defaults to
+        report_read_chunk_size.
+
+    Returns:
+      An (n, len(col_nums)) float64 array.
+    """
+    if chunk_size is None:
+      chunk_size = IO.report_read_chunk_size
+
+    report_data_chunks = []
+
+    while True:
+      report_lines = [line for line in islice(report_file, chunk_size)
+                      if line.strip()]
+
+      if len(report_lines) > 0:
+        report_data_chunks.append(
+          IO._parse_report_rows(report_lines, col_nums))
+      else:
+        break
+
+    if len(report_data_chunks) == 0:
+      return np.zeros((0, len(col_nums)), dtype=np.float64)
+
+    return np.concatenate(report_data_chunks)
+
   @staticmethod
   def read_report_header(
       report_reader, frame_col_num=None, timestamp_col_num=None, qa_flag_col_num=None,
@@ -183,50 +552,40 @@ class IO:
 
   @staticmethod
   def read_report_data(
-      report_reader, frame_col_num=None, timestamp_col_num=None,
+      report_file, frame_col_num=None, timestamp_col_num=None,
       qa_flag_col_num=None, data_col_range=None):
-    if frame_col_num and timestamp_col_num and data_col_range:
-      frame_numbers = []
-      timestamps = []
-      probabilities = []
-
-      for row in report_reader:
-        frame_numbers.append(row[frame_col_num])
-        timestamps.append(row[timestamp_col_num])
-        probabilities.append(row[data_col_range[0]:data_col_range[1]])
-
-      report_data = {'frame_numbers': np.array(frame_numbers),
-                     'frame_timestamps': np.array(timestamps),
-                     'probabilities': np.array(probabilities)}
-    elif frame_col_num and data_col_range:
-      frame_numbers = []
-      probabilities = []
-
-      for row in report_reader:
-        frame_numbers.append(row[frame_col_num])
-        probabilities.append(row[data_col_range[0]:data_col_range[1]])
-
-      report_data = {'frame_numbers': np.array(frame_numbers),
-                     'probabilities': np.array(probabilities)}
-    elif timestamp_col_num and data_col_range:
-      timestamps = []
-      probabilities = []
-
-      for row in report_reader:
-        timestamps.append(row[timestamp_col_num])
-        probabilities.append(row[data_col_range[0]:data_col_range[1]])
-
-      report_data = {'frame_timestamps': np.array(timestamps),
-                     'probabilities': np.array(probabilities)}
-    elif data_col_range:
-      probabilities = []
-
-      for row in report_reader:
-        probabilities.append(row[data_col_range[0]:data_col_range[1]])
-
-      report_data = {'probabilities': np.array(probabilities)}
-    else:
-      report_data = np.array([row for row in report_reader])
+    if data_col_range is None:
+      return np.array([row for row in csv.reader(report_file)])
+
+    col_names = []
+    col_nums = []
+
+    if frame_col_num:
+      col_names.append('frame_numbers')
+      col_nums.append(frame_col_num)
+
+    if timestamp_col_num:
+      col_names.append('frame_timestamps')
+      col_nums.append(timestamp_col_num)
+
+      if qa_flag_col_num:
+        col_names.append('qa_flag')
+        col_nums.append(qa_flag_col_num)
+
+    col_nums.extend(range(data_col_range[0], data_col_range[1]))
+
+    report_columns = IO.read_report_columns(report_file, col_nums)
+
+    report_data = {}
+
+    for i, col_name in enumerate(col_names):
+      if col_name == 'qa_flag':
+        report_data[col_name] = report_columns[:, i].astype(np.uint8)
+      else:
+        report_data[col_name] = report_columns[:, i].astype(np.int64)
+
+    report_data['probabilities'] = report_columns[:, len(col_names):].astype(
+      np.float32)
 
     return report_data
 
@@ -234,25 +593,21 @@ class IO:
   def read_report(report_file_path, frame_col_num=None, timestamp_col_num=None,
                   qa_flag_col_num=None, data_col_range=None, header_mask=None,
                   return_data_col_range=False):
-    report_reader = IO.open_report(report_file_path)
+    with IO.open_report_file(report_file_path) as report_file:
+      # only the header is read by the csv module; the rows that follow are
+      # parsed into typed arrays by read_report_data
+      header_reader = csv.reader([report_file.readline()])
 
-    if return_data_col_range:
       report_header, data_col_range = IO.read_report_header(
-        report_reader, frame_col_num=frame_col_num,
+        header_reader, frame_col_num=frame_col_num,
         timestamp_col_num=timestamp_col_num, qa_flag_col_num=qa_flag_col_num,
         data_col_range=data_col_range, header_mask=header_mask,
         return_data_col_range=True)
-    else:
-      report_header = IO.read_report_header(
-        report_reader, frame_col_num=frame_col_num,
-        timestamp_col_num=timestamp_col_num, qa_flag_col_num=qa_flag_col_num,
-        data_col_range=data_col_range, header_mask=header_mask,
-        return_data_col_range=False)
 
-    report_data = IO.read_report_data(
-      report_reader, frame_col_num=frame_col_num,
-      timestamp_col_num=timestamp_col_num, qa_flag_col_num=qa_flag_col_num,
-      data_col_range=data_col_range)
+      report_data = IO.read_report_data(
+        report_file, frame_col_num=frame_col_num,
+        timestamp_col_num=timestamp_col_num, qa_flag_col_num=qa_flag_col_num,
+        data_col_range=data_col_range)
 
     if return_data_col_range:
       return report_header, report_data, data_col_range
@@ -261,17 +616,206 @@ class IO:
 
   @staticmethod
   def write_csv(file_path, header, rows):
-    with open(file_path, 'w', newline='') as file:
+    with IO._open_output_file(file_path) as file:
       csv_writer = csv.writer(file)
       csv_writer.writerow(header)
       csv_writer.writerows(rows)
 
+    return IO.get_output_file_path(file_path)
+
+  @staticmethod
+  def _quote_csv_field(field):
+    field_buffer = StringIO()
+    csv.writer(field_buffer, lineterminator='').writerow([field])
+    return field_buffer.getvalue()
+
+  @staticmethod
+  def write_csv_columns(file_path, header, row_format, columns,
+                        chunk_size=None):
+    """Write rows formatted from numeric columns, chunk_size rows at a time,
+    exactly as csv.writer would write them.
+
+    Args:
+      file_path: str. The path of the CSV file to create.
+      header: list. The names of the columns.
+      row_format: str. A printf-style format for one row, without a line
+        terminator, with one conversion per column of the concatenated
+        columns. Literal fields must already be quoted as csv.writer would
+        quote them.
+      columns: list. Arrays of equal length. 2D arrays contribute one value
+        per column.
+      chunk_size: int. The number of rows to format at a time. Defaults to
+        report_write_chunk_size.
+    """
+    if chunk_size is None:
+      chunk_size = IO.report_write_chunk_size
+
+    row_format += csv.excel.lineterminator
+    num_rows = len(columns[0])
+
+    with IO._open_output_file(file_path) as file:
+      csv.writer(file).writerow(header)
+
+      for chunk_start in range(0, num_rows, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, num_rows)
+
+        # float64 holds float32 probabilities and integers below 2 ** 53
+        # exactly, so every value formats as it would on its own
+        chunk_values = np.column_stack(
+          [np.asarray(column[chunk_start:chunk_end], dtype=np.float64)
+           for column in columns])
+
+        file.write((row_format * (chunk_end - chunk_start)) % tuple(
+          chunk_values.ravel().tolist()))
+
+    return IO.get_output_file_path(file_path)
+
+  @staticmethod
+  def write_columnar_report(file_path, columns, metadata=None):
+    """Write named arrays of equal length to a self-describing binary file
+    whose columns can be memory-mapped by read_columnar_report.
+
+    Args:
+      file_path: str. The path of the file to create.
+      columns: list. (name, array) pairs, in the order they are stored.
+      metadata: dict. JSON-serializable values stored in the file header.
+    """
+    alignment = IO.columnar_report_alignment
+
+    column_descriptions = []
+    column_offset = 0
+
+    for column_name, column in columns:
+      column = np.ascontiguousarray(column)
+      column_descriptions.append({'name': column_name,
+                                  'dtype': column.dtype.str,
+                                  'shape': list(column.shape),
+                                  'offset': column_offset})
+      column_offset += -(-column.nbytes // alignment) * alignment
+
+    header = json.dumps({'columns': column_descriptions,
+                         'metadata': metadata or {}}).encode('utf-8')
+
+    # column offsets are relative to the end of the padded header
+    header_length = len(IO.columnar_report_magic) + 8 + len(header)
+    header += b' ' * (-header_length % alignment)
+
+    with open(file_path, 'wb') as file:
+      file.write(IO.columnar_report_magic)
+      file.write(struct.pack('<Q', len(header)))
+      file.write(header)
+
+      for _, column in columns:
+        column = np.ascontiguousarray(column)
+        file.write(column.tobytes())
+        file.write(b'\0' * (-column.nbytes % alignment))
+
+  @staticmethod
+  def is_columnar_report(file_path):
+    with open(file_path, 'rb') as file:
+      return file.read(len(IO.columnar_report_magic)) == \
+             IO.columnar_report_magic
+
+  @staticmethod
+  def read_columnar_report(file_path, mmap_mode='r'):
+    """Memory-map the columns of a file written by write_columnar_report.
+
+    Args:
+      file_path: str. The path of the columnar report.
+      mmap_mode: str. The mode passed to np.memmap, or None to read the columns
+        into memory.
+
+    Returns:
+      The metadata dict stored in the file header, and a dict mapping column
+      names to arrays in the order they are stored.
+    """
+    with open(file_path, 'rb') as file:
+      if file.read(len(IO.columnar_report_magic)) != IO.columnar_report_magic:
+        raise ValueError('{} is not a columnar report'.format(file_path))
+
+      header_length, = struct.unpack('<Q', file.read(8))
+      header = json.loads(file.read(header_length).decode('utf-8'))
+
+    data_offset = len(IO.columnar_report_magic) + 8 + header_length
+
+    columns = {}
+
+    for column_description in header['columns']:
+      dtype = np.dtype(column_description['dtype'])
+      shape = tuple(column_description['shape'])
+      offset = data_offset + column_description['offset']
+
+      if mmap_mode is None or np.prod(shape) == 0:
+        # np.memmap cannot map an empty array
+        columns[column_description['name']] = np.fromfile(
+          file_path, dtype=dtype, count=int(np.prod(shape)),
+          offset=offset).reshape(shape)
+      else:
+        columns[column_description['name']] = np.memmap(
+          file_path, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape)
+
+    return header['metadata'], columns
+
+  @staticmethod
+  def write_csv_inference_report(
+      report_file_path, report_file_name, probability_names, class_probs,
+      frame_numbers=None, timestamps=None, qa_flags=None):
+    if frame_numbers is None:
+      frame_numbers = np.arange(1, len(class_probs) + 1)
+
+    # a file name is written verbatim into the row format, so escape any
+    # conversion characters it contains
+    file_name_field = IO._quote_csv_field(report_file_name).replace('%', '%%')
+    prob_formats = ['%.4f'] * class_probs.shape[1]
+
+    if timestamps is not None:
+      header = ['file_name', 'frame_number', 'frame_timestamp', 'qa_flag'] + \
+               probability_names
+      row_format = ','.join([file_name_field, '%d', '%d', '%d'] + prob_formats)
+      columns = [frame_numbers, timestamps, qa_flags, class_probs]
+    else:
+      header = ['file_name', 'frame_number'] + probability_names
+      row_format = ','.join([file_name_field, '%d'] + prob_formats)
+      columns = [frame_numbers, class_probs]
+
+    return IO.write_csv_columns(
+      report_file_path, header, row_format, columns)
+
+  @staticmethod
+  def write_columnar_inference_report(
+      report_file_path, report_file_name, probability_names, class_probs,
+      frame_numbers=None, timestamps=None, qa_flags=None, metadata=None):
+    if frame_numbers is None:
+      frame_numbers = np.arange(1, len(class_probs) + 1)
+
+    columns = [('frame_number', np.asarray(frame_numbers, dtype=np.int32))]
+
+    if timestamps is not None:
+      columns.append(('frame_timestamp', np.asarray(timestamps, dtype=np.int64)))
+      columns.append(('qa_flag', np.asarray(qa_flags, dtype=np.uint8)))
+
+    columns.append(('probabilities', np.asarray(class_probs, dtype=np.float32)))
+
+    report_metadata = {'file_name': report_file_name,
+                       'probability_names': probability_names}
+
+    if metadata is not None:
+      report_metadata.update(metadata)
+
+    IO.write_columnar_report(report_file_path, columns, report_metadata)
+
   # TODO: confirm that the csv can be opened after writing
   @staticmethod
   def write_inference_report(
       report_file_name, report_dir_path, class_probs, class_name_map,
-      timestamp_strings=None, qa_flags=None, smooth_probs=False,
-      smoothing_factor=0, binarize_probs=False):
+      timestamps=None, qa_flags=None, smooth_probs=False,
+      smoothing_factor=0, binarize_probs=False, report_format='csv',
+      metadata=None):
+    if report_format not in ['csv', 'columnar']:
+      raise ValueError(
+        'report_format must be \'csv\' or \'columnar\', not {}'.format(
+          report_format))
+
     class_names = ['{}_probability'.format(class_name)
                    for class_name in class_name_map.values()]
 
@@ -279,33 +823,41 @@ class IO:
       class_names = IO._expand_class_names(class_names, '_smoothed')
       smoothed_probs = IO.smooth_probs(class_probs, smoothing_factor)
       class_probs = np.concatenate((class_probs, smoothed_probs), axis=1)
+    else:
+      smoothing_factor = 0
 
     if binarize_probs:
       class_names = IO._expand_class_names(class_names, '_binarized')
       binarized_probs = IO._binarize_probs(class_probs)
       class_probs = np.concatenate((class_probs, binarized_probs), axis=1)
 
-    if timestamp_strings is not None:
-      header = ['file_name', 'frame_number', 'frame_timestamp', 'qa_flag'] + \
-               class_names
-      rows = [[report_file_name, '{:d}'.format(i + 1), timestamp_strings[i],
-               qa_flags[i]] + ['{0:.4f}'.format(cls) for cls in class_probs[i]]
-              for i in range(len(class_probs))]
-    else:
-      header = ['file_name', 'frame_number'] + class_names
-      rows = [[report_file_name, '{:d}'.format(i + 1)]
-              + ['{0:.4f}'.format(cls) for cls in class_probs[i]]
-              for i in range(len(class_probs))]
-
     report_dir_path = path.join(report_dir_path, 'inference_reports')
 
     if not path.exists(report_dir_path):
       os.makedirs(report_dir_path)
 
-    report_file_path = path.join(
-      report_dir_path, report_file_name + '.csv')
+    if report_format == 'columnar':
+      report_file_path = path.join(
+        report_dir_path, report_file_name + IO.columnar_report_extension)
+
+      report_metadata = {'class_names': list(class_name_map.values()),
+                         'smoothing_factor': smoothing_factor,
+                         'binarize_probs': binarize_probs}
+
+      if metadata is not None:
+        report_metadata.update(metadata)
+
+      IO.write_columnar_inference_report(
+        report_file_path, report_file_name, class_names, class_probs,
+        timestamps=timestamps, qa_flags=qa_flags, metadata=report_metadata)
+    else:
+      report_file_path = path.join(
+        report_dir_path, report_file_name + '.csv')
+
+      report_file_path = IO.write_csv_inference_report(
+        report_file_path, report_file_name, class_names, class_probs,
+        timestamps=timestamps, qa_flags=qa_flags)
 
-    IO.write_csv(report_file_path, header, rows)
     return report_file_path
 
   # TODO: confirm that the csv can be opened after writing
@@ -319,26 +871,16 @@ class IO:
     report_file_path = path.join(
       report_dir_path, report_file_name + '.csv')
 
-    header = ['file_name', 'sequence_number', 'start_frame_number',
-              'end_frame_number', 'start_timestamp', 'end_timestamp']
+    return IO.write_csv(
+      report_file_path, IO.event_report_header,
+      IO.get_event_report_rows(report_file_name, events))
 
-    rows = [[report_file_name, event.event_id + 1, event.start_frame_number,
+  @staticmethod
+  def get_event_report_rows(report_file_name, events):
+    return [[report_file_name, event.event_id + 1, event.start_frame_number,
              event.end_frame_number, event.start_timestamp, event.end_timestamp]
             for event in events]
-
-    IO.write_csv(report_file_path, header, rows)
-    return report_dir_path
   
-  @staticmethod
-  def write_json(file_name, dir_path, json_data):
-    file_path = path.join(dir_path, 'bbox_reports')
-    if not path.exists(file_path):
-      os.makedirs(file_path)
-    file_path = path.join(file_path, file_name + '.json')
-    with open(file_path, mode='w', newline='') as output_file:
-        json.dump(json_data, output_file)
-    return file_path
-
   @staticmethod
   def write_weather_report(report_file_name, report_dir_path, weather_features):
     report_dir_path = path.join(report_dir_path, 'event_reports')
@@ -349,16 +891,29 @@ class IO:
     report_file_path = path.join(
       report_dir_path, report_file_name + '.csv')
 
-    header = ['file_name', 'sequence_number', 'classification', 'start_frame_number',
-              'end_frame_number', 'start_timestamp', 'end_timestamp']
-    rows = [[report_file_name, feat.feature_id, feat.class_name, feat.start_frame_number,
-             feat.end_frame_number, feat.start_timestamp, feat.end_timestamp]
+    return IO.write_csv(
+      report_file_path, IO.weather_report_header,
+      IO.get_weather_report_rows(report_file_name, weather_features))
+
+  @staticmethod
+  def get_weather_report_rows(report_file_name, weather_features):
+    return [[report_file_name, feat.feature_id, feat.class_name,
+             feat.start_frame_number, feat.end_frame_number,
+             feat.start_timestamp, feat.end_timestamp]
             for feat in weather_features]
-    IO.write_csv(report_file_path, header, rows)
-    return report_file_path
 
   @staticmethod
-  def write_signalstate_report(report_file_name, report_dir_path, detections):
+  def write_signalstate_report(report_file_name, report_dir_path, detections,
+                               chunk_size=None):
+    """Write one row per signal state detection, chunk_size rows at a time.
+
+    Args:
+      detections: dict. Detection columns as labeled by the signal state
+        processor.
+    """
+    if chunk_size is None:
+      chunk_size = IO.report_write_chunk_size
+
     report_dir_path = path.join(report_dir_path, 'event_reports')
 
     if not path.exists(report_dir_path):
@@ -367,12 +922,199 @@ class IO:
     report_file_path = path.join(
       report_dir_path, report_file_name + '.csv')
 
-    header = ['file_name', 'frame_number', 'timestamp',
-              'classification']
+    num_detections = len(detections['frame_number'])
 
-    rows = [[report_file_name, det['frame_num'], det['timestamp'],
-             det['classification']]
-            for det in detections]
+    with IO._open_output_file(report_file_path) as file:
+      csv_writer = csv.writer(file)
+      csv_writer.writerow(IO.signalstate_report_header)
 
-    IO.write_csv(report_file_path, header, rows)
-    return report_file_path
+      for chunk_start in range(0, num_detections, chunk_size):
+        csv_writer.writerows(IO.get_signalstate_report_rows(
+          report_file_name, detections, chunk_start, chunk_start + chunk_size))
+
+    return IO.get_output_file_path(report_file_path)
+
+  @staticmethod
+  def get_signalstate_report_rows(report_file_name, detections, start=0,
+                                  end=None):
+    frame_numbers = detections['frame_number'][start:end].tolist()
+
+    if detections['timestamp'] is None:
+      timestamps = [None] * len(frame_numbers)
+    else:
+      timestamps = detections['timestamp'][start:end].tolist()
+
+    return [[report_file_name, frame_number, timestamp, classification]
+            for frame_number, timestamp, classification in zip(
+              frame_numbers, timestamps,
+              detections['classification'][start:end].tolist())]
+
+  @staticmethod
+  def write_signalstate_event_report(report_file_name, report_dir_path,
+                                     signal_events):
+    """Write one row per tracked signal, alongside the signal state report.
+
+    Args:
+      signal_events: dict. Track columns as returned by
+        track.summarize_tracks.
+    """
+    report_dir_path = path.join(report_dir_path, 'event_reports')
+
+    if not path.exists(report_dir_path):
+      os.makedirs(report_dir_path)
+
+    report_file_path = path.join(
+      report_dir_path, report_file_name + '_signal_events.csv')
+
+    return IO.write_csv(
+      report_file_path, IO.signalstate_event_report_header,
+      IO.get_signalstate_event_report_rows(report_file_name, signal_events))
+
+  @staticmethod
+  def get_signalstate_event_report_rows(report_file_name, signal_events):
+    num_signal_events = len(signal_events['start_frame_number'])
+
+    if signal_events['start_timestamp'] is None:
+      start_timestamps = end_timestamps = [None] * num_signal_events
+    else:
+      start_timestamps = signal_events['start_timestamp'].tolist()
+      end_timestamps = signal_events['end_timestamp'].tolist()
+
+    return [[report_file_name, sequence_number, classification,
+             start_frame_number, end_frame_number, start_timestamp,
+             end_timestamp, num_detections]
+            for sequence_number, (classification, start_frame_number,
+                                  end_frame_number, start_timestamp,
+                                  end_timestamp, num_detections) in enumerate(
+              zip(signal_events['classification'].tolist(),
+                  signal_events['start_frame_number'].tolist(),
+                  signal_events['end_frame_number'].tolist(),
+                  start_timestamps, end_timestamps,
+                  signal_events['num_detections'].tolist()), start=1)]
+
+  @staticmethod
+  def write_bbox_report(report_file_name, report_dir_path, detections,
+                        report_format='jsonl', chunk_size=None):
+    """Write one JSON object per signal state detection, with its box in
+    fractions of the frame, chunk_size objects at a time.
+
+    Args:
+      detections: dict. Detection columns as labeled by the signal state
+        processor.
+      report_format: str. 'jsonl' writes one object per line to a .jsonl file.
+        'json' writes a single array of objects to a .json file, as reports
+        were written before JSON lines.
+    """
+    if chunk_size is None:
+      chunk_size = IO.report_write_chunk_size
+
+    report_dir_path = path.join(report_dir_path, 'bbox_reports')
+
+    if not path.exists(report_dir_path):
+      os.makedirs(report_dir_path)
+
+    report_file_path = path.join(
+      report_dir_path, report_file_name + 'BBOX.' + report_format)
+
+    # string fields are encoded once, so that each object is formatted from
+    # numbers alone
+    object_format = '{"frame_num": %d, "video_name": ' + json.dumps(
+      report_file_name).replace('%', '%%') + ', "timestamp": %s, ' \
+      '"class_name": %s, "detection_boxes": [%r, %r, %r, %r], ' \
+      '"detection_score": %r}'
+
+    if report_format == 'json':
+      separator = ', '
+      chunk_prefix, chunk_suffix = separator, ''
+    else:
+      separator = '\n'
+      chunk_prefix, chunk_suffix = '', separator
+
+    num_detections = len(detections['frame_number'])
+
+    with IO._open_output_file(report_file_path) as file:
+      if report_format == 'json':
+        file.write('[')
+
+      for chunk_start in range(0, num_detections, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, num_detections)
+
+        if detections['timestamp'] is None:
+          timestamps = ['null'] * (chunk_end - chunk_start)
+        else:
+          timestamps = detections['timestamp'][chunk_start:chunk_end].tolist()
+
+        class_names = detections['classification'][
+          chunk_start:chunk_end].tolist()
+        encoded_class_names = {class_name: json.dumps(class_name)
+                               for class_name in set(class_names)}
+
+        chunk_values = []
+
+        for frame_number, timestamp, classification, box, score in zip(
+            detections['frame_number'][chunk_start:chunk_end].tolist(),
+            timestamps, class_names,
+            detections['box'][chunk_start:chunk_end].tolist(),
+            detections['score'][chunk_start:chunk_end].tolist()):
+          chunk_values.extend(
+            [frame_number, timestamp, encoded_class_names[classification]]
+            + box
+            + [score])
+
+        if chunk_start > 0:
+          file.write(chunk_prefix)
+
+        file.write(separator.join(
+          [object_format] * (chunk_end - chunk_start)) % tuple(chunk_values)
+                   + chunk_suffix)
+
+      if report_format == 'json':
+        file.write(']')
+
+    return IO.get_output_file_path(report_file_path)
+
+class ReportWriter:
+  def __init__(self, report_file_path, header):
+    """Create a new 'ReportWriter' object.
+
+    Rows are appended to the CSV file at report_file_path as they are written.
+    The file, and its header, are only created once the first row arrives.
+    """
+    self.report_file_path = IO.get_output_file_path(report_file_path)
+    self._uncompressed_report_file_path = report_file_path
+    self.header = header
+    self.report_file = None
+    self.csv_writer = None
+    self.num_rows = 0
+    self.last_flush_time = None
+
+  def write_rows(self, rows):
+    if len(rows) == 0:
+      return
+
+    if self.report_file is None:
+      report_dir_path = path.dirname(self.report_file_path)
+
+      if not path.exists(report_dir_path):
+        os.makedirs(report_dir_path)
+
+      self.report_file = IO._open_output_file(
+        self._uncompressed_report_file_path)
+      self.csv_writer = csv.writer(self.report_file)
+      self.csv_writer.writerow(self.header)
+      self.last_flush_time = time()
+
+    self.csv_writer.writerows(rows)
+
+    # written rows are made visible to readers at most once per
+    # report_flush_interval, and all of them once the report is closed
+    if time() - self.last_flush_time >= IO.report_flush_interval:
+      self.report_file.flush()
+      self.last_flush_time = time()
+
+    self.num_rows += len(rows)
+
+  def close(self):
+    if self.report_file is not None:
+      self.report_file.close()
+      self.report_file = None
@@ -0,0 +1,75 @@
+import logging
+import os
+from time import time
+from utils.io import IO
+from utils.probe import ProbeCache
+
+
+def read_ahead(video_file_path, readahead_size):
+  """Ask the kernel to start reading the head of a video into the page cache,
+  so that its decoder's first reads do not wait on the disk or network file
+  system.
+
+  Returns:
+    True if the hint was given, False if the platform does not support it.
+  """
+  if not hasattr(os, 'posix_fadvise'):
+    return False
+
+  video_file = os.open(video_file_path, os.O_RDONLY)
+
+  try:
+    os.posix_fadvise(
+      video_file, 0, readahead_size, os.POSIX_FADV_WILLNEED)
+  finally:
+    os.close(video_file)
+
+  return True
+
+
+def prefetch_video(video_file_path, ffprobe_path, probe_cache_path=None,
+                   readahead_size=64 * 1024 * 1024):
+  """Prepare a video that is waiting for a worker, so that its processing
+  starts decoding as soon as a worker takes it up.
+
+  Args:
+    video_file_path: str.
+    ffprobe_path: str.
+    probe_cache_path: str. The probe cache to read dimensions from and write
+      them to, if given.
+    readahead_size: int. The number of bytes at the head of the video to read
+      ahead. 0 reads ahead the whole video.
+
+  Returns:
+    The video's dimensions as returned by IO.get_video_dimensions, or None if
+    the video could not be probed, in which case the worker probes it again
+    and reports the failure.
+  """
+  start = time()
+
+  try:
+    read_ahead(video_file_path, readahead_size)
+  except OSError as e:
+    logging.warning('could not read ahead {}: {}'.format(video_file_path, e))
+
+  # each call runs on an executor thread, and SQLite connections may not be
+  # shared between threads
+  probe_cache = None
+
+  try:
+    if probe_cache_path:
+      probe_cache = ProbeCache(probe_cache_path)
+
+    video_dimensions = IO.get_video_dimensions(
+      video_file_path, ffprobe_path, probe_cache)
+  except Exception as e:
+    logging.warning('could not prefetch {}: {}'.format(video_file_path, e))
+    video_dimensions = None
+  finally:
+    if probe_cache is not None:
+      probe_cache.close()
+
+  logging.debug(IO.get_processing_duration(
+    time() - start, 'prefetched {} in'.format(video_file_path)))
+
+  return video_dimensions
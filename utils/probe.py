@@ -0,0 +1,175 @@
+import argparse
+import logging
+from multiprocessing import Pool
+import os
+import sqlite3
+from time import time
+from utils.io import IO
+
+path = os.path
+
+
+class ProbeCache:
+  def __init__(self, cache_file_path, timeout=60):
+    """Create a new 'ProbeCache' object.
+
+    Args:
+      cache_file_path: str. The path to the SQLite database in which probe
+        results are stored. The file is created if it does not exist.
+      timeout: float. The number of seconds to wait on a lock held by another
+        process (e.g. a concurrent pre-probe run) before raising.
+    """
+    self.cache_file_path = cache_file_path
+
+    cache_dir_path = path.dirname(path.abspath(cache_file_path))
+
+    if not path.exists(cache_dir_path):
+      os.makedirs(cache_dir_path)
+
+    self.connection = sqlite3.connect(cache_file_path, timeout=timeout)
+    self.connection.execute('PRAGMA journal_mode=WAL')
+    self.connection.execute(
+      'CREATE TABLE IF NOT EXISTS probes ('
+      'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, width INTEGER, '
+      'height INTEGER, num_frames INTEGER, duration INTEGER)')
+    self.connection.commit()
+
+  @staticmethod
+  def _get_key(video_file_path):
+    # a cached entry is only valid for the exact file that was probed, so any
+    # change in size or modification time invalidates it
+    video_file_path = path.abspath(video_file_path)
+    stat = os.stat(video_file_path)
+    return video_file_path, stat.st_size, stat.st_mtime_ns
+
+  def get(self, video_file_path):
+    video_file_path, size, mtime_ns = ProbeCache._get_key(video_file_path)
+
+    row = self.connection.execute(
+      'SELECT width, height, num_frames, duration FROM probes '
+      'WHERE path = ? AND size = ? AND mtime_ns = ?',
+      (video_file_path, size, mtime_ns)).fetchone()
+
+    return row
+
+  def put(self, video_file_path, video_dimensions):
+    self.put_many([(ProbeCache._get_key(video_file_path), video_dimensions)])
+
+  def put_many(self, entries):
+    self.connection.executemany(
+      'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?)',
+      [key + tuple(video_dimensions) for key, video_dimensions in entries])
+    self.connection.commit()
+
+  def close(self):
+    self.connection.close()
+
+
+def _probe_video(args):
+  video_file_path, ffprobe_path = args
+
+  try:
+    key = ProbeCache._get_key(video_file_path)
+    video_dimensions = IO.probe_video_dimensions(video_file_path, ffprobe_path)
+    return key, video_dimensions, None
+  except Exception as e:
+    return video_file_path, None, str(e)
+
+
+def read_video_file_paths(input_path):
+  if path.isdir(input_path):
+    return [path.join(input_path, video_file_name)
+            for video_file_name in IO.read_video_file_names(input_path)]
+
+  with open(input_path, newline='') as input_file:
+    return [line.rstrip() for line in input_file.readlines() if line.rstrip()]
+
+
+def preprobe(video_file_paths, cache_file_path, ffprobe_path, num_processes,
+             chunk_size=16, commit_size=256):
+  probe_cache = ProbeCache(cache_file_path)
+
+  unprobed_video_file_paths = []
+
+  for video_file_path in video_file_paths:
+    try:
+      if probe_cache.get(video_file_path) is None:
+        unprobed_video_file_paths.append(video_file_path)
+    except OSError as e:
+      logging.warning(e)
+
+  logging.info('{} of {} videos are missing from the probe cache'.format(
+    len(unprobed_video_file_paths), len(video_file_paths)))
+
+  entries = []
+  num_failures = 0
+
+  with Pool(processes=num_processes) as pool:
+    for key, video_dimensions, error in pool.imap_unordered(
+        _probe_video,
+        [(video_file_path, ffprobe_path)
+         for video_file_path in unprobed_video_file_paths],
+        chunksize=chunk_size):
+      if error is None:
+        entries.append((key, video_dimensions))
+      else:
+        num_failures += 1
+        logging.error('failed to probe {}: {}'.format(key, error))
+
+      if len(entries) >= commit_size:
+        probe_cache.put_many(entries)
+        entries = []
+
+  if len(entries) > 0:
+    probe_cache.put_many(entries)
+
+  probe_cache.close()
+
+  return len(unprobed_video_file_paths) - num_failures, num_failures
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Fill the SNVA probe cache with the dimensions of every video '
+                'in a directory or list so that processors can skip ffprobe')
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to a folder containing video files, or a text '
+                           'file that lists video file paths.')
+  parser.add_argument('--probecachepath', '-pcp', required=True,
+                      help='Path to the SQLite probe cache file.')
+  parser.add_argument('--ffprobepath', '-fpp', default=None,
+                      help='Path to the ffprobe binary. Defaults to the value '
+                           'of FFPROBE_HOME, then to ffprobe on the PATH.')
+  parser.add_argument('--numprocesses', '-np', type=int,
+                      default=os.cpu_count(),
+                      help='Number of ffprobe processes to run at one time')
+  parser.add_argument('--loglevel', '-ll', default='info',
+                      help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
+                           'for verbose or minimal logging, respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  if args.ffprobepath is not None:
+    ffprobe_path = args.ffprobepath
+  else:
+    ffprobe_path = os.environ.get('FFPROBE_HOME', 'ffprobe')
+
+  start = time()
+
+  num_probed, num_failed = preprobe(
+    read_video_file_paths(args.inputpath), args.probecachepath, ffprobe_path,
+    args.numprocesses)
+
+  logging.info(IO.get_processing_duration(
+    time() - start, 'probed {} videos ({} failures) in'.format(
+      num_probed, num_failed)))
@@ -5,11 +5,14 @@ import numpy as np
 import os
 import signal
 from time import time
-from utils.analyzer import VideoAnalyzer
+from utils.analyzer import VideoAnalyzer, get_prediction_service_stub
+from utils.catalog import ResultCatalog
 from utils.signalstateanalyzer import SignalVideoAnalyzer
 from utils.event import Trip
 from utils.io import IO
-from utils.timestamp import Timestamp
+from utils.probe import ProbeCache
+from utils.stream import TripStream
+from utils.track import summarize_tracks, track_detections
 
 path = os.path
 
@@ -23,6 +26,17 @@ def configure_logger(log_level, log_queue):
   root_logger.addHandler(queue_handler)
 
 
+def initialize_worker(model_server_host, processor_mode):
+  """Open the model server channel that every video processed by a worker
+  shares, so that its cost, like that of importing this module, is paid once
+  when the worker starts."""
+  if processor_mode == 'signalstate':
+    get_prediction_service_stub(
+      model_server_host, SignalVideoAnalyzer.service_stub_options)
+  else:
+    get_prediction_service_stub(model_server_host)
+
+
 def should_crop(frame_width, frame_height, do_crop, crop_width, crop_height,
                 crop_x, crop_y):
   if do_crop:
@@ -62,6 +76,36 @@ def should_extract_timestamps(
   else:
     logging.debug('timestamps will not be extracted')
     return False
+
+
+def label_detections(detections, class_name_map, timestamps, frame_width,
+                     frame_height):
+  """Add the class name, frame timestamp and pixel box of each signal state
+  detection to its columns.
+
+  Args:
+    detections: dict. Detection columns as returned by
+      SignalVideoAnalyzer.get_detections.
+    timestamps: int array. The timestamp of each frame, or None.
+  """
+  class_ids, class_indices = np.unique(
+    detections['class_id'], return_inverse=True)
+  class_names = np.array(
+    [class_name_map[class_id] for class_id in class_ids.tolist()],
+    dtype=np.str_)
+  detections['classification'] = class_names[class_indices.ravel()]
+
+  if timestamps is None:
+    detections['timestamp'] = None
+  else:
+    detections['timestamp'] = np.asarray(timestamps)[
+      detections['frame_number']]
+
+  # [ymin, xmin, ymax, xmax] fractions to [xtl, ytl, xbr, ybr] pixels
+  detections['pixel_box'] = detections['box'][:, [1, 0, 3, 2]] * np.array(
+    [frame_width, frame_height, frame_width, frame_height], dtype=np.float32)
+
+  return detections
   
   
 def process_video(
@@ -72,9 +116,15 @@ def process_video(
     timestamp_max_width, timestamp_height, timestamp_x, timestamp_y,
     do_deinterlace, num_channels, batch_size, do_smooth_probs,
     smoothing_factor, do_binarize_probs, do_write_inference_reports,
-    do_write_event_reports, max_threads, processor_mode):
+    do_write_event_reports, max_threads, processor_mode,
+    probe_cache_path=None, timestamp_anchor_interval=0,
+    timestamp_digit_tolerance=0, do_stream_events=False,
+    inference_report_format='csv', output_compression=None,
+    result_catalog_path=None, video_dimensions=None):
   configure_logger(log_level, log_queue)
 
+  IO.output_compression = output_compression
+
   interrupt_queue = Queue()
 
   # Create a output subdirectory for the current mode
@@ -101,8 +151,23 @@ def process_video(
   try:
     start = time()
 
-    frame_width, frame_height, num_frames, _ = IO.get_video_dimensions(
-      video_file_path, ffprobe_path)
+    # videos that were prefetched by the main process arrive already probed
+    if video_dimensions is None:
+      probe_cache = None
+
+      # workers run many videos, so the cache's connection must not outlive
+      # the video that opened it
+      try:
+        if probe_cache_path:
+          probe_cache = ProbeCache(probe_cache_path)
+
+        video_dimensions = IO.get_video_dimensions(
+          video_file_path, ffprobe_path, probe_cache)
+      finally:
+        if probe_cache is not None:
+          probe_cache.close()
+
+    frame_width, frame_height, num_frames, _ = video_dimensions
 
     end = time() - start
 
@@ -144,14 +209,8 @@ def process_video(
 
   logging.debug('Constructing ffmpeg command')
 
-  ffmpeg_command = [ffmpeg_path, '-i', video_file_path]
-
-  if do_deinterlace:
-    ffmpeg_command.append('-deinterlace')
-
-  ffmpeg_command.extend(
-    ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', 'vfr',
-     '-hide_banner', '-loglevel', '0', '-f', 'image2pipe', 'pipe:1'])
+  ffmpeg_command = IO.get_decode_command(
+    ffmpeg_path, video_file_path, do_deinterlace)
 
   try:
     do_extract_timestamps = should_extract_timestamps(
@@ -171,6 +230,26 @@ def process_video(
 
     return
 
+  presentation_timestamps = None
+
+  if do_extract_timestamps and timestamp_anchor_interval > 0:
+    try:
+      start = time()
+
+      presentation_timestamps = IO.read_anchor_presentation_timestamps(
+        video_file_path, ffprobe_path)
+
+      end = time() - start
+
+      processing_duration = IO.get_processing_duration(
+        end, 'read presentation timestamps in')
+
+      logging.info(processing_duration)
+    except Exception as e:
+      logging.warning('could not read presentation timestamps, so every '
+                      'timestamp will be read instead of reconstructed')
+      logging.warning(e)
+
   frame_shape = [frame_height, frame_width, num_channels]
 
   logging.debug('FFmpeg output frame shape == {}'.format(frame_shape))
@@ -180,12 +259,26 @@ def process_video(
     model_signature_name, model_server_host, model_input_size,
     do_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
     timestamp_max_width, do_crop, crop_x, crop_y, crop_width, crop_height,
-    ffmpeg_command, max_threads)
+    ffmpeg_command, max_threads, presentation_timestamps,
+    timestamp_anchor_interval, timestamp_digit_tolerance)
+
+  # events are detected and reported while inference is still under way
+  if do_stream_events:
+    trip_stream = TripStream(
+      video_file_name, output_dir_path, class_name_map, processor_mode,
+      analyzer.prob_array, analyzer.timestamp,
+      smoothing_factor if do_smooth_probs else 0, do_write_event_reports,
+      keep_rows=result_catalog_path is not None)
+    frame_callback = trip_stream.update
+  else:
+    trip_stream = None
+    frame_callback = None
 
   try:
     start = time()
 
-    num_analyzed_frames, probability_array, timestamp_array = analyzer.run()
+    num_analyzed_frames, probability_array, timestamp_object = analyzer.run(
+      frame_callback)
 
     end = time()
 
@@ -243,25 +336,23 @@ def process_video(
 
     return
 
-  logging.debug('converting timestamp images to strings')
+  logging.debug('finalizing timestamps read during analysis')
 
   if do_extract_timestamps:
     try:
       start = time()
 
-      timestamp_object = Timestamp(timestamp_height, timestamp_max_width)
-      timestamp_strings, qa_flags = \
-        timestamp_object.stringify_timestamps(timestamp_array)
+      timestamps, qa_flags = timestamp_object.finalize()
 
       end = time() - start
 
       processing_duration = IO.get_processing_duration(
-        end, 'timestamp strings converted in')
+        end, 'timestamps finalized in')
 
       logging.info(processing_duration)
     except Exception as e:
-      logging.error('encountered an unexpected error while converting '
-                    'timestamp image crops to strings'.format(os.getpid()))
+      logging.error('encountered an unexpected error while finalizing '
+                    'timestamps')
       logging.error(e)
 
       logging.debug(
@@ -275,7 +366,7 @@ def process_video(
 
       return
   else:
-    timestamp_strings = None
+    timestamps = None
     qa_flags = None
 
   logging.debug('attempting to generate reports')
@@ -286,8 +377,9 @@ def process_video(
 
       inf_report = IO.write_inference_report(
         video_file_name, output_dir_path, analyzer.prob_array, class_name_map,
-        timestamp_strings, qa_flags, do_smooth_probs, smoothing_factor,
-        do_binarize_probs)
+        timestamps, qa_flags, do_smooth_probs, smoothing_factor,
+        do_binarize_probs, inference_report_format,
+        {'model_name': model_name})
       output_files.append(inf_report)
       end = time() - start
 
@@ -313,37 +405,75 @@ def process_video(
   try:
     start = time()
 
-    if do_smooth_probs:
-      probability_array = IO.smooth_probs(
-        probability_array, smoothing_factor)
+    if trip_stream is not None:
+      num_events = trip_stream.finish()
+      catalog_rows = trip_stream.rows
 
-    frame_numbers = list(range(1, len(probability_array) + 1))
+      if num_events > 0:
+        logging.info('{} {} events were found in {}'.format(
+          num_events,
+          'weather' if processor_mode == 'weather' else 'work zone',
+          video_file_name))
 
-    if timestamp_strings is not None:
-      timestamp_strings = timestamp_strings.astype(np.int32)
-    trip = Trip(frame_numbers, timestamp_strings, qa_flags, probability_array,
-                class_name_map)
-
-    if processor_mode == "weather":
-      if len(trip.feature_sequence) > 0:
-        logging.info('{} weather events were found in {}'.format(
-          len(trip.feature_sequence), video_file_name))
         if do_write_event_reports:
-          weather_rep =IO.write_weather_report(video_file_name, output_dir_path, trip.feature_sequence)
-          output_files.append(weather_rep)
+          output_files.append(trip_stream.report_writer.report_file_path)
+      else:
+        logging.info(
+          'No events were found in {}'.format(video_file_name))
     else:
-      events = trip.find_work_zone_events()
+      if do_smooth_probs:
+        probability_array = IO.smooth_probs(
+          probability_array, smoothing_factor)
 
-      if len(events) > 0:
-        logging.info('{} work zone events were found in {}'.format(
-          len(events), video_file_name))
+      frame_numbers = list(range(1, len(probability_array) + 1))
 
-        if do_write_event_reports:
-          event_rep = IO.write_event_report(video_file_name, output_dir_path, events)
-          output_files.append(event_rep)
+      trip = Trip(frame_numbers, timestamps, qa_flags, probability_array,
+                  class_name_map)
+
+      IO.clear_smoothed_probs_cache()
+
+      if processor_mode == "weather":
+        catalog_rows = IO.get_weather_report_rows(
+          video_file_name, trip.feature_sequence)
+
+        if trip.num_features > 0:
+          logging.info('{} weather events were found in {}'.format(
+            trip.num_features, video_file_name))
+          if do_write_event_reports:
+            weather_rep =IO.write_weather_report(video_file_name, output_dir_path, trip.feature_sequence)
+            output_files.append(weather_rep)
       else:
-        logging.info(
-          'No work zone events were found in {}'.format(video_file_name))
+        events = trip.find_work_zone_events()
+
+        catalog_rows = IO.get_event_report_rows(video_file_name, events)
+
+        if len(events) > 0:
+          logging.info('{} work zone events were found in {}'.format(
+            len(events), video_file_name))
+
+          if do_write_event_reports:
+            event_rep = IO.write_event_report(video_file_name, output_dir_path, events)
+            output_files.append(event_rep)
+        else:
+          logging.info(
+            'No work zone events were found in {}'.format(video_file_name))
+
+    # results are only cataloged once the video has been processed, so that a
+    # failure leaves its previous results in place
+    if result_catalog_path is not None:
+      result_catalog = ResultCatalog(result_catalog_path)
+
+      try:
+        result_catalog.begin_video(video_file_name, processor_mode, num_frames)
+
+        if processor_mode == 'weather':
+          result_catalog.add_weather_rows(catalog_rows)
+        else:
+          result_catalog.add_event_rows(catalog_rows)
+
+        result_catalog.end_video()
+      finally:
+        result_catalog.close()
 
     end = time() - start
 
@@ -385,9 +515,16 @@ def process_video_signalstate(
     timestamp_max_width, timestamp_height, timestamp_x, timestamp_y,
     do_deinterlace, num_channels, batch_size, do_smooth_probs,
     smoothing_factor, do_binarize_probs, do_write_bbox_reports,
-    do_write_event_reports, max_threads, processor_mode):
+    do_write_event_reports, max_threads, processor_mode,
+    probe_cache_path=None, timestamp_anchor_interval=0,
+    timestamp_digit_tolerance=0, output_compression=None,
+    result_catalog_path=None, track_iou_threshold=0.3,
+    track_max_missed_frames=1, bbox_report_format='jsonl',
+    video_dimensions=None):
   configure_logger(log_level, log_queue)
 
+  IO.output_compression = output_compression
+
   interrupt_queue = Queue()
 
   # Create a output subdirectory for the current mode
@@ -414,8 +551,22 @@ def process_video_signalstate(
     start = time()
 
     # For signal state, we use duration as num_frames, as we will only grab one frame per second
-    frame_width, frame_height, num_frames, duration = IO.get_video_dimensions(
-      video_file_path, ffprobe_path)
+    if video_dimensions is None:
+      probe_cache = None
+
+      # workers run many videos, so the cache's connection must not outlive
+      # the video that opened it
+      try:
+        if probe_cache_path:
+          probe_cache = ProbeCache(probe_cache_path)
+
+        video_dimensions = IO.get_video_dimensions(
+          video_file_path, ffprobe_path, probe_cache)
+      finally:
+        if probe_cache is not None:
+          probe_cache.close()
+
+    frame_width, frame_height, num_frames, duration = video_dimensions
     num_frames = duration
     end = time() - start
 
@@ -457,14 +608,9 @@ def process_video_signalstate(
 
   logging.debug('Constructing ffmpeg command')
 
-  ffmpeg_command = [ffmpeg_path, '-i', video_file_path]
-
-  if do_deinterlace:
-    ffmpeg_command.append('-deinterlace')
-
-  ffmpeg_command.extend(
-    ['-vcodec', 'rawvideo', '-pix_fmt', 'rgb24', '-vsync', 'vfr',
-     '-hide_banner', '-loglevel', '0', '-r', '1', '-f', 'image2pipe', 'pipe:1'])
+  ffmpeg_command = IO.get_decode_command(
+    ffmpeg_path, video_file_path, do_deinterlace,
+    output_frame_rate=IO.signalstate_frame_rate)
 
   try:
     do_extract_timestamps = should_extract_timestamps(
@@ -484,6 +630,26 @@ def process_video_signalstate(
 
     return
 
+  presentation_timestamps = None
+
+  if do_extract_timestamps and timestamp_anchor_interval > 0:
+    try:
+      start = time()
+
+      presentation_timestamps = IO.read_anchor_presentation_timestamps(
+        video_file_path, ffprobe_path, IO.signalstate_frame_rate)
+
+      end = time() - start
+
+      processing_duration = IO.get_processing_duration(
+        end, 'read presentation timestamps in')
+
+      logging.info(processing_duration)
+    except Exception as e:
+      logging.warning('could not read presentation timestamps, so every '
+                      'timestamp will be read instead of reconstructed')
+      logging.warning(e)
+
   frame_shape = [frame_height, frame_width, num_channels]
 
   logging.debug('FFmpeg output frame shape == {}'.format(frame_shape))
@@ -493,12 +659,13 @@ def process_video_signalstate(
   model_signature_name, model_server_host, model_input_size,
   do_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
   timestamp_max_width, do_crop, crop_x, crop_y, crop_width, crop_height,
-  ffmpeg_command, max_threads)
+  ffmpeg_command, max_threads, presentation_timestamps,
+  timestamp_anchor_interval, timestamp_digit_tolerance)
 
   try:
     start = time()
 
-    num_analyzed_frames, frame_map_array, timestamp_array = analyzer.run()
+    num_analyzed_frames, detections, timestamp_object = analyzer.run()
 
     end = time()
 
@@ -549,25 +716,23 @@ def process_video_signalstate(
 
     return
 
-  logging.debug('converting timestamp images to strings')
+  logging.debug('finalizing timestamps read during analysis')
 
   if do_extract_timestamps:
     try:
       start = time()
 
-      timestamp_object = Timestamp(timestamp_height, timestamp_max_width)
-      timestamp_strings, qa_flags = \
-        timestamp_object.stringify_timestamps(timestamp_array)
+      timestamps, qa_flags = timestamp_object.finalize()
 
       end = time() - start
 
       processing_duration = IO.get_processing_duration(
-        end, 'timestamp strings converted in')
+        end, 'timestamps finalized in')
 
       logging.info(processing_duration)
     except Exception as e:
-      logging.error('encountered an unexpected error while converting '
-                    'timestamp image crops to strings'.format(os.getpid()))
+      logging.error('encountered an unexpected error while finalizing '
+                    'timestamps')
       logging.error(e)
 
       logging.debug(
@@ -581,66 +746,68 @@ def process_video_signalstate(
 
       return
   else:
-    timestamp_strings = None
+    timestamps = None
     qa_flags = None
 
   logging.debug('attempting to generate reports')
 
-  if do_write_bbox_reports:
-    json_data = []
-    for frame_num, frame_map in enumerate(frame_map_array, start=0):
-      if timestamp_strings is not None:
-        timestamp = timestamp_strings[frame_num]
-      else:
-        timestamp = None
-      for i in range(0, frame_map['num_detections']):
-        class_name = class_name_map[frame_map['detection_classes'][i]]
-        bbox = frame_map['detection_boxes'][i]
-        json_data.append({
-          'frame_num': int(frame_num),
-          'video_name': video_file_name,
-          'timestamp': int(timestamp),
-          'class_name': class_name,
-          'detection_boxes': bbox.tolist(),
-          'detection_score': float(frame_map['detection_scores'][i])})
-    bbox_rep = IO.write_json(video_file_name + 'BBOX', output_dir_path, json_data)
-    output_files.append(bbox_rep)
-
   try:
     start = time()
 
-    frame_numbers = list(range(1, len(frame_map_array) + 1))
+    detections = label_detections(
+      detections, class_name_map, timestamps, frame_width, frame_height)
 
-    if timestamp_strings is not None:
-      timestamp_strings = timestamp_strings.astype(np.int32)
+    if do_write_bbox_reports:
+      bbox_rep = IO.write_bbox_report(
+        video_file_name, output_dir_path, detections, bbox_report_format)
+      output_files.append(bbox_rep)
 
-    # Process our raw predictions into a list of bounding boxes and frame data
-    detections = []
-    for frame_num, frame_map in enumerate(frame_map_array, start=0):
-      if timestamp_strings is not None:
-        timestamp = timestamp_strings[frame_num]
-      else:
-        timestamp = None
-      for i in range(0, frame_map['num_detections']):
-        class_name = class_name_map[frame_map['detection_classes'][i]]
-        bbox = frame_map['detection_boxes'][i]
-        xtl = bbox[1] * frame_width
-        ytl = bbox[0] * frame_height
-        xbr = bbox[3] * frame_width
-        ybr = bbox[2] * frame_height
-        detections.append({'frame_num': frame_num, 'timestamp': timestamp, 'classification': class_name, \
-                          'xtl': xtl, 'ytl': ytl, 'xbr': xbr, 'ybr': ybr})
-    if len(detections) > 0:
+    # group each signal's detections across frames into one event
+    track_ids = track_detections(
+      detections['frame_number'], detections['pixel_box'],
+      track_iou_threshold, track_max_missed_frames)
+    signal_events = summarize_tracks(
+      track_ids, detections['frame_number'], detections['timestamp'],
+      detections['classification'])
+
+    num_detections = len(detections['frame_number'])
+
+    if num_detections > 0:
       logging.info('{} signal state detections were found in {}'.format(
-        len(detections), video_file_name))
+        num_detections, video_file_name))
 
       if do_write_event_reports:
         evt_rep = IO.write_signalstate_report(video_file_name, output_dir_path, detections)
         output_files.append(evt_rep)
+
+      logging.info('{} signal state detections were grouped into {} signal '
+                   'events'.format(num_detections,
+                                   len(signal_events['num_detections'])))
+
+      if do_write_event_reports:
+        sig_rep = IO.write_signalstate_event_report(
+          video_file_name, output_dir_path, signal_events)
+        output_files.append(sig_rep)
     else:
       logging.info(
         'No signal state events were found in {}'.format(video_file_name))
 
+    if result_catalog_path is not None:
+      result_catalog = ResultCatalog(result_catalog_path)
+
+      try:
+        result_catalog.begin_video(video_file_name, processor_mode, num_frames)
+        result_catalog.add_signalstate_rows(IO.get_signalstate_report_rows(
+          video_file_name, detections))
+        result_catalog.end_video()
+        result_catalog.begin_video(
+          video_file_name, 'signalstate_event', num_frames)
+        result_catalog.add_signalstate_event_rows(
+          IO.get_signalstate_event_report_rows(video_file_name, signal_events))
+        result_catalog.end_video()
+      finally:
+        result_catalog.close()
+
     end = time() - start
 
     processing_duration = IO.get_processing_duration(
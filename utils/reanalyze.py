@@ -0,0 +1,176 @@
+import argparse
+import logging
+from multiprocessing import Pool
+import os
+from time import time
+from utils.event import TripFromReportFile
+from utils.io import IO
+
+path = os.path
+
+
+def _reanalyze_report(args):
+  report_file_path, class_names_file_path, output_dir_path, processor_mode, \
+    smooth_probs, smoothing_factor, non_event_weight_scale, \
+    minimum_event_length = args
+
+  report_file_name = IO.strip_report_extension(path.basename(report_file_path))
+
+  start = time()
+
+  try:
+    trip = TripFromReportFile(
+      report_file_path, class_names_file_path, smooth_probs, smoothing_factor,
+      non_event_weight_scale, minimum_event_length)
+
+    if processor_mode == 'weather':
+      num_events = trip.num_features
+
+      if num_events > 0:
+        IO.write_weather_report(
+          report_file_name, output_dir_path, trip.feature_sequence)
+    else:
+      events = trip.find_work_zone_events()
+      num_events = len(events)
+
+      if num_events > 0:
+        IO.write_event_report(report_file_name, output_dir_path, events)
+
+    IO.clear_smoothed_probs_cache()
+
+    return report_file_path, num_events, time() - start, None
+  except Exception as e:
+    IO.clear_smoothed_probs_cache()
+
+    return report_file_path, None, time() - start, str(e)
+
+
+def is_report_file_name(file_name):
+  extension = file_name[len(IO.strip_report_extension(file_name)):]
+
+  return extension in ['.csv', IO.columnar_report_extension] + [
+    '.csv' + suffix for suffix in IO.output_compression_suffixes.values()]
+
+
+def read_report_file_paths(input_path):
+  if path.isdir(input_path):
+    report_file_paths = []
+
+    for dir_path, _, file_names in os.walk(input_path):
+      report_file_paths.extend(
+        [path.join(dir_path, file_name) for file_name in file_names
+         if is_report_file_name(file_name)])
+
+    return sorted(report_file_paths)
+
+  with open(input_path, newline='') as input_file:
+    return [line.rstrip() for line in input_file.readlines() if line.rstrip()]
+
+
+def reanalyze(report_file_paths, class_names_file_path, output_dir_path,
+              processor_mode='workzone', smooth_probs=False,
+              smoothing_factor=16, non_event_weight_scale=0.05,
+              minimum_event_length=100, num_processes=None, chunk_size=4):
+  output_dir_path = path.join(output_dir_path, processor_mode)
+
+  if not path.exists(output_dir_path):
+    os.makedirs(output_dir_path)
+
+  summary_rows = []
+  num_failures = 0
+
+  with Pool(processes=num_processes) as pool:
+    for report_file_path, num_events, duration, error in pool.imap_unordered(
+        _reanalyze_report,
+        [(report_file_path, class_names_file_path, output_dir_path,
+          processor_mode, smooth_probs, smoothing_factor,
+          non_event_weight_scale, minimum_event_length)
+         for report_file_path in report_file_paths],
+        chunksize=chunk_size):
+      if error is None:
+        logging.debug('found {} events in {}'.format(
+          num_events, report_file_path))
+        summary_rows.append(
+          [report_file_path, 'success', '{:d}'.format(num_events),
+           '{:.3f}'.format(duration), ''])
+      else:
+        num_failures += 1
+        logging.error('failed to reanalyze {}: {}'.format(
+          report_file_path, error))
+        summary_rows.append(
+          [report_file_path, 'failure', '', '{:.3f}'.format(duration), error])
+
+  # imap_unordered yields in completion order, but the summary should be
+  # comparable between runs
+  summary_rows.sort(key=lambda row: row[0])
+
+  summary_file_path = path.join(output_dir_path, 'reanalysis_summary.csv')
+
+  IO.write_csv(summary_file_path, ['report_file_path', 'status', 'num_events',
+                                   'duration', 'error'], summary_rows)
+
+  return len(report_file_paths) - num_failures, num_failures, summary_file_path
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Regenerate SNVA event reports from existing inference reports '
+                'without decoding video or querying the model server')
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to a folder of inference reports (searched '
+                           'recursively), or a text file that lists inference '
+                           'report file paths.')
+  parser.add_argument('--classnamesfilepath', '-cnfp', required=True,
+                      help='Path to the class ids/names text file that the '
+                           'inference reports were generated with.')
+  parser.add_argument('--outputpath', '-op', default='./reports',
+                      help='Path to the output folder. Event reports are '
+                           'written to <outputpath>/<processormode>/'
+                           'event_reports.')
+  parser.add_argument('--processormode', '-pm', default='workzone',
+                      help='Pass \'weather\' to report weather features '
+                           'instead of work zone events.')
+  parser.add_argument('--smoothprobs', '-sp', action='store_true',
+                      help='Apply class-wise smoothing across video frame class'
+                           ' probability distributions.')
+  parser.add_argument('--smoothingfactor', '-sf', type=int, default=16,
+                      help='The class-wise probability smoothing factor.')
+  parser.add_argument('--noneventweightscale', '-news', type=float,
+                      default=0.05,
+                      help='Weight given to non-event features when deciding '
+                           'whether an event has ended.')
+  parser.add_argument('--minimumeventlength', '-mel', type=int, default=100,
+                      help='The minimum number of frames in a reported event.')
+  parser.add_argument('--numprocesses', '-np', type=int,
+                      default=os.cpu_count(),
+                      help='Number of reports to reanalyze at one time')
+  parser.add_argument('--chunksize', '-cs', type=int, default=4,
+                      help='Number of reports dispatched to a process at once')
+  parser.add_argument('--loglevel', '-ll', default='info',
+                      help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
+                           'for verbose or minimal logging, respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  start = time()
+
+  num_reanalyzed, num_failed, summary_file_path = reanalyze(
+    read_report_file_paths(args.inputpath), args.classnamesfilepath,
+    args.outputpath, args.processormode, args.smoothprobs,
+    args.smoothingfactor, args.noneventweightscale, args.minimumeventlength,
+    num_processes=args.numprocesses, chunk_size=args.chunksize)
+
+  logging.info(IO.get_processing_duration(
+    time() - start, 'reanalyzed {} reports ({} failures) in'.format(
+      num_reanalyzed, num_failed)))
+  logging.info('wrote run summary to {}'.format(summary_file_path))
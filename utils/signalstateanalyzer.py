@@ -1,5 +1,4 @@
 from concurrent import futures
-from grpc import insecure_channel
 import logging
 import numpy as np
 from skimage import img_as_float32
@@ -7,18 +6,24 @@ from skimage.transform import resize
 from subprocess import PIPE, Popen
 from tensorboard._vendor.tensorflow_serving.apis.predict_pb2 \
   import PredictRequest  #TODO or not todo, find an alternative source of TF serving api
-from tensorboard._vendor.tensorflow_serving.apis.prediction_service_pb2_grpc \
-  import PredictionServiceStub
 import tensorflow as tf
+from utils.analyzer import get_prediction_service_stub
+from utils.timestamp import Timestamp
 
 
 class SignalVideoAnalyzer:
+  # detection responses are far larger than grpc's default message limit
+  service_stub_options = [('grpc.max_message_length', 100 * 1024 * 1024),
+                          ('grpc.max_receive_message_length', 100 * 1024 * 1024)]
+
   def __init__(
       self, frame_shape, num_frames, num_classes, batch_size, model_name,
       model_signature_name, model_server_host, model_input_size,
       should_extract_timestamps, timestamp_x, timestamp_y, timestamp_height,
       timestamp_max_width, should_crop, crop_x, crop_y, crop_width,
-      crop_height, ffmpeg_command, max_num_threads):
+      crop_height, ffmpeg_command, max_num_threads,
+      presentation_timestamps=None, timestamp_anchor_interval=0,
+      timestamp_digit_tolerance=0):
     #### frame generator variables ####
     self.frame_shape = frame_shape
     self.should_crop = should_crop
@@ -33,32 +38,34 @@ class SignalVideoAnalyzer:
     self.should_extract_timestamps = should_extract_timestamps
 
     if self.should_extract_timestamps:
-      self.ti = 0
-
       self.tx = timestamp_x
       self.ty = timestamp_y
       self.th = timestamp_height
       self.tw = timestamp_max_width
 
-      self.timestamp_array = np.ndarray(
-        (self.th * num_frames, self.tw, self.frame_shape[-1]), dtype=np.uint8)
+      # timestamp crops are read as they arrive so that only their integer
+      # values, not the crops themselves, are held for the length of the video
+      self.timestamp = Timestamp(
+        self.th, self.tw, timestamp_digit_tolerance)
+      self.timestamp.begin(num_frames, presentation_timestamps,
+                           timestamp_anchor_interval)
     else:
-      self.timestamp_array = None
+      self.timestamp = None
 
     self.model_input_size = model_input_size
     self.max_num_threads = max_num_threads
     self.batch_size = batch_size
     self.ffmpeg_command = ffmpeg_command
     self.num_classes = num_classes
-    self.signal_maps = []
+    # the raw model outputs of each request, keyed by the index of its first
+    # frame, since requests complete out of order
+    self.detection_batches = {}
     self.num_frames_processed = 0
 
     self.model_name = model_name
     self.signature_name = model_signature_name
-    max_msg_length = 100* 1024 * 1024
-    options = [('grpc.max_message_length', max_msg_length), ('grpc.max_receive_message_length', max_msg_length)]
-    channel = insecure_channel(model_server_host, options=options)
-    self.service_stub = PredictionServiceStub(channel)
+    self.service_stub = get_prediction_service_stub(
+      model_server_host, SignalVideoAnalyzer.service_stub_options)
 
     logging.debug('opening video frame pipe')
 
@@ -111,10 +118,9 @@ class SignalVideoAnalyzer:
         frame = np.reshape(frame, self.frame_shape)
 
         if self.should_extract_timestamps:
-          self.timestamp_array[self.th * self.ti:self.th * (self.ti + 1)] = \
-            frame[self.ty:self.ty + self.th,
-            self.tx:self.tx + self.tw]
-          self.ti += 1
+          self.timestamp.update(
+            frame[np.newaxis, self.ty:self.ty + self.th,
+            self.tx:self.tx + self.tw])
 
         if self.should_crop:
           frame = frame[self.crop_y:self.crop_y + self.crop_height,
@@ -154,15 +160,8 @@ class SignalVideoAnalyzer:
     classes = tf.make_ndarray(response.outputs['detection_classes'])
     scores = tf.make_ndarray(response.outputs['detection_scores'])
     boxes = tf.make_ndarray(response.outputs['detection_boxes'])
-    num_detections = int(counts[0])
-    frame_scores = scores[0]
-    frame_scores = frame_scores[:num_detections]
-    frame_classes = classes[0]
-    frame_classes = frame_classes[:num_detections]
-    frame_boxes = boxes[0]
-    frame_boxes = frame_boxes[:num_detections]
-    frame_map = {'num_detections': num_detections, 'detection_classes': frame_classes, 'detection_scores': frame_scores, 'detection_boxes': frame_boxes }
-    self.signal_maps.insert(index, frame_map)
+    self.detection_batches[index] = (
+      counts[:1], classes[:1], scores[:1], boxes[:1])
     return 1  # report one additional frame processed to caller
 
   def _produce_batch_grpc_request(self):
@@ -182,11 +181,8 @@ class SignalVideoAnalyzer:
         frame = np.fromstring(frame, dtype=np.uint8)
         frame = np.reshape(frame, [-1] + self.frame_shape)
         if self.should_extract_timestamps:
-          self.timestamp_array[self.th * self.ti:self.th * (
-            self.ti + frame.shape[0])] = \
-            np.reshape(frame[:, self.ty:self.ty + self.th,
-            self.tx:self.tx + self.tw], (-1,) + self.timestamp_array.shape[1:])
-          self.ti += frame.shape[0]
+          self.timestamp.update(
+            frame[:, self.ty:self.ty + self.th, self.tx:self.tx + self.tw])
         if self.should_crop:
           frame = frame[:, self.crop_y:self.crop_y + self.crop_height,
                   self.crop_x:self.crop_x + self.crop_width]
@@ -221,16 +217,7 @@ class SignalVideoAnalyzer:
     classes = tf.make_ndarray(response.outputs['detection_classes'])
     scores = tf.make_ndarray(response.outputs['detection_scores'])
     boxes = tf.make_ndarray(response.outputs['detection_boxes'])
-    for i in range(counts.shape[0]):
-      num_detections = int(counts[i])
-      frame_scores = scores[i]
-      frame_scores = frame_scores[:num_detections]
-      frame_classes = classes[i]
-      frame_classes = frame_classes[:num_detections]
-      frame_boxes = boxes[i]
-      frame_boxes = frame_boxes[:num_detections]
-      frame_map = {'num_detections': num_detections, 'detection_classes': frame_classes, 'detection_scores': frame_scores, 'detection_boxes': frame_boxes }
-      self.signal_maps.insert(index + i, frame_map)
+    self.detection_batches[index] = (counts, classes, scores, boxes)
 
     return counts.shape[0]  # report num frames processed to caller
 
@@ -251,7 +238,44 @@ class SignalVideoAnalyzer:
     logging.info('completed inference on {} frames.'.format(
       self.num_frames_processed))
 
-    return self.num_frames_processed, self.signal_maps, self.timestamp_array
+    return self.num_frames_processed, self.get_detections(), self.timestamp
+
+  def get_detections(self):
+    """Concatenate the detections of every request, in frame order.
+
+    Returns:
+      A dict of columns with one element (or row) per detection:
+      'frame_number' (counted from 0), 'class_id', 'score', and 'box', an
+      (n, 4) array of [ymin, xmin, ymax, xmax] in fractions of the frame.
+    """
+    frame_numbers = []
+    class_ids = []
+    scores = []
+    boxes = []
+
+    for index in sorted(self.detection_batches):
+      batch_counts, batch_classes, batch_scores, batch_boxes = \
+        self.detection_batches[index]
+
+      # each frame's outputs are padded to the maximum number of detections
+      is_detection = np.arange(batch_scores.shape[1]) \
+                     < batch_counts.astype(np.int64)[:, np.newaxis]
+
+      frame_numbers.append(index + np.nonzero(is_detection)[0])
+      class_ids.append(batch_classes[is_detection].astype(np.int64))
+      scores.append(batch_scores[is_detection])
+      boxes.append(batch_boxes[is_detection])
+
+    if len(frame_numbers) == 0:
+      return {'frame_number': np.zeros(0, dtype=np.int64),
+              'class_id': np.zeros(0, dtype=np.int64),
+              'score': np.zeros(0, dtype=np.float32),
+              'box': np.zeros((0, 4), dtype=np.float32)}
+
+    return {'frame_number': np.concatenate(frame_numbers),
+            'class_id': np.concatenate(class_ids),
+            'score': np.concatenate(scores),
+            'box': np.concatenate(boxes)}
 
   def __del__(self):
     if self.frame_pipe.returncode is None:
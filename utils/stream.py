@@ -0,0 +1,425 @@
+import logging
+import numpy as np
+import os
+from utils.event import Event, Feature
+from utils.io import IO, ReportWriter
+
+path = os.path
+
+
+class ProbabilitySmoother:
+  def __init__(self, smoothing_factor):
+    """Create a new 'ProbabilitySmoother' object.
+
+    Smooths probabilities as they arrive in frame order, matching the output
+    of IO.smooth_probs over the whole video to within float32 rounding
+    (exactly, for windows that IO.smooth_probs convolves directly). Each
+    smoothed frame is produced as soon as the window that covers it has
+    arrived, so at most one window of raw frames is held at a time.
+    """
+    weight, self.window = IO._get_gauss_weight_and_window(smoothing_factor)
+    self.weight = (weight / np.sum(weight)).astype(np.float32)
+    self.head_padding_len, _ = IO._div_odd(self.window)
+
+    self.buffer = None
+    self.num_received_frames = 0
+    self.num_smoothed_windows = 0
+    self.last_smoothed_probs = None
+
+  def update(self, class_probs):
+    """Receive the probabilities of the next frames.
+
+    Returns:
+      A float32 array holding the smoothed probabilities of the next frames
+      that can be smoothed, which may be empty.
+    """
+    class_probs = np.asarray(class_probs, dtype=np.float32)
+
+    if self.buffer is None:
+      self.buffer = class_probs
+    else:
+      self.buffer = np.concatenate((self.buffer, class_probs))
+
+    self.num_received_frames += class_probs.shape[0]
+
+    # IO.smooth_probs never smooths a window that includes the last frame, so
+    # a window is only smoothed once the frame after it has arrived
+    num_smoothable_windows = \
+      self.num_received_frames - self.window - self.num_smoothed_windows
+
+    if num_smoothable_windows <= 0:
+      return np.zeros((0, class_probs.shape[1]), dtype=np.float32)
+
+    if self.window > IO.max_direct_smoothing_window:
+      smoothed_probs = IO._convolve_by_fft(
+        self.buffer[:num_smoothable_windows + self.window - 1], self.weight,
+        num_smoothable_windows)
+    else:
+      smoothed_probs = IO._convolve_directly(
+        self.buffer, self.weight, num_smoothable_windows)
+
+    self.buffer = self.buffer[num_smoothable_windows:]
+
+    if self.num_smoothed_windows == 0:
+      smoothed_probs = np.concatenate(
+        (np.repeat(smoothed_probs[:1], self.head_padding_len, axis=0),
+         smoothed_probs))
+
+    self.num_smoothed_windows += num_smoothable_windows
+    self.last_smoothed_probs = smoothed_probs[-1:]
+
+    return smoothed_probs
+
+  def finish(self):
+    """Return the smoothed probabilities of the frames that remain."""
+    if self.buffer is None:
+      return np.zeros((0, 0), dtype=np.float32)
+
+    if self.last_smoothed_probs is None:
+      logging.warning('{} frames are too few to smooth with a window of {} '
+                      'frames'.format(self.num_received_frames, self.window))
+      return self.buffer
+
+    num_remaining_frames = self.num_received_frames - \
+                           self.head_padding_len - self.num_smoothed_windows
+
+    return np.repeat(self.last_smoothed_probs, num_remaining_frames, axis=0)
+
+
+class StreamingTrip:
+  def __init__(self, class_name_map, target_feature_class_names=None,
+               smoothing_factor=0, non_event_weight_scale=0.05,
+               minimum_event_length=100):
+    """Create a new 'StreamingTrip' object.
+
+    Segments class probabilities into features, and features into events, as
+    they arrive in frame order. Features and events are returned as soon as
+    they are closed and are identical to those of a Trip over the whole video
+    (with find_events given no preceding or following feature class).
+
+    Args:
+      class_name_map: dict. Maps class ids to class names.
+      target_feature_class_names: list. The names of the classes that make up
+        an event. Defaults to the work zone classes.
+      smoothing_factor: int. Probabilities are smoothed as by IO.smooth_probs
+        if greater than 0.
+    """
+    self.class_names = class_name_map
+    self.class_ids = {value: key for key, value in self.class_names.items()}
+
+    if target_feature_class_names is None:
+      target_feature_class_names = [
+        'regulatory_sign', 'warning_sign', 'work_zone']
+
+    self.target_feature_class_ids = set(
+      self.class_ids[name] for name in target_feature_class_names)
+
+    if smoothing_factor > 0:
+      self.smoother = ProbabilitySmoother(smoothing_factor)
+    else:
+      self.smoother = None
+
+    self.weight_scale = non_event_weight_scale
+    self.minimum_event_length = minimum_event_length
+
+    # frame numbers, timestamps and QA flags of frames awaiting smoothing
+    self.pending_frame_numbers = np.zeros((0,), dtype=np.int64)
+    self.pending_timestamps = None
+    self.pending_qa_flags = None
+
+    # the feature that the most recent frame belongs to
+    self.feature_id = 0
+    self.class_id = None
+    self.start_frame_number = None
+    self.start_timestamp = None
+    self.start_timestamp_qa_flag = None
+    self.end_frame_number = None
+    self.end_timestamp = None
+    self.end_timestamp_qa_flag = None
+
+    # the event that is being accumulated
+    self.event_id = 0
+    self.target_feature_list = None
+    self.weight = 0.0
+
+  def _close_feature(self):
+    feature = Feature(
+      self.feature_id, self.class_id, self.class_names[self.class_id],
+      self.start_timestamp, self.end_timestamp, self.start_timestamp_qa_flag,
+      self.end_timestamp_qa_flag, self.start_frame_number,
+      self.end_frame_number)
+
+    self.feature_id += 1
+
+    return feature
+
+  def _close_event(self):
+    event = Event(event_id=self.event_id,
+                  target_feature_list=self.target_feature_list)
+
+    self.target_feature_list = None
+    self.weight = 0
+
+    if event.length >= self.minimum_event_length:
+      self.event_id += 1
+      return [event]
+
+    return []
+
+  def _consume_feature(self, feature):
+    if self.target_feature_list is None:
+      if feature.class_id in self.target_feature_class_ids:
+        self.target_feature_list = [feature]
+        self.weight += feature.length
+
+      return []
+
+    if feature.class_id in self.target_feature_class_ids:
+      self.target_feature_list.append(feature)
+      self.weight += feature.length
+    else:
+      self.weight -= self.weight_scale * feature.length
+
+    if self.weight <= 0:
+      return self._close_event()
+
+    return []
+
+  def _segment(self, class_ids, frame_numbers, timestamps, qa_flags):
+    features = []
+    events = []
+
+    if class_ids.shape[0] == 0:
+      return features, events
+
+    # the first frame of each feature that begins in this batch
+    start_indices = np.flatnonzero(np.diff(class_ids)) + 1
+
+    if self.class_id is None or class_ids[0] != self.class_id:
+      start_indices = np.concatenate(([0], start_indices))
+
+    class_ids = class_ids.tolist()
+    frame_numbers = frame_numbers.tolist()
+
+    if timestamps is not None:
+      timestamps = timestamps.tolist()
+      qa_flags = qa_flags.tolist()
+
+    for start_index in start_indices.tolist():
+      if self.class_id is not None:
+        if start_index > 0:
+          self.end_frame_number = frame_numbers[start_index - 1]
+
+          if timestamps is not None:
+            self.end_timestamp = timestamps[start_index - 1]
+            self.end_timestamp_qa_flag = qa_flags[start_index - 1]
+
+        feature = self._close_feature()
+        features.append(feature)
+        events.extend(self._consume_feature(feature))
+
+      self.class_id = class_ids[start_index]
+      self.start_frame_number = frame_numbers[start_index]
+
+      if timestamps is not None:
+        self.start_timestamp = timestamps[start_index]
+        self.start_timestamp_qa_flag = qa_flags[start_index]
+
+    self.end_frame_number = frame_numbers[-1]
+
+    if timestamps is not None:
+      self.end_timestamp = timestamps[-1]
+      self.end_timestamp_qa_flag = qa_flags[-1]
+
+    return features, events
+
+  def _segment_smoothed_probs(self, smoothed_probs):
+    num_frames = smoothed_probs.shape[0]
+
+    if num_frames == 0:
+      return [], []
+
+    frame_numbers = self.pending_frame_numbers[:num_frames]
+    self.pending_frame_numbers = self.pending_frame_numbers[num_frames:]
+
+    if self.pending_timestamps is not None:
+      timestamps = self.pending_timestamps[:num_frames]
+      qa_flags = self.pending_qa_flags[:num_frames]
+      self.pending_timestamps = self.pending_timestamps[num_frames:]
+      self.pending_qa_flags = self.pending_qa_flags[num_frames:]
+    else:
+      timestamps = None
+      qa_flags = None
+
+    return self._segment(np.argmax(smoothed_probs, axis=1), frame_numbers,
+                         timestamps, qa_flags)
+
+  def update(self, class_probs, frame_numbers, timestamps=None,
+             qa_flags=None):
+    """Receive the probabilities of the next frames.
+
+    Returns:
+      The list of features and the list of events closed by these frames.
+    """
+    self.pending_frame_numbers = np.concatenate(
+      (self.pending_frame_numbers, frame_numbers))
+
+    if timestamps is not None:
+      if self.pending_timestamps is None:
+        self.pending_timestamps = np.asarray(timestamps)
+        self.pending_qa_flags = np.asarray(qa_flags)
+      else:
+        self.pending_timestamps = np.concatenate(
+          (self.pending_timestamps, timestamps))
+        self.pending_qa_flags = np.concatenate(
+          (self.pending_qa_flags, qa_flags))
+
+    if self.smoother is not None:
+      class_probs = self.smoother.update(class_probs)
+
+    return self._segment_smoothed_probs(class_probs)
+
+  def finish(self):
+    """Close the last feature, and any event it belongs to.
+
+    Returns:
+      The list of features and the list of events that remained open.
+    """
+    if self.smoother is not None:
+      features, events = self._segment_smoothed_probs(self.smoother.finish())
+    else:
+      features, events = [], []
+
+    if self.class_id is not None:
+      feature = self._close_feature()
+      features.append(feature)
+      events.extend(self._consume_feature(feature))
+      self.class_id = None
+
+    # an event that is still accumulating when the video ends is closed there
+    if self.target_feature_list is not None:
+      events.extend(self._close_event())
+
+    return features, events
+
+
+class TripStream:
+  def __init__(self, report_file_name, report_dir_path, class_name_map,
+               processor_mode, class_probs, timestamp_object=None,
+               smoothing_factor=0, write_reports=True, chunk_size=1800,
+               keep_rows=False):
+    """Create a new 'TripStream' object.
+
+    Feeds the probabilities of a video to a StreamingTrip as inference
+    completes, and appends closed events (or weather features) to the
+    video's event report as they arrive.
+
+    Args:
+      class_probs: float array. The probability array that the analyzer
+        fills in.
+      timestamp_object: Timestamp. Frames are only fed once their timestamps
+        are settled, if given.
+      chunk_size: int. The minimum number of new frames to feed at a time.
+      keep_rows: bool. Whether the report rows of closed events are also
+        kept in rows, e.g. to be cataloged once the video has been processed.
+    """
+    self.report_file_name = report_file_name
+    self.processor_mode = processor_mode
+    self.class_probs = class_probs
+    self.timestamp_object = timestamp_object
+    self.chunk_size = chunk_size
+    self.rows = [] if keep_rows else None
+
+    if processor_mode == 'weather':
+      target_feature_class_names = list(class_name_map.values())
+      header = IO.weather_report_header
+    else:
+      target_feature_class_names = None
+      header = IO.event_report_header
+
+    self.trip = StreamingTrip(
+      class_name_map, target_feature_class_names, smoothing_factor)
+
+    if write_reports:
+      self.report_writer = ReportWriter(path.join(
+        report_dir_path, 'event_reports', report_file_name + '.csv'), header)
+    else:
+      self.report_writer = None
+
+    self.num_available_frames = 0
+    self.num_fed_frames = 0
+    self.num_features = 0
+    self.num_events = 0
+
+  def _write(self, features, events):
+    self.num_features += len(features)
+    self.num_events += len(events)
+
+    if self.report_writer is None and self.rows is None:
+      return
+
+    if self.processor_mode == 'weather':
+      rows = IO.get_weather_report_rows(self.report_file_name, features)
+    else:
+      rows = IO.get_event_report_rows(self.report_file_name, events)
+
+    if self.report_writer is not None:
+      self.report_writer.write_rows(rows)
+
+    if self.rows is not None:
+      self.rows.extend(rows)
+
+  def _feed(self, is_final):
+    num_frames = self.num_available_frames
+
+    if self.timestamp_object is not None:
+      if not is_final:
+        num_frames = min(num_frames,
+                         self.timestamp_object.num_settled_timestamps)
+
+      if num_frames <= self.num_fed_frames:
+        return
+
+      # the timestamp object keeps what it has finalized, so only the frames
+      # fed now are finalized, with the values the inference report gets
+      timestamps, qa_flags = self.timestamp_object.finalize(
+        num_frames, self.num_fed_frames)
+    else:
+      if num_frames <= self.num_fed_frames:
+        return
+
+      timestamps = None
+      qa_flags = None
+
+    features, events = self.trip.update(
+      self.class_probs[self.num_fed_frames:num_frames],
+      np.arange(self.num_fed_frames + 1, num_frames + 1), timestamps,
+      qa_flags)
+
+    self.num_fed_frames = num_frames
+
+    self._write(features, events)
+
+  def update(self, num_available_frames):
+    """Receive the number of leading frames whose probabilities are known."""
+    self.num_available_frames = num_available_frames
+
+    if self.num_available_frames - self.num_fed_frames >= self.chunk_size:
+      self._feed(False)
+
+  def finish(self):
+    """Feed the remaining frames and close the event report.
+
+    Returns:
+      The number of events found, or of features found in weather mode.
+    """
+    self._feed(True)
+    self._write(*self.trip.finish())
+
+    if self.report_writer is not None:
+      self.report_writer.close()
+
+    if self.processor_mode == 'weather':
+      return self.num_features
+
+    return self.num_events
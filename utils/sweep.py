@@ -0,0 +1,308 @@
+import argparse
+import csv
+import itertools
+import logging
+from multiprocessing import Pool
+import numpy as np
+import os
+from time import time
+from utils.event import EventQuery, EventQueryEngine, Trip, read_trip_report
+from utils.io import IO
+from utils.reanalyze import read_report_file_paths
+
+path = os.path
+
+work_zone_class_names = ['regulatory_sign', 'warning_sign', 'work_zone']
+
+
+def read_ground_truth(ground_truth_file_path):
+  """Read ground-truth event intervals from a CSV file with file_name,
+  start_frame_number and end_frame_number columns, e.g. a reviewed event
+  report.
+
+  Returns:
+    A dict mapping file names (without any video extension) to (n, 2) arrays
+    of inclusive start and end frame numbers.
+  """
+  ground_truth = {}
+
+  with IO.open_report_file(ground_truth_file_path) as ground_truth_file:
+    for row in csv.DictReader(ground_truth_file):
+      file_name, extension = path.splitext(row['file_name'])
+
+      # names such as Trip.001 have no extension to remove
+      if extension[1:].lower() not in IO.video_file_extensions:
+        file_name = row['file_name']
+
+      ground_truth.setdefault(file_name, []).append(
+        (int(row['start_frame_number']), int(row['end_frame_number'])))
+
+  return {file_name: np.array(intervals, dtype=np.int64)
+          for file_name, intervals in ground_truth.items()}
+
+
+def score_intervals(predicted_intervals, true_intervals, iou_threshold=0.5):
+  """Match predicted to true intervals one-to-one, in descending order of
+  intersection over union, and count the outcomes.
+
+  Returns:
+    A tuple of true positive, false positive and false negative counts.
+  """
+  num_predicted = predicted_intervals.shape[0]
+  num_true = true_intervals.shape[0]
+
+  if num_predicted == 0 or num_true == 0:
+    return 0, num_predicted, num_true
+
+  # frame intervals are inclusive at both ends
+  intersections = np.minimum(predicted_intervals[:, 1:], true_intervals[:, 1]) \
+                  - np.maximum(predicted_intervals[:, :1], true_intervals[:, 0]) \
+                  + 1
+  intersections = np.maximum(intersections, 0)
+
+  predicted_lengths = predicted_intervals[:, 1] - predicted_intervals[:, 0] + 1
+  true_lengths = true_intervals[:, 1] - true_intervals[:, 0] + 1
+
+  ious = intersections / (predicted_lengths[:, np.newaxis] + true_lengths
+                          - intersections)
+
+  candidate_pairs = np.argwhere(ious >= iou_threshold)
+  candidate_pairs = candidate_pairs[np.argsort(
+    -ious[candidate_pairs[:, 0], candidate_pairs[:, 1]], kind='stable')]
+
+  matched_predictions = set()
+  matched_truths = set()
+
+  for predicted_index, true_index in candidate_pairs.tolist():
+    if predicted_index not in matched_predictions \
+        and true_index not in matched_truths:
+      matched_predictions.add(predicted_index)
+      matched_truths.add(true_index)
+
+  num_true_positives = len(matched_predictions)
+
+  return num_true_positives, num_predicted - num_true_positives, \
+         num_true - num_true_positives
+
+
+def _sweep_report(args):
+  report_file_path, class_name_map, smoothing_factors, weight_scales, \
+    minimum_event_lengths, true_intervals, iou_threshold = args
+
+  try:
+    frame_numbers, timestamps, qa_flags, probs = read_trip_report(
+      report_file_path, class_name_map)
+
+    # every (weight scale, minimum length) pair is evaluated in the same scan
+    # of a trip's features, so each factor is smoothed and segmented only once
+    engine = EventQueryEngine(
+      [EventQuery((weight_scale, minimum_event_length), work_zone_class_names,
+                  non_event_weight_scale=weight_scale,
+                  minimum_event_length=minimum_event_length)
+       for weight_scale, minimum_event_length in itertools.product(
+        weight_scales, minimum_event_lengths)])
+
+    results = {}
+
+    for smoothing_factor in smoothing_factors:
+      if smoothing_factor > 1:
+        smoothed_probs = IO.smooth_probs(probs, smoothing_factor)
+      else:
+        smoothed_probs = probs
+
+      trip = Trip(frame_numbers, timestamps, qa_flags, smoothed_probs,
+                  class_name_map)
+
+      for (weight_scale, minimum_event_length), events in \
+          engine.run(trip).items():
+        predicted_intervals = np.array(
+          [(event.start_frame_number, event.end_frame_number)
+           for event in events], dtype=np.int64).reshape(-1, 2)
+
+        if true_intervals is None:
+          scores = ()
+        else:
+          scores = score_intervals(
+            predicted_intervals, true_intervals, iou_threshold)
+
+        results[(smoothing_factor, weight_scale, minimum_event_length)] = \
+          (len(events),) + scores
+
+    IO.clear_smoothed_probs_cache()
+
+    return report_file_path, results, None
+  except Exception as e:
+    IO.clear_smoothed_probs_cache()
+
+    return report_file_path, None, str(e)
+
+
+def sweep(report_file_paths, class_names_file_path, smoothing_factors,
+          weight_scales, minimum_event_lengths, ground_truth_file_path=None,
+          iou_threshold=0.5, num_processes=None, chunk_size=4):
+  """Evaluate every combination of event detection parameters on each report.
+
+  Returns:
+    A list of result rows, one per parameter combination, and the number of
+    reports that could not be evaluated. Rows are ordered by descending F1
+    score if ground truth is given.
+  """
+  class_name_map = IO.read_class_names(class_names_file_path)
+
+  if ground_truth_file_path is None:
+    ground_truth = None
+  else:
+    ground_truth = read_ground_truth(ground_truth_file_path)
+
+  def get_true_intervals(report_file_path):
+    if ground_truth is None:
+      return None
+
+    report_file_name = IO.strip_report_extension(
+      path.basename(report_file_path))
+
+    return ground_truth.get(report_file_name, np.zeros((0, 2), dtype=np.int64))
+
+  combinations = list(itertools.product(
+    smoothing_factors, weight_scales, minimum_event_lengths))
+
+  totals = {combination: np.zeros(1 if ground_truth is None else 4,
+                                  dtype=np.int64)
+            for combination in combinations}
+  num_failures = 0
+
+  with Pool(processes=num_processes) as pool:
+    for report_file_path, results, error in pool.imap_unordered(
+        _sweep_report,
+        [(report_file_path, class_name_map, smoothing_factors, weight_scales,
+          minimum_event_lengths, get_true_intervals(report_file_path),
+          iou_threshold)
+         for report_file_path in report_file_paths],
+        chunksize=chunk_size):
+      if error is None:
+        for combination, counts in results.items():
+          totals[combination] += counts
+      else:
+        num_failures += 1
+        logging.error('failed to sweep {}: {}'.format(report_file_path, error))
+
+  rows = []
+
+  for combination in combinations:
+    row = list(combination) + totals[combination].tolist()
+
+    if ground_truth is not None:
+      _, num_true_positives, num_false_positives, num_false_negatives = \
+        totals[combination].tolist()
+
+      num_predicted = num_true_positives + num_false_positives
+      num_true = num_true_positives + num_false_negatives
+
+      precision = num_true_positives / num_predicted if num_predicted else 0.
+      recall = num_true_positives / num_true if num_true else 0.
+      f1 = 2 * precision * recall / (precision + recall) \
+        if precision + recall else 0.
+
+      row.extend([precision, recall, f1])
+
+    rows.append(row)
+
+  if ground_truth is not None:
+    rows.sort(key=lambda row: row[-1], reverse=True)
+
+  return rows, num_failures
+
+
+def write_sweep_report(sweep_file_path, rows, scored):
+  header = ['smoothing_factor', 'non_event_weight_scale',
+            'minimum_event_length', 'num_events']
+
+  if scored:
+    header.extend(['true_positives', 'false_positives', 'false_negatives',
+                   'precision', 'recall', 'f1'])
+    rows = [row[:7] + ['{:.4f}'.format(value) for value in row[7:]]
+            for row in rows]
+
+  sweep_dir_path = path.dirname(path.abspath(sweep_file_path))
+
+  if not path.exists(sweep_dir_path):
+    os.makedirs(sweep_dir_path)
+
+  IO.write_csv(sweep_file_path, header, rows)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Evaluate a grid of SNVA work zone event detection parameters '
+                'over existing inference reports')
+
+  parser.add_argument('--inputpath', '-ip', required=True,
+                      help='Path to a folder of inference reports (searched '
+                           'recursively), or a text file that lists inference '
+                           'report file paths.')
+  parser.add_argument('--classnamesfilepath', '-cnfp', required=True,
+                      help='Path to the class ids/names text file that the '
+                           'inference reports were generated with.')
+  parser.add_argument('--outputpath', '-op',
+                      default='./reports/sweep_results.csv',
+                      help='Path to the CSV file in which results are '
+                           'written.')
+  parser.add_argument('--smoothingfactors', '-sf', type=int, nargs='+',
+                      default=[0, 16, 32, 64],
+                      help='Smoothing factors to evaluate. 0 disables '
+                           'smoothing.')
+  parser.add_argument('--noneventweightscales', '-news', type=float,
+                      nargs='+', default=[0.01, 0.05, 0.1],
+                      help='Non-event weight scales to evaluate.')
+  parser.add_argument('--minimumeventlengths', '-mel', type=int, nargs='+',
+                      default=[50, 100, 200],
+                      help='Minimum event lengths, in frames, to evaluate.')
+  parser.add_argument('--groundtruthpath', '-gtp', default=None,
+                      help='Path to a CSV file of true events with file_name, '
+                           'start_frame_number and end_frame_number columns. '
+                           'Combinations are scored if given.')
+  parser.add_argument('--iouthreshold', '-iou', type=float, default=0.5,
+                      help='The minimum intersection over union at which a '
+                           'detected event matches a true event.')
+  parser.add_argument('--numprocesses', '-np', type=int,
+                      default=os.cpu_count(),
+                      help='Number of reports to evaluate at one time')
+  parser.add_argument('--chunksize', '-cs', type=int, default=4,
+                      help='Number of reports dispatched to a process at once')
+  parser.add_argument('--loglevel', '-ll', default='info',
+                      help='Defaults to \'info\'. Pass \'debug\' or \'error\' '
+                           'for verbose or minimal logging, respectively.')
+
+  args = parser.parse_args()
+
+  if args.loglevel == 'error':
+    log_level = logging.ERROR
+  elif args.loglevel == 'debug':
+    log_level = logging.DEBUG
+  else:
+    log_level = logging.INFO
+
+  logging.basicConfig(level=log_level)
+
+  start = time()
+
+  report_file_paths = read_report_file_paths(args.inputpath)
+
+  rows, num_failed = sweep(
+    report_file_paths, args.classnamesfilepath, args.smoothingfactors,
+    args.noneventweightscales, args.minimumeventlengths, args.groundtruthpath,
+    args.iouthreshold, args.numprocesses, args.chunksize)
+
+  write_sweep_report(args.outputpath, rows, args.groundtruthpath is not None)
+
+  logging.info(IO.get_processing_duration(
+    time() - start, 'evaluated {} parameter combinations on {} reports ({} '
+                    'failures) in'.format(len(rows), len(report_file_paths),
+                                          num_failed)))
+
+  if args.groundtruthpath is not None and len(rows) > 0:
+    logging.info('best combination: smoothing_factor={}, non_event_weight_'
+                 'scale={}, minimum_event_length={} (f1={:.4f})'.format(
+                  rows[0][0], rows[0][1], rows[0][2], rows[0][-1]))
+
+  logging.info('wrote sweep results to {}'.format(args.outputpath))
@@ -165,283 +165,662 @@ class Timestamp:
       [0, 0, 0,   0,   0, 255, 255, 255, 255,   0,   0,   0,   0,   0, 0, 0],
       [0, 0, 0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0,   0, 0, 0]]])
 
-  def __init__(self, timestamp_height, timestamp_maxwidth):
+  # values of the per-frame quality assurance flag
+  QA_READ = 0
+  QA_SYNTHESIZED = 1
+  QA_UNREADABLE = 2
+  QA_PTS_RECONSTRUCTED = 3
+  QA_PTS_DISAGREEMENT = 4
+
+  # the number of milliseconds by which a timestamp read at an anchor frame may
+  # differ from the one predicted by PTS from the previous anchor. 66/67 ms
+  # steps and 66.67 ms PTS steps never drift more than this apart.
+  pts_tolerance = 2
+
+  # the number of set bits in each possible byte of a packed digit cell
+  popcount_table = np.array([bin(i).count('1') for i in range(256)],
+                            dtype=np.uint8)
+
+  def __init__(self, timestamp_height, timestamp_maxwidth, digit_tolerance=0):
+    """Create a new 'Timestamp' object.
+
+    Args:
+      timestamp_height: int. The height of the timestamp overlay, which is
+        also the width of one digit cell.
+      timestamp_maxwidth: int. The width of the timestamp overlay.
+      digit_tolerance: int. The number of pixels in which a digit cell may
+        differ from the nearest digit mask and still be recognized as that
+        digit. Cells are only recognized on exact match if 0.
+    """
     self.height = timestamp_height
     self.maxwidth = timestamp_maxwidth
     self.num_digits = int(self.maxwidth / self.height)
-    self.digit_mask_array = np.tile(
-      Timestamp.digit_mask_array, [self.num_digits])  # (10, 16, 16 * nd)
-    self.digit_mask_array = np.transpose(
-      self.digit_mask_array, (0, 2, 1))  # (10, 16 * nd, 16)
-    self.digit_mask_array = np.reshape(
-      self.digit_mask_array,
-      (-1, self.num_digits, self.height, self.height))  # (10, nd, 16, 16)
-
-  def _binarize_timestamps(self, timestamp_array):
-    timestamp_array = np.average(timestamp_array, axis=2)
-    timestamp_array = np.where(timestamp_array >= 128, [255], [0])
-
-    return timestamp_array
-
-  # alternative per-frame implementation in case the per-video method fails,
-  # e.g. due to unreadable digit in between readable digits
-  def _stringify_timestamps_per_frame(
-      self, timestamp_image_array, num_timestamps):
-    # (16 * nt, 16 * nd)
-    timestamp_image_array = self._binarize_timestamps(timestamp_image_array)
-    # (16 * nd, 16 * nt)
-    timestamp_image_array = np.transpose(timestamp_image_array)
-
+    self.digit_tolerance = digit_tolerance
+
+    # each binarized 16x16 digit cell is bit-packed into a 32-byte key so that
+    # cells can be matched against the ten digit masks by exact lookup
+    # (10, 32)
+    self.digit_mask_keys = self._pack_digit_cells(
+      Timestamp.digit_mask_array > 0)
+    self.digit_lookup_table = {
+      digit_mask_key.tobytes(): digit
+      for digit, digit_mask_key in enumerate(self.digit_mask_keys)}
+
+    # cells that do not match exactly are compared against every digit mask
+    # and against a blank cell, so that noise in the space that follows the
+    # last digit is not mistaken for a digit
+    # (11, 32)
+    self.reference_keys = np.concatenate(
+      (self.digit_mask_keys, np.zeros_like(self.digit_mask_keys[:1])))
+
+    reference_distances = self._get_hamming_distances(self.reference_keys)
+    np.fill_diagonal(reference_distances, np.iinfo(np.int64).max)
+
+    if 2 * self.digit_tolerance >= np.min(reference_distances):
+      logging.warning(
+        'a digit tolerance of {} pixels may confuse digit masks that differ '
+        'by as few as {} pixels'.format(
+          self.digit_tolerance, np.min(reference_distances)))
+
+    # (nd,)
+    self.place_value_array = 10 ** np.arange(self.num_digits, dtype=np.int64)
+
+    self.begin(0)
+
+  # (nb, 16, 16 * nd, nc)
+  def _binarize_timestamps(self, timestamp_image_batch):
+    # equivalent to thresholding the channel average at 128, without the
+    # floating point temporary. Channels are summed one at a time because
+    # numpy reduces a short trailing axis very slowly
+    num_channels = timestamp_image_batch.shape[-1]
+    timestamp_sum_batch = timestamp_image_batch[..., 0].astype(np.uint16)
+
+    for i in range(1, num_channels):
+      timestamp_sum_batch += timestamp_image_batch[..., i]
+
+    return timestamp_sum_batch >= 128 * num_channels
+
+  # (nb, 16, 16 * nd, nc)
+  def _split_digit_cells(self, timestamp_image_batch):
+    num_timestamps = timestamp_image_batch.shape[0]
+    # (nb, 16, 16 * nd)
+    timestamp_image_batch = self._binarize_timestamps(
+      timestamp_image_batch[:, :, :self.num_digits * self.height])
+    # (nb, 16, nd, 16)
+    timestamp_image_batch = np.reshape(
+      timestamp_image_batch,
+      (num_timestamps, self.height, self.num_digits, self.height))
+    # (nb, nd, 16, 16)
+    return np.transpose(timestamp_image_batch, (0, 2, 1, 3))
+
+  # (..., 16, 16)
+  def _pack_digit_cells(self, digit_cells):
+    # (..., 32)
+    return np.packbits(
+      np.reshape(digit_cells, digit_cells.shape[:-2] + (-1,)), axis=-1)
+
+  # (n, 32)
+  def _get_hamming_distances(self, digit_keys):
+    # (n, 11)
+    return np.sum(Timestamp.popcount_table[np.bitwise_xor(
+      np.expand_dims(digit_keys, 1), self.reference_keys)], axis=-1,
+      dtype=np.int64)
+
+  # (n, 32)
+  def _recognize_digit_keys(self, digit_keys):
+    # only a handful of distinct cells (ten digits, blank space and the odd
+    # corrupted cell) occur in practice, so the lookup table is consulted once
+    # per distinct cell rather than once per cell
+    num_key_bytes = digit_keys.shape[-1]
+    digit_keys = np.ascontiguousarray(digit_keys).view(
+      'V{}'.format(num_key_bytes))[:, 0]
+    unique_digit_keys, unique_key_indices = np.unique(
+      digit_keys, return_inverse=True)
+    unique_digits = np.array(
+      [self.digit_lookup_table.get(unique_digit_key.tobytes(), -1)
+       for unique_digit_key in unique_digit_keys], dtype=np.int8)
+    unique_distances = np.zeros(unique_digits.shape, dtype=np.uint8)
+
+    unmatched = np.flatnonzero(unique_digits < 0)
+
+    if self.digit_tolerance > 0 and unmatched.shape[0] > 0:
+      # (k, 11)
+      distances = self._get_hamming_distances(np.reshape(
+        unique_digit_keys[unmatched].view(np.uint8), (-1, num_key_bytes)))
+      # (k, 2)
+      nearest_distances = np.partition(distances, 1, axis=1)[:, :2]
+      nearest_references = np.argmin(distances, axis=1)
+
+      # a cell equidistant from two references is ambiguous
+      recognized = np.logical_and.reduce((
+        nearest_distances[:, 0] <= self.digit_tolerance,
+        nearest_distances[:, 0] < nearest_distances[:, 1],
+        nearest_references < Timestamp.digit_mask_array.shape[0]))
+
+      unique_digits[unmatched[recognized]] = nearest_references[recognized]
+      unique_distances[unmatched[recognized]] = \
+        nearest_distances[recognized, 0]
+
+    unique_key_indices = np.reshape(unique_key_indices, (-1,))
+
+    # (n,), (n,)
+    return unique_digits[unique_key_indices], \
+           unique_distances[unique_key_indices]
+
+  # (nb, 16, 16 * nd, nc)
+  def recognize_digits(self, timestamp_image_batch, return_distances=False):
+    """Map each digit cell of each timestamp crop to the digit it depicts.
+
+    Args:
+      timestamp_image_batch: uint8 array of shape (nb, 16, 16 * nd, nc).
+      return_distances: bool. Whether to also return the number of pixels in
+        which each recognized cell differs from its digit mask.
+
+    Returns:
+      An int8 array of shape (nb, nd) holding the digit in each position of
+      each crop, or -1 where no digit could be recognized, and if requested a
+      uint8 array of the same shape holding the distance of each cell, or 0
+      where no digit was recognized.
+    """
+    num_timestamps = timestamp_image_batch.shape[0]
+    # (nb * nd, 32)
+    digit_keys = np.reshape(
+      self._pack_digit_cells(self._split_digit_cells(timestamp_image_batch)),
+      (num_timestamps * self.num_digits, -1))
+
+    digit_array, distance_array = self._recognize_digit_keys(digit_keys)
+
+    # (nb, nd)
+    digit_array = np.reshape(digit_array, (num_timestamps, self.num_digits))
+
+    if not return_distances:
+      return digit_array
+
+    return digit_array, np.reshape(
+      distance_array, (num_timestamps, self.num_digits))
+
+  def begin(self, num_timestamps, presentation_timestamps=None,
+            anchor_interval=0):
+    """Prepare to receive timestamp image crops for a new video.
+
+    Only the integer value read from each crop and the number of digits that
+    could be read are retained, so memory use is independent of crop size.
+
+    If presentation timestamps are given, only the crops of anchor frames are
+    read (see select_anchor_frames), and the timestamps of all other frames
+    are reconstructed from their PTS offset to the nearest readable anchor.
+
+    Args:
+      num_timestamps: int. The expected number of frames. Storage grows if
+        more crops than expected are received.
+      presentation_timestamps: float array. The PTS of each frame in
+        milliseconds, in display order, or None to read every crop.
+      anchor_interval: int. The number of frames between regularly spaced
+        anchors. Crops are read for every frame if 0.
+    """
     # 32-bit ints/uints should be fine given no trip exceeds 24 days in length
-    timestamp_string_array = np.ndarray((num_timestamps,), dtype=np.uint32)
-    quality_assurance_array = np.zeros((num_timestamps,), dtype=np.uint8)
-
-    current_timestamp_length = 0
-
-    current_range_left_index = None
-    previous_timestamp_was_missing = False
-    total_true_num_unreadable_timestamps = 0
-    total_observed_num_unreadable_timestamps = 0
-    total_num_unreadable_sequences = 0
-
-    for i in range(num_timestamps):
-      try:
-        timestamp_image = timestamp_image_array[
-                          :, self.height * i:self.height * (i + 1)]
-        # (nd, 16, 16)
-        timestamp_image = np.reshape(
-          timestamp_image, (self.num_digits, self.height, self.height))
-        # (10, nd, 16, 16)
-        _equal = np.equal(timestamp_image, self.digit_mask_array)
-        # (10, nd)
-        _all = np.all(_equal, axis=(2, 3))
-        # ((10,), (nd,))
-        digits, positions = np.nonzero(_all)
-
-        digits_len = len(digits)
-
-        if digits_len > 0:
-          if digits_len >= current_timestamp_length:
-            current_timestamp_length = digits_len
-
-            sorted_positions = np.argsort(positions)
-            digits = digits[sorted_positions]
-            digits = digits.astype(np.unicode_)
-
-            timestamp_string_array[i] = ''.join(digits)
-
-            if previous_timestamp_was_missing:
-              previous_timestamp_was_missing = False
-
-              # we don't subtract 1 from current_range_left_index because frame
-              # numbers are indexed starting at 1, not 0
-              earlier_readable_timestamp = timestamp_string_array[
-                current_range_left_index]
-
-              later_readable_timestamp = timestamp_string_array[i]
-
-              observed_num_unreadable_timestamps = i - current_range_left_index
-
-              milliseconds_between_readable_timestamps = \
-                later_readable_timestamp - earlier_readable_timestamp
-
-              mod_67_remainder = milliseconds_between_readable_timestamps % 67
-
-              div_67_whole = int(
-                milliseconds_between_readable_timestamps / 67)
-
-              if mod_67_remainder == 0:
-                num_66_occurrences = 0
-                num_67_occurrences = div_67_whole
-              else:
-                num_66_occurrences = 66 - mod_67_remainder
-
-                num_67_occurrences = div_67_whole - num_66_occurrences
-
-                num_66_occurrences += 1
-
-              true_num_unreadable_timestamps = \
-                num_66_occurrences + num_67_occurrences
-
-              total_true_num_unreadable_timestamps += true_num_unreadable_timestamps
-              total_observed_num_unreadable_timestamps += observed_num_unreadable_timestamps
-
-              # if no frames are inferred to be missing
-              if observed_num_unreadable_timestamps == true_num_unreadable_timestamps:
-                timesteps = [66 for _ in range(num_66_occurrences)]
-                timesteps.extend([67 for _ in range(num_67_occurrences)])
-
-                timesteps = np.array(timesteps)
-
-                np.random.shuffle(timesteps)
-
-                cumulative_timesteps = 0
-
-                for j in range(observed_num_unreadable_timestamps - 1):
-                  cumulative_timesteps += timesteps[j]
-                  timestamp_string_array[current_range_left_index + 1 + j] = \
-                    earlier_readable_timestamp + cumulative_timesteps
-                  quality_assurance_array[current_range_left_index + 1 + j] = 1
-              else:  # if at least one frame is inferred to be missing
-                for j in range(observed_num_unreadable_timestamps - 1):
-                  timestamp_string_array[current_range_left_index + 1 + j] = 0
-                total_num_unreadable_sequences += 1
-          else:
-            timestamp_string_array[i] = 0
-
-            if not previous_timestamp_was_missing:
-              previous_timestamp_was_missing = True
-
-              if i > 0:
-                current_range_left_index = i - 1
-              else:
-                logging.error('Unable to synthesize replacements for sequence '
-                              'of unreadable timestamps starting with frame 0')
-        else:
-          timestamp_string_array[i] = 0
-
-          if not previous_timestamp_was_missing:
-            previous_timestamp_was_missing = True
-
-            if i > 0:
-              current_range_left_index = i - 1
-              logging.error('setting current_range_left_index to {}'.format(i))
-            else:
-              logging.error('Unable to synthesize replacements for sequence of '
-                            'unreadable timestamps starting with frame 0')
-      except Exception as e:
-        logging.debug('the {}th timestamp could not be interpreted or '
-                      'synthesized'.format(i))
-        logging.error(e)
+    self.timestamp_array = np.zeros((num_timestamps,), dtype=np.uint32)
+    self.digit_count_array = np.zeros((num_timestamps,), dtype=np.uint8)
+    self.match_distance_array = np.zeros((num_timestamps,), dtype=np.uint8)
+    self.num_timestamps = 0
+
+    # the timestamps and QA flags of frames up to and including the last
+    # readable frame that finalize() has seen, which are kept rather than
+    # finalized again, so every caller sees the same synthesized steps
+    self.finalized_timestamp_array = np.zeros((num_timestamps,), dtype=np.int32)
+    self.quality_assurance_array = np.zeros((num_timestamps,), dtype=np.uint8)
+    self.num_finalized_timestamps = 0
+
+    # frames up to and including the last readable frame keep the timestamps
+    # that finalize() gives them, no matter which frames follow
+    self.num_settled_timestamps = 0
+    self.max_digit_count = 0
+
+    if presentation_timestamps is not None and anchor_interval > 0 \
+        and len(presentation_timestamps) > 0:
+      self.presentation_timestamp_array = np.asarray(
+        presentation_timestamps, dtype=np.float64)
+      self.anchor_array = Timestamp.select_anchor_frames(
+        self.presentation_timestamp_array, anchor_interval)
+    else:
+      self.presentation_timestamp_array = None
+      self.anchor_array = None
+
+  @staticmethod
+  def select_anchor_frames(presentation_timestamps, anchor_interval):
+    """Choose the frames whose timestamp crops will be read.
+
+    Every anchor_interval-th frame and the last frame are anchors, as are both
+    frames on either side of a break in PTS cadence (a step that differs from
+    the typical step by more than half a frame), since frames may have been
+    dropped or duplicated there.
+
+    Returns:
+      A bool array with one element per presentation timestamp.
+    """
+    num_frames = presentation_timestamps.shape[0]
+
+    anchor_array = np.zeros((num_frames,), dtype=np.bool_)
+    anchor_array[::anchor_interval] = True
+    anchor_array[-1] = True
+
+    if num_frames > 1:
+      pts_steps = np.diff(presentation_timestamps)
+      nominal_pts_step = np.median(pts_steps)
+      cadence_breaks = np.abs(pts_steps - nominal_pts_step) > \
+                       nominal_pts_step / 2
+      anchor_array[:-1] |= cadence_breaks
+      anchor_array[1:] |= cadence_breaks
+
+    return anchor_array
+
+  def _reserve(self, num_timestamps):
+    capacity = self.timestamp_array.shape[0]
+
+    if num_timestamps > capacity:
+      padding_len = max(num_timestamps - capacity, capacity)
+      self.timestamp_array = np.concatenate(
+        (self.timestamp_array, np.zeros((padding_len,), dtype=np.uint32)))
+      self.digit_count_array = np.concatenate(
+        (self.digit_count_array, np.zeros((padding_len,), dtype=np.uint8)))
+      self.match_distance_array = np.concatenate(
+        (self.match_distance_array, np.zeros((padding_len,), dtype=np.uint8)))
+      self.finalized_timestamp_array = np.concatenate(
+        (self.finalized_timestamp_array,
+         np.zeros((padding_len,), dtype=np.int32)))
+      self.quality_assurance_array = np.concatenate(
+        (self.quality_assurance_array,
+         np.zeros((padding_len,), dtype=np.uint8)))
+
+  def update(self, timestamp_image_batch):
+    """Read the timestamps in a batch of crops and append them to the video.
+
+    Args:
+      timestamp_image_batch: uint8 array of shape (nb, 16, 16 * nd, nc)
+        holding the timestamp crops of nb consecutive frames.
+    """
+    num_timestamps = timestamp_image_batch.shape[0]
+
+    l_idx = self.num_timestamps
+    r_idx = l_idx + num_timestamps
+
+    self._reserve(r_idx)
+
+    if self.anchor_array is None:
+      # (nb, nd), (nb, nd)
+      digit_array, distance_array = self.recognize_digits(
+        timestamp_image_batch, return_distances=True)
+    else:
+      # frames beyond the last known PTS cannot be reconstructed, so their
+      # crops are always read
+      anchor_batch = np.ones((num_timestamps,), dtype=np.bool_)
+      num_known_anchors = max(
+        min(r_idx, self.anchor_array.shape[0]) - l_idx, 0)
+      anchor_batch[:num_known_anchors] = \
+        self.anchor_array[l_idx:l_idx + num_known_anchors]
+
+      # non-anchor frames are left with no recognized digits
+      digit_array = np.full(
+        (num_timestamps, self.num_digits), -1, dtype=np.int8)
+      distance_array = np.zeros(
+        (num_timestamps, self.num_digits), dtype=np.uint8)
+
+      if np.any(anchor_batch):
+        digit_array[anchor_batch], distance_array[anchor_batch] = \
+          self.recognize_digits(timestamp_image_batch[anchor_batch],
+                                return_distances=True)
+
+    # unrecognized cells are skipped, so the place value of each recognized
+    # digit is determined by the number of recognized digits to its right
+    recognized_array = digit_array >= 0
+    # (nb,)
+    digit_counts = np.sum(recognized_array, axis=1)
+    # (nb, nd)
+    place_values = self.place_value_array[np.maximum(
+      np.expand_dims(digit_counts, 1) - np.cumsum(recognized_array, axis=1),
+      0)]
+
+    self.timestamp_array[l_idx:r_idx] = np.sum(
+      np.where(recognized_array, digit_array * place_values, 0), axis=1)
+    self.digit_count_array[l_idx:r_idx] = digit_counts
+    self.match_distance_array[l_idx:r_idx] = np.max(distance_array, axis=1)
+
+    max_digit_counts = np.maximum.accumulate(
+      np.maximum(digit_counts, self.max_digit_count))
+    readable_indices = np.flatnonzero(np.logical_and(
+      digit_counts > 0, digit_counts >= max_digit_counts))
+
+    if readable_indices.shape[0] > 0:
+      self.num_settled_timestamps = l_idx + readable_indices[-1] + 1
+
+    if num_timestamps > 0:
+      self.max_digit_count = max_digit_counts[-1]
+
+    self.num_timestamps = r_idx
+
+  # reconstruct the timestamps of unreadable frames that lie between two
+  # readable frames by distributing the elapsed time into 66/67 ms steps
+  def _synthesize_timestamps(
+      self, timestamp_array, readable_array, quality_assurance_array):
+    # every run of unreadable frames is bounded by a pair of readable anchors.
+    # when the whole number of 66 and 67 ms steps that span the anchors equals
+    # the number of frames between them, no frames were dropped and the run
+    # can be filled with those steps in a random order
+    anchor_indices = np.flatnonzero(readable_array)
+
+    if not readable_array[0]:
+      logging.error('Unable to synthesize replacements for sequence of '
+                    'unreadable timestamps starting with frame 0')
+
+    if anchor_indices.shape[0] < 2:
+      return
+
+    left_indices = anchor_indices[:-1]
+    observed_num_steps = np.diff(anchor_indices)
+
+    gaps = observed_num_steps > 1
+
+    left_indices = left_indices[gaps]
+    observed_num_steps = observed_num_steps[gaps]
+
+    earlier_readable_timestamps = timestamp_array[left_indices].astype(np.int64)
+    later_readable_timestamps = timestamp_array[
+      left_indices + observed_num_steps].astype(np.int64)
+
+    milliseconds_between_readable_timestamps = \
+      later_readable_timestamps - earlier_readable_timestamps
+
+    mod_67_remainders = np.mod(milliseconds_between_readable_timestamps, 67)
+    div_67_wholes = np.trunc(
+      milliseconds_between_readable_timestamps / 67).astype(np.int64)
+
+    num_66_occurrences = np.where(
+      mod_67_remainders == 0, 0, 67 - mod_67_remainders)
+    num_67_occurrences = np.where(
+      mod_67_remainders == 0, div_67_wholes,
+      div_67_wholes - (66 - mod_67_remainders))
+
+    true_num_steps = num_66_occurrences + num_67_occurrences
+
+    # if at least one frame is inferred to be missing
+    mismatches = np.logical_or(true_num_steps != observed_num_steps,
+                               num_67_occurrences < 0)
 
     logging.debug(
       '{} frames predicted to be missing across {} instances of observed signal'
-      ' loss'.format(total_true_num_unreadable_timestamps -
-                     total_observed_num_unreadable_timestamps,
-                     total_num_unreadable_sequences))
+      ' loss'.format(np.sum(true_num_steps - observed_num_steps),
+                     np.count_nonzero(mismatches)))
 
-    # handle case where last timestamp is missing
-    timestamp_errors = timestamp_string_array == 0
+    matches = np.logical_not(mismatches)
 
-    if len(timestamp_errors) > 0:
-      logging.warning(
-        '{} timestamps could not be read nor synthesized and will'
-        ' be placeheld using the QA value -1.'.format(len(timestamp_errors)))
-
-    timestamp_string_array = timestamp_string_array.astype(np.unicode_)
-    timestamp_string_array[timestamp_errors] = '-1'  # for quality control
-    quality_assurance_array[timestamp_errors] = 2
+    left_indices = left_indices[matches]
+    observed_num_steps = observed_num_steps[matches]
+    earlier_readable_timestamps = earlier_readable_timestamps[matches]
+    num_66_occurrences = num_66_occurrences[matches]
 
-    quality_assurance_array = quality_assurance_array.astype(np.unicode_)
+    num_gaps = left_indices.shape[0]
 
-    return timestamp_string_array, quality_assurance_array
+    if num_gaps == 0:
+      return
 
-  # (16 * nt, 16 * nd, nc)
-  def _stringify_timestamps(self, timestamp_image_array, num_timestamps):
-    # (16 * nt, 16 * nd)
-    timestamp_image_array = self._binarize_timestamps(timestamp_image_array)
-    # (nt, 16, 16 * nd)
-    timestamp_image_array = np.reshape(
-      timestamp_image_array, (num_timestamps, self.height, self.maxwidth))
-    # (nt, 16 * nd, 16)
-    timestamp_image_array = np.transpose(
-      timestamp_image_array, (0, 2, 1))
-    # (nt, nd, 16, 16)
-    timestamp_image_array = np.reshape(
-      timestamp_image_array,
-      (num_timestamps, self.num_digits, self.height, self.height))
-    # (nt, 1, nd, 16, 16)
-    timestamp_image_array = np.expand_dims(timestamp_image_array, 1)
-    # (nt, 10, nd, 16, 16)
-    _equal = np.equal(timestamp_image_array, self.digit_mask_array)
-    # (nt, 10, nd)
-    _all = np.all(_equal, axis=(3, 4))
-    # ((nt,), (nd,), (nd,))
-    frame_numbers, digits, positions = np.nonzero(_all)
+    # lay the steps of every gap end to end, one gap after another
+    gap_ids = np.repeat(np.arange(num_gaps), observed_num_steps)
+    gap_offsets = np.cumsum(observed_num_steps) - observed_num_steps
+    step_positions = np.arange(gap_ids.shape[0]) - gap_offsets[gap_ids]
 
-    unique_frame_numbers, counts = np.unique(frame_numbers, return_counts=True)
+    # shuffle positions within each gap by sorting on gap id plus a random
+    # fraction, then make the first num_66 shuffled positions 66 ms steps
+    shuffled_ranks = np.empty_like(step_positions)
+    shuffled_ranks[np.argsort(gap_ids + np.random.random(gap_ids.shape[0]),
+                              kind='stable')] = step_positions
 
-    unique_counts, unique_count_indices, unique_count_counts = np.unique(
-      counts, return_index=True, return_counts=True)
+    timesteps = np.where(shuffled_ranks < num_66_occurrences[gap_ids], 66, 67)
 
-    if np.sum(unique_count_counts) != num_timestamps:
-      raise ValueError(
-        'The cumulative sum of frames having a common number of digits should '
-        'be equal to the total number of frames regardless of digit length')
+    cumulative_timesteps = np.cumsum(timesteps)
+    cumulative_timesteps -= np.concatenate(
+      ([0], cumulative_timesteps))[gap_offsets][gap_ids]
 
-    # the unique count indices should be monotonically increasing
-    for i in range(1, len(unique_count_indices)):
-      if unique_count_indices[i] < unique_count_indices[i - 1]:
-        raise ValueError(
-          'Timestamp string lengths should be monotonically non-decreasing, but'
-          ' a timestamp of length {} at array index {} follows a timestamp of '
-          'length {} at array index {}'.format(
-            unique_counts[i - 1], unique_count_indices[i - 1],
-            unique_counts[i], unique_count_indices[i]))
+    # the last step of each gap lands on its right anchor, which was read
+    filled = step_positions < observed_num_steps[gap_ids] - 1
 
-    digits = digits.astype(np.unicode_)
+    filled_indices = left_indices[gap_ids[filled]] + 1 + step_positions[filled]
 
-    timestamp_string_array = np.ndarray((num_timestamps,), dtype=np.uint32)
+    timestamp_array[filled_indices] = earlier_readable_timestamps[
+      gap_ids[filled]] + cumulative_timesteps[filled]
+    quality_assurance_array[filled_indices] = Timestamp.QA_SYNTHESIZED
 
-    r_idx = 0
+  def _finalize_read_timestamps(self, timestamp_array, readable_array):
+    num_timestamps = timestamp_array.shape[0]
 
-    for i in range(unique_counts.shape[0]):
-      unique_count = unique_counts[i]
+    quality_assurance_array = np.full(
+      (num_timestamps,), Timestamp.QA_READ, dtype=np.uint8)
 
-      unique_count_count = unique_count_counts[i]
+    if np.all(readable_array):
+      return timestamp_array.astype(np.int32), quality_assurance_array
 
-      num_count_len_digits = unique_count * unique_count_count
+    logging.warning('{} timestamps could not be read and will be synthesized '
+                    'from their readable neighbors where possible'.format(
+      num_timestamps - np.count_nonzero(readable_array)))
 
-      l_idx = r_idx
-      r_idx = l_idx + num_count_len_digits
+    timestamp_array = np.where(readable_array, timestamp_array, 0).astype(
+      np.uint32)
 
-      count_len_positions = positions[l_idx:r_idx]
-      count_len_positions = np.reshape(
-        count_len_positions, (unique_count_count, unique_count))
-      count_len_positions = np.argsort(count_len_positions)
+    self._synthesize_timestamps(
+      timestamp_array, readable_array, quality_assurance_array)
 
-      offsets = np.arange(0, num_count_len_digits, unique_count)
-      offsets = np.expand_dims(offsets, axis=1)
+    timestamp_errors = np.logical_and(
+      np.logical_not(readable_array),
+      quality_assurance_array == Timestamp.QA_READ)
 
-      count_len_positions = np.add(offsets, count_len_positions)
+    num_timestamp_errors = np.count_nonzero(timestamp_errors)
 
-      count_len_digits = digits[l_idx:r_idx][count_len_positions]
-
-      unique_count_idx = unique_count_indices[i]
-
-      for j in range(unique_count_idx, unique_count_idx + unique_count_count):
-        timestamp_string_array[j] = ''.join(
-          count_len_digits[j - unique_count_idx])
-
-    return timestamp_string_array, np.zeros((num_timestamps,), dtype=np.uint8)
+    if num_timestamp_errors > 0:
+      logging.warning(
+        '{} timestamps could not be read nor synthesized and will'
+        ' be placeheld using the QA value -1.'.format(num_timestamp_errors))
+
+    timestamp_array = timestamp_array.astype(np.int32)
+    timestamp_array[timestamp_errors] = -1  # for quality control
+    quality_assurance_array[timestamp_errors] = Timestamp.QA_UNREADABLE
+
+    return timestamp_array, quality_assurance_array
+
+  def _reconstruct_timestamps(self, timestamp_array, readable_array,
+                              first_index=0):
+    # timestamp_array and readable_array begin at frame first_index
+    num_timestamps = timestamp_array.shape[0]
+    num_reconstructable = max(min(
+      num_timestamps,
+      self.presentation_timestamp_array.shape[0] - first_index), 0)
+
+    if num_reconstructable == 0:
+      return self._finalize_read_timestamps(timestamp_array, readable_array)
+
+    presentation_timestamps = self.presentation_timestamp_array[
+                              first_index:first_index + num_reconstructable]
+    anchor_readable_array = readable_array[:num_reconstructable]
+    anchor_indices = np.flatnonzero(anchor_readable_array)
+
+    if anchor_indices.shape[0] == 0:
+      logging.warning('no anchor timestamps could be read, so none can be '
+                      'reconstructed from PTS')
+      return self._finalize_read_timestamps(timestamp_array, readable_array)
+
+    logging.debug('read {} anchor timestamps to reconstruct {} '
+                  'frames'.format(anchor_indices.shape[0], num_reconstructable))
+
+    # every frame is reconstructed from the nearest readable anchor at or
+    # before it, or from the first readable anchor if there is none
+    reference_indices = np.maximum.accumulate(np.where(
+      anchor_readable_array, np.arange(num_reconstructable), -1))
+    reference_indices[reference_indices < 0] = anchor_indices[0]
+
+    reconstructed_array = timestamp_array[reference_indices].astype(
+      np.int64) + np.rint(presentation_timestamps -
+                          presentation_timestamps[reference_indices]).astype(
+      np.int64)
+
+    quality_assurance_array = np.where(
+      anchor_readable_array, Timestamp.QA_READ,
+      Timestamp.QA_PTS_RECONSTRUCTED).astype(np.uint8)
+
+    # flag every frame reconstructed from an anchor whose successor was read
+    # as something other than what PTS predicted
+    left_indices = anchor_indices[:-1]
+    right_indices = anchor_indices[1:]
+
+    predicted_timestamps = timestamp_array[left_indices].astype(
+      np.int64) + np.rint(presentation_timestamps[right_indices] -
+                          presentation_timestamps[left_indices]).astype(
+      np.int64)
+
+    disagreements = np.abs(
+      predicted_timestamps - timestamp_array[right_indices].astype(np.int64)) \
+                    > Timestamp.pts_tolerance
+
+    if np.any(disagreements):
+      logging.warning('PTS disagreed with the timestamps read at {} of {} '
+                      'anchors'.format(np.count_nonzero(disagreements),
+                                       right_indices.shape[0]))
+
+      boundaries = np.zeros((num_reconstructable + 1,), dtype=np.int64)
+      np.add.at(boundaries, left_indices[disagreements] + 1, 1)
+      np.add.at(boundaries, right_indices[disagreements], -1)
+
+      disagreement_array = np.logical_and(
+        np.cumsum(boundaries[:-1]) > 0, np.logical_not(anchor_readable_array))
+      quality_assurance_array[disagreement_array] = \
+        Timestamp.QA_PTS_DISAGREEMENT
+
+    if num_reconstructable < num_timestamps:
+      logging.warning('{} frames have no PTS, so their timestamps will be read '
+                      'instead of reconstructed'.format(
+        num_timestamps - num_reconstructable))
+
+      remaining_timestamp_array, remaining_quality_assurance_array = \
+        self._finalize_read_timestamps(
+          timestamp_array[num_reconstructable:],
+          readable_array[num_reconstructable:])
+
+      reconstructed_array = np.concatenate(
+        (reconstructed_array, remaining_timestamp_array))
+      quality_assurance_array = np.concatenate(
+        (quality_assurance_array, remaining_quality_assurance_array))
+
+    return reconstructed_array.astype(np.int32), quality_assurance_array
+
+  def finalize(self, num_timestamps=None, first_index=0):
+    """Return the timestamps and QA flags of all frames received so far.
+
+    Timestamps are returned as int32 and QA flags as uint8. If num_timestamps
+    is given, only the first num_timestamps frames are finalized, and if
+    first_index is given, only the frames from first_index on are returned.
+
+    Frames up to and including the last readable frame are only finalized
+    once. Later calls return the same values, including the random order of
+    synthesized steps, and only finalize the frames that follow, so frames
+    can be finalized as they arrive at a cost proportional to their number.
+    Frames before num_settled_timestamps are finalized the same way
+    regardless of how many frames follow them.
+
+    A frame is readable if at least one digit was recognized and it has at
+    least as many digits as every frame before it. Timestamps of unreadable
+    frames are synthesized from their readable neighbors where possible, and
+    placeheld using -1 otherwise. If presentation timestamps were given to
+    begin(), timestamps are instead reconstructed from readable anchors.
+    """
+    if num_timestamps is None:
+      num_timestamps = self.num_timestamps
+    else:
+      num_timestamps = min(num_timestamps, self.num_timestamps)
+
+    first_index = min(first_index, num_timestamps)
+
+    num_finalized_timestamps = self.num_finalized_timestamps
+
+    if num_timestamps <= num_finalized_timestamps:
+      return \
+        self.finalized_timestamp_array[first_index:num_timestamps].copy(), \
+        self.quality_assurance_array[first_index:num_timestamps].copy()
+
+    # finalization resumes from the last readable frame finalized before,
+    # which bounds every run of unreadable frames that follows it, and has at
+    # least as many digits as every frame before it
+    resume_index = max(num_finalized_timestamps - 1, 0)
+
+    timestamp_array = self.timestamp_array[resume_index:num_timestamps]
+    digit_count_array = self.digit_count_array[resume_index:num_timestamps]
+
+    # timestamp string lengths should be monotonically non-decreasing, so a
+    # frame with fewer digits than its predecessors has an unreadable digit
+    readable_array = np.logical_and(
+      digit_count_array > 0,
+      digit_count_array >= np.maximum.accumulate(digit_count_array))
+
+    num_inexact_timestamps = np.count_nonzero(
+      self.match_distance_array[resume_index:num_timestamps])
+
+    if num_inexact_timestamps > 0:
+      logging.debug('{} timestamps were read with at least one digit that did '
+                    'not exactly match its mask'.format(num_inexact_timestamps))
+
+    if self.anchor_array is None:
+      timestamp_array, quality_assurance_array = \
+        self._finalize_read_timestamps(timestamp_array, readable_array)
+    else:
+      timestamp_array, quality_assurance_array = \
+        self._reconstruct_timestamps(
+          timestamp_array, readable_array, resume_index)
+
+    readable_indices = np.flatnonzero(readable_array)
+
+    if readable_indices.shape[0] > 0:
+      num_settled_timestamps = resume_index + readable_indices[-1] + 1
+
+      if num_settled_timestamps > num_finalized_timestamps:
+        self.finalized_timestamp_array[
+          num_finalized_timestamps:num_settled_timestamps] = timestamp_array[
+          num_finalized_timestamps - resume_index:
+          num_settled_timestamps - resume_index]
+        self.quality_assurance_array[
+          num_finalized_timestamps:num_settled_timestamps] = \
+          quality_assurance_array[num_finalized_timestamps - resume_index:
+                                  num_settled_timestamps - resume_index]
+        self.num_finalized_timestamps = num_settled_timestamps
+
+    if first_index < num_finalized_timestamps:
+      return np.concatenate(
+        (self.finalized_timestamp_array[first_index:num_finalized_timestamps],
+         timestamp_array[num_finalized_timestamps - resume_index:])), \
+        np.concatenate(
+          (self.quality_assurance_array[first_index:num_finalized_timestamps],
+           quality_assurance_array[num_finalized_timestamps - resume_index:]))
+
+    return timestamp_array[first_index - resume_index:], \
+           quality_assurance_array[first_index - resume_index:]
+
+  def get_match_distances(self):
+    """Return how confidently the timestamp of each frame was read.
+
+    Returns:
+      A uint8 array holding, for each frame received so far, the largest
+      number of pixels in which one of its recognized digit cells differs from
+      its digit mask. 0 means every digit matched exactly.
+    """
+    return self.match_distance_array[:self.num_timestamps].copy()
 
-  def stringify_timestamps(self, timestamp_image_array):
+  # (16 * nt, 16 * nd, nc)
+  def stringify_timestamps(self, timestamp_image_array, batch_size=1024):
     num_timestamps = int(timestamp_image_array.shape[0] / self.height)
 
-    try:
-      timestamp_string_array, quality_assurance_array = \
-        self._stringify_timestamps(
-          timestamp_image_array, num_timestamps)
-      return timestamp_string_array, quality_assurance_array
-    except Exception as e:
-      logging.warning('encountered an exception while converting timestamp '
-                      'images to strings en masse')
-      logging.warning(e)
-      logging.warning('will re-attempt conversions one-at-a-time')
-
-    try:
-      # slower, but will isolate and gracefully handle individual failures
-      timestamp_string_array, quality_assurance_array = \
-        self._stringify_timestamps_per_frame(
-          timestamp_image_array, num_timestamps)
-
-      return timestamp_string_array, quality_assurance_array
-    except Exception as e:
-      logging.debug('encountered an exception while converting '
-                    'timestamp images to strings one-at-a-time.')
-      logging.debug('will raise exception to caller')
-
-      raise e
+    # (nt, 16, 16 * nd, nc)
+    timestamp_image_array = np.reshape(
+      timestamp_image_array[:num_timestamps * self.height],
+      (num_timestamps, self.height) + timestamp_image_array.shape[1:])
 
+    self.begin(num_timestamps)
 
+    for i in range(0, num_timestamps, batch_size):
+      self.update(timestamp_image_array[i:i + batch_size])
 
+    return self.finalize()
@@ -0,0 +1,181 @@
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+  """Compute the intersection over union of every pair of boxes.
+
+  Args:
+    boxes_a: float array. (n, 4) boxes with corners in the order
+      [x0, y0, x1, y1] or [y0, x0, y1, x1].
+    boxes_b: float array. (m, 4) boxes in the same order.
+
+  Returns:
+    An (n, m) float64 array.
+  """
+  boxes_a = np.asarray(boxes_a, dtype=np.float64)
+  boxes_b = np.asarray(boxes_b, dtype=np.float64)
+
+  top_left = np.maximum(boxes_a[:, np.newaxis, :2], boxes_b[:, :2])
+  bottom_right = np.minimum(boxes_a[:, np.newaxis, 2:], boxes_b[:, 2:])
+
+  intersections = np.prod(np.maximum(bottom_right - top_left, 0), axis=2)
+
+  areas_a = np.prod(np.maximum(boxes_a[:, 2:] - boxes_a[:, :2], 0), axis=1)
+  areas_b = np.prod(np.maximum(boxes_b[:, 2:] - boxes_b[:, :2], 0), axis=1)
+
+  unions = areas_a[:, np.newaxis] + areas_b - intersections
+
+  with np.errstate(invalid='ignore', divide='ignore'):
+    return np.where(unions > 0, intersections / unions, 0.)
+
+
+def match_greedy(ious, iou_threshold):
+  """Match rows to columns one-to-one, in descending order of intersection
+  over union.
+
+  Returns:
+    A list of (row index, column index) pairs.
+  """
+  candidate_pairs = np.argwhere(ious >= iou_threshold)
+  candidate_pairs = candidate_pairs[np.argsort(
+    -ious[candidate_pairs[:, 0], candidate_pairs[:, 1]], kind='stable')]
+
+  matched_rows = set()
+  matched_columns = set()
+  matches = []
+
+  for row_index, column_index in candidate_pairs.tolist():
+    if row_index not in matched_rows and column_index not in matched_columns:
+      matched_rows.add(row_index)
+      matched_columns.add(column_index)
+      matches.append((row_index, column_index))
+
+  return matches
+
+
+def track_detections(frame_numbers, boxes, iou_threshold=0.3,
+                     max_missed_frames=1):
+  """Group detections into tracks by matching the boxes of each frame to the
+  last boxes of tracks that were detected in the previous frame, or that have
+  missed no more than max_missed_frames frames since.
+
+  Args:
+    frame_numbers: int array. The frame of each detection, in ascending order.
+    boxes: float array. (n, 4) detection boxes.
+    iou_threshold: float. The minimum intersection over union at which a
+      detection continues a track.
+    max_missed_frames: int. The number of consecutive frames in which a track
+      may go undetected and still be continued.
+
+  Returns:
+    An int64 array of track ids, numbered from 0 in order of each track's first
+    detection.
+  """
+  frame_numbers = np.asarray(frame_numbers, dtype=np.int64)
+  num_detections = frame_numbers.shape[0]
+
+  track_ids = np.empty(num_detections, dtype=np.int64)
+
+  if num_detections == 0:
+    return track_ids
+
+  frame_starts = np.flatnonzero(
+    np.diff(frame_numbers, prepend=frame_numbers[0] - 1))
+  frame_ends = np.append(frame_starts[1:], num_detections)
+
+  # there can be no more tracks than detections
+  track_boxes = np.empty((num_detections, 4), dtype=np.float64)
+  track_frame_numbers = np.empty(num_detections, dtype=np.int64)
+
+  active_track_ids = np.zeros(0, dtype=np.int64)
+  num_tracks = 0
+
+  for frame_start, frame_end in zip(frame_starts.tolist(),
+                                    frame_ends.tolist()):
+    frame_number = frame_numbers[frame_start]
+    frame_boxes = boxes[frame_start:frame_end]
+
+    active_track_ids = active_track_ids[
+      track_frame_numbers[active_track_ids]
+      >= frame_number - 1 - max_missed_frames]
+
+    frame_track_ids = np.full(frame_end - frame_start, -1, dtype=np.int64)
+
+    if active_track_ids.shape[0] > 0:
+      for track_index, detection_index in match_greedy(
+          box_iou(track_boxes[active_track_ids], frame_boxes), iou_threshold):
+        frame_track_ids[detection_index] = active_track_ids[track_index]
+
+    is_new_track = frame_track_ids < 0
+    num_new_tracks = int(np.count_nonzero(is_new_track))
+
+    new_track_ids = np.arange(num_tracks, num_tracks + num_new_tracks)
+    frame_track_ids[is_new_track] = new_track_ids
+    num_tracks += num_new_tracks
+
+    track_boxes[frame_track_ids] = frame_boxes
+    track_frame_numbers[frame_track_ids] = frame_number
+    active_track_ids = np.concatenate([active_track_ids, new_track_ids])
+
+    track_ids[frame_start:frame_end] = frame_track_ids
+
+  return track_ids
+
+
+def summarize_tracks(track_ids, frame_numbers, timestamps, classifications):
+  """Reduce the detections of each track to one signal state event.
+
+  Args:
+    track_ids: int array. As returned by track_detections.
+    frame_numbers: int array. In ascending order.
+    timestamps: int array. The timestamp of each detection, or None.
+    classifications: str array. The state of each detection.
+
+  Returns:
+    A dict of columns with one element per track, in order of track id:
+    'start_frame_number', 'end_frame_number', 'start_timestamp' and
+    'end_timestamp' (None if timestamps is None), 'num_detections', and
+    'classification', the state that the track was detected in most often.
+  """
+  num_detections = track_ids.shape[0]
+
+  if num_detections == 0:
+    empty_timestamps = None if timestamps is None else timestamps[:0]
+
+    return {'start_frame_number': frame_numbers[:0],
+            'end_frame_number': frame_numbers[:0],
+            'start_timestamp': empty_timestamps,
+            'end_timestamp': empty_timestamps,
+            'num_detections': np.zeros(0, dtype=np.int64),
+            'classification': classifications[:0]}
+
+  num_tracks = int(track_ids.max()) + 1
+
+  # a stable sort keeps each track's detections in frame order
+  detection_order = np.argsort(track_ids, kind='stable')
+  track_starts = np.searchsorted(
+    track_ids[detection_order], np.arange(num_tracks))
+  track_ends = np.append(track_starts[1:], num_detections)
+
+  first_detections = detection_order[track_starts]
+  last_detections = detection_order[track_ends - 1]
+
+  class_names, class_indices = np.unique(
+    classifications, return_inverse=True)
+  class_counts = np.bincount(
+    track_ids * len(class_names) + class_indices.ravel(),
+    minlength=num_tracks * len(class_names)).reshape(
+    (num_tracks, len(class_names)))
+
+  if timestamps is None:
+    start_timestamps = end_timestamps = None
+  else:
+    start_timestamps = timestamps[first_detections]
+    end_timestamps = timestamps[last_detections]
+
+  return {'start_frame_number': frame_numbers[first_detections],
+          'end_frame_number': frame_numbers[last_detections],
+          'start_timestamp': start_timestamps,
+          'end_timestamp': end_timestamps,
+          'num_detections': track_ends - track_starts,
+          'classification': class_names[np.argmax(class_counts, axis=1)]}
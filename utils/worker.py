@@ -0,0 +1,342 @@
+from collections import deque
+from concurrent.futures import Future
+import logging
+import multiprocessing
+import os
+from queue import Empty
+import signal
+from threading import Lock, Thread
+from time import time
+from utils.io import IO
+
+# workers are started from the dispatcher thread of a multi-threaded process,
+# which is not safe to fork
+_context = multiprocessing.get_context('spawn')
+
+
+def get_queue():
+  """Create a queue that can be shared with the workers of a WorkerPool."""
+  return _context.Queue()
+
+
+class _TaskQueue:
+  """Stands in for the return code or log queue of a single video, so that
+  process_video can be called repeatedly in one worker. Items are forwarded to
+  a queue shared by the pool, prefixed with tag if given, and neither the None
+  that ends a video's log nor a close call ends the shared queue."""
+  def __init__(self, queue, tag=None):
+    self.queue = queue
+    self.tag = tag
+
+  def put(self, item, block=True, timeout=None):
+    if item is None:
+      return
+
+    if self.tag is not None:
+      item = self.tag + (item,)
+
+    self.queue.put(item, block, timeout)
+
+  def put_nowait(self, item):
+    self.put(item, block=False)
+
+  def close(self):
+    pass
+
+
+def _run_worker(worker_id, task_queue, message_queue, log_queue,
+                max_num_tasks, creation_time, initializer, initargs):
+  # the pool is shut down by the main process, and each video's processor
+  # handles interrupts of its own
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+  if initializer is not None:
+    initializer(*initargs)
+
+  # the cost of starting a process per video: the process itself, importing
+  # the processor (which happens as initializer is unpickled) and initializing
+  message_queue.put(('ready', worker_id, None, time() - creation_time))
+
+  num_tasks = 0
+
+  while max_num_tasks <= 0 or num_tasks < max_num_tasks:
+    task = task_queue.get()
+
+    if task is None:
+      break
+
+    start = time()
+
+    task_id, target, leading_args, trailing_args = task
+
+    return_code_queue = _TaskQueue(message_queue, ('result', worker_id, task_id))
+
+    args = leading_args + (return_code_queue, _TaskQueue(log_queue)) \
+           + trailing_args
+
+    target_start = time()
+
+    try:
+      target(*args)
+    except Exception as e:
+      return_code_queue.put({'return_code': 'exception',
+                             'return_value': str(e)})
+
+    target_end = time()
+
+    # memoized results must not outlive the video they were computed for
+    IO.clear_smoothed_probs_cache()
+
+    num_tasks += 1
+
+    # the cost of running a video in a running worker rather than a new
+    # process: unpacking the task, and cleaning up after it
+    message_queue.put(('done', worker_id, task_id,
+                       (target_start - start) + (time() - target_end)))
+
+  message_queue.put(('exit', worker_id, None, None))
+
+
+class WorkerPool:
+  def __init__(self, num_workers, log_queue, max_num_tasks_per_worker=0,
+               initializer=None, initargs=(), liveness_check_interval=1):
+    """Create a new 'WorkerPool' object.
+
+    Starts num_workers long-lived processes that each import the processor,
+    and keep their model server channels, for as long as they run, rather
+    than paying for a new process per video.
+
+    Args:
+      log_queue: Queue. The queue, created by get_queue, to which workers
+        forward log records.
+      max_num_tasks_per_worker: int. The number of tasks after which a worker
+        is replaced, to bound the memory that it may leak. Workers are never
+        replaced if 0.
+      initializer: function. Called with initargs in each worker as it
+        starts, e.g. to open model server channels.
+      liveness_check_interval: float. The number of seconds between checks
+        for workers that have died.
+    """
+    self.num_workers = num_workers
+    self.log_queue = log_queue
+    self.max_num_tasks_per_worker = max_num_tasks_per_worker
+    self.initializer = initializer
+    self.initargs = initargs
+    self.liveness_check_interval = liveness_check_interval
+
+    self.message_queue = _context.Queue()
+
+    # tasks are handed to a specific idle worker through its own queue, so the
+    # dispatcher always knows which task a worker holds
+    self.lock = Lock()
+    self.workers = {}
+    self.worker_task_queues = {}
+    self.worker_num_tasks = {}
+    self.worker_task_ids = {}
+    self.idle_worker_ids = deque()
+    self.pending_task_ids = deque()
+    self.tasks = {}
+    self.task_futures = {}
+    self.num_started_workers = 0
+    self.num_submitted_tasks = 0
+    self.is_closing = False
+
+    self.startup_durations = []
+    self.task_overhead_durations = []
+
+    for _ in range(num_workers):
+      self._start_worker()
+
+    self.dispatcher_thread = Thread(target=self._dispatch)
+    self.dispatcher_thread.start()
+
+  def _start_worker(self):
+    worker_id = self.num_started_workers
+    self.num_started_workers += 1
+
+    task_queue = _context.Queue()
+
+    worker = _context.Process(
+      target=_run_worker, name='worker-{}'.format(worker_id),
+      args=(worker_id, task_queue, self.message_queue, self.log_queue,
+            self.max_num_tasks_per_worker, time(), self.initializer,
+            self.initargs))
+    worker.start()
+
+    self.workers[worker_id] = worker
+    self.worker_task_queues[worker_id] = task_queue
+    self.worker_num_tasks[worker_id] = 0
+
+  def _finish_task(self, task_id, return_code_map):
+    with self.lock:
+      task_future = self.task_futures.pop(task_id, None)
+      self.tasks.pop(task_id, None)
+
+    if task_future is not None:
+      task_future.set_result(return_code_map)
+
+  def _assign_tasks(self):
+    while len(self.idle_worker_ids) > 0 and len(self.pending_task_ids) > 0:
+      worker_id = self.idle_worker_ids.popleft()
+      task_id = self.pending_task_ids.popleft()
+
+      with self.lock:
+        target, leading_args, trailing_args = self.tasks[task_id]
+
+      # the assignment is recorded before the worker can take up the task, so
+      # the task is failed if the worker dies at any point after
+      self.worker_task_ids[worker_id] = task_id
+      self.worker_task_queues[worker_id].put(
+        (task_id, target, leading_args, trailing_args))
+
+  def _remove_worker(self, worker_id, return_value):
+    worker = self.workers.pop(worker_id)
+    worker.join(timeout=15)
+
+    self.worker_task_queues.pop(worker_id).close()
+    self.worker_num_tasks.pop(worker_id)
+
+    if worker_id in self.idle_worker_ids:
+      self.idle_worker_ids.remove(worker_id)
+
+    task_id = self.worker_task_ids.pop(worker_id, None)
+
+    if task_id is not None:
+      self._finish_task(task_id, {'return_code': 'exception',
+                                  'return_value': return_value})
+
+    if not self.is_closing:
+      logging.debug('replacing worker {}'.format(worker.pid))
+      self._start_worker()
+
+  def _handle_message(self, message_type, worker_id, task_id, value):
+    if message_type == 'ready':
+      self.startup_durations.append(value)
+      self.idle_worker_ids.append(worker_id)
+    elif message_type == 'submit':
+      self.pending_task_ids.append(task_id)
+    elif message_type == 'result':
+      self._finish_task(task_id, value)
+    elif message_type == 'done':
+      self.worker_task_ids.pop(worker_id, None)
+      self.task_overhead_durations.append(value)
+      self._finish_task(task_id, {'return_code': 'exception',
+                                  'return_value': 'no return code'})
+
+      self.worker_num_tasks[worker_id] += 1
+
+      # a worker that has reached its limit exits rather than take a task
+      if self.max_num_tasks_per_worker <= 0 or self.worker_num_tasks[
+          worker_id] < self.max_num_tasks_per_worker:
+        self.idle_worker_ids.append(worker_id)
+    elif message_type == 'exit':
+      self._remove_worker(worker_id, 'worker exited before returning')
+    elif message_type == 'close':
+      for task_queue in self.worker_task_queues.values():
+        task_queue.put(None)
+
+  def _remove_dead_workers(self):
+    dead_worker_ids = [worker_id for worker_id, worker in self.workers.items()
+                       if not worker.is_alive()]
+
+    if len(dead_worker_ids) == 0:
+      return
+
+    # a dead worker's last messages (e.g. its result) may still be unread
+    while True:
+      try:
+        self._handle_message(*self.message_queue.get_nowait())
+      except Empty:
+        break
+
+    for worker_id in dead_worker_ids:
+      if worker_id in self.workers:
+        logging.warning('worker {} exited unexpectedly with code {}'.format(
+          self.workers[worker_id].pid, self.workers[worker_id].exitcode))
+        self._remove_worker(worker_id, 'worker exited unexpectedly')
+
+  def _dispatch(self):
+    last_liveness_check = time()
+
+    while not self.is_closing or len(self.workers) > 0:
+      try:
+        self._handle_message(*self.message_queue.get(
+          timeout=self.liveness_check_interval))
+      except Empty:
+        pass
+
+      # checked on a schedule rather than only when no messages arrive, so
+      # that a busy pool notices a dead worker promptly
+      if time() - last_liveness_check >= self.liveness_check_interval:
+        self._remove_dead_workers()
+        last_liveness_check = time()
+
+      if not self.is_closing:
+        self._assign_tasks()
+
+  def submit(self, target, leading_args, trailing_args):
+    """Queue a video for the next idle worker.
+
+    Args:
+      target: function. process_video or process_video_signalstate.
+      leading_args: tuple. The arguments that precede the return code and log
+        queues in target's signature.
+      trailing_args: tuple. The arguments that follow them.
+
+    Returns:
+      A concurrent.futures.Future that resolves to the video's return code
+      dict.
+    """
+    task_future = Future()
+
+    with self.lock:
+      task_id = self.num_submitted_tasks
+      self.num_submitted_tasks += 1
+      self.task_futures[task_id] = task_future
+      self.tasks[task_id] = (target, leading_args, trailing_args)
+
+    self.message_queue.put(('submit', None, task_id, None))
+
+    return task_future
+
+  def get_startup_summary(self):
+    """Compare the time that a new worker takes to start, import the
+    processor and initialize, i.e. the cost of a process per video, with the
+    overhead of running a video in a worker that is already running.
+
+    Returns:
+      A tuple of the mean worker startup duration, the mean per-video
+      overhead, and the number of videos run.
+    """
+    startup_durations = list(self.startup_durations)
+    task_overhead_durations = list(self.task_overhead_durations)
+
+    mean_startup_duration = sum(startup_durations) / len(startup_durations) \
+      if len(startup_durations) > 0 else 0.
+    mean_task_overhead_duration = sum(task_overhead_durations) / len(
+      task_overhead_durations) if len(task_overhead_durations) > 0 else 0.
+
+    return mean_startup_duration, mean_task_overhead_duration, \
+           len(task_overhead_durations)
+
+  def close(self):
+    self.is_closing = True
+
+    self.message_queue.put(('close', None, None, None))
+
+    self.dispatcher_thread.join(timeout=30)
+
+    for worker in list(self.workers.values()):
+      if worker.is_alive():
+        logging.warning('worker {} remained alive following shutdown and had '
+                        'to be killed'.format(worker.pid))
+        os.kill(worker.pid, signal.SIGKILL)
+
+    with self.lock:
+      task_futures = list(self.task_futures.values())
+      self.task_futures = {}
+      self.tasks = {}
+
+    for task_future in task_futures:
+      task_future.set_result({'return_code': 'exception',
+                              'return_value': 'worker pool closed'})